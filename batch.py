@@ -0,0 +1,208 @@
+import os
+from collections import defaultdict
+from time import perf_counter
+
+from planner import DestinationModel
+from durability import DurableCopier, rename_noreplace, DEFAULT_DURABILITY
+from freespace import is_out_of_space, remove_partial_copy
+
+
+class BatchExecutor:
+    """Executes many moves at once, grouped by destination folder
+
+    Each destination folder is created once and listed once; unique names
+    are then resolved against that in-memory listing instead of probing the
+    filesystem per file. Within a folder, moves are ordered by source inode
+    for locality, and same-device moves are renames that never replace a
+    file. If another writer took a name since the listing, the move retries
+    under a fresh unique name. Cross-device moves the caller did not
+    reserve space for are checked against the destination's free space
+    first and skipped if they can't fit. Copies
+    at the "safe" and "paranoid" durability levels remove their sources
+    only after one fsync of the folder for the whole batch (see
+    durability.py), and only then are marked done in the journal.
+    """
+
+    def __init__(self, organizer, max_pending=10000):
+        self.organizer = organizer
+        self.max_pending = max_pending
+        self.model = DestinationModel()
+        self._pending = defaultdict(list)
+        self._pending_count = 0
+        self.reports = []
+
+    def add(self, src, destination, category, name=None, stat=None, reserved=False):
+        """Queue a move of src into the destination folder, optionally under a planned name
+
+        reserved means the caller already reserved the file's size with the
+        organizer's free space tracker. Queued moves are executed
+        automatically once max_pending is reached, so memory stays bounded
+        on very large sweeps.
+        """
+        self._pending[destination].append((src, name or os.path.basename(src), category, stat, reserved))
+        self._pending_count += 1
+        if self._pending_count >= self.max_pending:
+            self.run()
+
+    def __len__(self):
+        return self._pending_count
+
+    @property
+    def moved(self):
+        return sum(report["files"] for report in self.reports)
+
+    def run(self):
+        """Execute every queued move and return one report per destination folder"""
+        pending, self._pending = self._pending, defaultdict(list)
+        self._pending_count = 0
+        reports = [self._run_batch(destination, moves) for destination, moves in pending.items()]
+        self.reports.extend(reports)
+        return reports
+
+    def _stat_moves(self, moves):
+        stated = []
+        for src, name, category, stat, reserved in moves:
+            if stat is None:
+                try:
+                    stat = os.stat(src)
+                except FileNotFoundError:
+                    self.organizer.logger.warning(f"File not found: {src}. Skipping.")
+                    continue
+            stated.append((src, name, category, stat, reserved))
+        stated.sort(key=lambda move: move[3].st_ino)
+        return stated
+
+    def _run_batch(self, destination, moves):
+        organizer = self.organizer
+        logger = organizer.logger
+        metrics = organizer.metrics
+        started = perf_counter()
+        moved = failed = total_bytes = 0
+
+        try:
+            organizer.make_folders(destination)
+            destination_device = os.stat(destination).st_dev
+        except OSError as e:
+            logger.error(f"Failed to prepare destination folder {destination}. Reason: {e}")
+            return self._report(destination, 0, len(moves), 0, perf_counter() - started)
+
+        # Resolve every name first so the whole batch can be journaled with
+        # a single fsync before any file is touched
+        planned = []
+        journal = organizer.journal
+        free_space = organizer.free_space
+        for src, name, category, stat, reserved in self._stat_moves(moves):
+            if stat.st_dev != destination_device and not reserved:
+                if not free_space.reserve(destination, destination_device, stat.st_size):
+                    logger.error(f"Not enough free space in {destination} for {src}. Skipping.")
+                    failed += 1
+                    continue
+            dst = self.model.reserve(destination, name)
+            intent_id = journal.intent(src, dst, stat.st_size, stat.st_dev != destination_device) if journal else None
+            planned.append((src, name, dst, category, stat, intent_id))
+        if journal:
+            journal.sync()
+
+        durability = organizer.config.durability
+        copiers = {}
+        moved_ids = {}
+
+        def created(src, dst, inode):
+            if journal:
+                journal.copying(moved_ids[src], inode)
+
+        def committed(src, dst):
+            if journal:
+                journal.done(moved_ids.pop(src), dst)
+
+        throttle = organizer.throttle
+        for src, name, dst, category, stat, intent_id in planned:
+            if throttle is not None:
+                # Hold bulk moves while the machine is busy or on battery
+                throttle.wait()
+            if organizer.shutdown_flag:
+                break
+            same_device = stat.st_dev == destination_device
+            move_started = perf_counter()
+            try:
+                with organizer.device_scheduler.slot(stat.st_dev, destination_device, src, destination, stat.st_size):
+                    while True:
+                        try:
+                            if same_device:
+                                rename_noreplace(src, dst)
+                            else:
+                                level = durability.get(category, DEFAULT_DURABILITY)
+                                copier = copiers.get(level)
+                                if copier is None:
+                                    copier = copiers[level] = DurableCopier(level, committed, on_create=created)
+                                moved_ids[src] = intent_id
+                                try:
+                                    copier.move(src, dst)
+                                except BaseException:
+                                    moved_ids.pop(src, None)
+                                    raise
+                            break
+                        except FileExistsError:
+                            # Another writer took the name since the folder was listed
+                            dst = organizer.get_unique_file_path(destination, name)
+                            self.model.names(destination).add(os.path.basename(dst))
+                            if journal:
+                                journal.redirect(intent_id, dst)
+                                journal.sync()
+                    if not same_device:
+                        organizer.restore_owner(dst, (stat.st_uid, stat.st_gid))
+            except FileNotFoundError:
+                if not same_device:
+                    free_space.release(destination_device, stat.st_size)
+                logger.warning(f"File not found: {src}. Skipping.")
+                failed += 1
+                continue
+            except Exception as e:
+                if not same_device:
+                    free_space.release(destination_device, stat.st_size)
+                    if is_out_of_space(e):
+                        remove_partial_copy(src, dst)
+                        free_space.exhausted(destination_device)
+                logger.error(f"Failed to move file: {src}. Reason: {e}")
+                failed += 1
+                continue
+            if journal:
+                if same_device:
+                    # Synced with the rest of the group: recovery already
+                    # treats a renamed file whose source name is back as done
+                    journal.done(intent_id, dst)
+                elif src not in moved_ids:
+                    # A "fast" copy already removed its source. Make "done"
+                    # durable before a new file can take the source name, or
+                    # recovery would roll the copy back
+                    journal.sync()
+            metrics.move_duration.labels('same' if same_device else 'cross').observe(perf_counter() - move_started)
+            metrics.bytes_moved.labels(category).inc(stat.st_size)
+            metrics.files_moved.labels(category).inc()
+            logger.info(f"Moved file: {src} to {dst}")
+            moved += 1
+            total_bytes += stat.st_size
+        for copier in copiers.values():
+            try:
+                copier.commit()
+            except OSError as e:
+                # The copies stay next to their sources; recovery resolves them
+                logger.error(f"Failed to commit copies to {destination}. Reason: {e}")
+        if journal:
+            journal.sync()
+
+        return self._report(destination, moved, failed, total_bytes, perf_counter() - started)
+
+    def _report(self, destination, moved, failed, total_bytes, seconds):
+        report = {
+            "destination": destination,
+            "files": moved,
+            "failed": failed,
+            "bytes": total_bytes,
+            "seconds": seconds,
+            "files_per_second": moved / seconds if seconds > 0 else None,
+        }
+        self.organizer.logger.info(
+            f"Batch to {destination}: {moved} files ({failed} failed) in {seconds:.3f}s"
+            + (f", {report['files_per_second']:.0f} files/s" if report['files_per_second'] else ""))
+        return report
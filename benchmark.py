@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""Synthetic-downloads benchmarks for the organizer engines.
+
+Generates a reproducible download tree and runs each engine headlessly,
+printing JSON results that can be compared across commits:
+
+    python benchmark.py --files 10000 --output before.json
+    python benchmark.py --files 10000 --output after.json
+    python benchmark.py --compare before.json after.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import traceback
+import subprocess
+import multiprocessing
+from queue import Empty
+from argparse import Namespace
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CATEGORY_EXTENSIONS = {
+    "Documents": [".pdf", ".docx", ".txt", ".xlsx"],
+    "Apps": [".exe", ".msi"],
+    "Images": [".png", ".jpg", ".jpeg", ".webp"],
+    "Videos": [".mp4", ".mkv", ".mov"],
+    "Archives": [".zip", ".rar", ".tar.gz", ".iso"],
+    "Music": [".mp3", ".flac"],
+}
+
+DEFAULT_EXTENSION_MIX = {
+    ".pdf": 12, ".docx": 6, ".txt": 6, ".xlsx": 3,
+    ".exe": 3, ".msi": 1,
+    ".png": 10, ".jpg": 14, ".jpeg": 3, ".webp": 2,
+    ".mp4": 4, ".mkv": 1, ".mov": 1,
+    ".zip": 8, ".rar": 1, ".tar.gz": 2, ".iso": 1,
+    ".mp3": 4, ".flac": 1,
+    ".json": 3, ".md": 2, ".bin": 5,
+}
+
+ENGINES = ["mover", "unique_path", "sweep", "stats", "dupes", "scan_paths", "scan_table", "metadata", "durability"]
+
+
+def parse_extension_mix(text):
+    """Parse '.pdf=3,.jpg=5' into a weight mapping"""
+    mix = {}
+    for part in text.split(","):
+        ext, _, weight = part.partition("=")
+        mix[ext.strip()] = float(weight or 1)
+    return mix
+
+
+def parse_size_distribution(text):
+    """Parse 'fixed:N', 'uniform:MIN-MAX' or 'lognormal:MEDIAN' into a sampler"""
+    kind, _, spec = text.partition(":")
+    if kind == "fixed":
+        size = int(spec or 4096)
+        return lambda rng: size
+    if kind == "uniform":
+        low, _, high = (spec or "0-65536").partition("-")
+        low, high = int(low), int(high)
+        return lambda rng: rng.randint(low, high)
+    if kind == "lognormal":
+        import math
+        mu = math.log(int(spec or 16384))
+        return lambda rng: int(rng.lognormvariate(mu, 1.5))
+    raise ValueError(f"Unknown size distribution: {text}")
+
+
+def build_config(root):
+    downloads_folder = os.path.join(root, "Downloads")
+    folders = {category: os.path.join(downloads_folder, category) for category in CATEGORY_EXTENSIONS}
+    folders["Other"] = os.path.join(downloads_folder, "Other")
+    return {
+        "downloads_folder": downloads_folder,
+        "folders": folders,
+        "default_folder_mappings": {".md": "Documents", ".json": "Documents"},
+        "file_types": dict(CATEGORY_EXTENSIONS),
+        "notifications": False,
+        "retry_attempts": 1,
+        "retry_delay": 0,
+        # Measure the built-in rules, not whatever plugins the user has installed
+        "plugins": {"enabled": False},
+        # Timings shouldn't depend on the machine's load or battery
+        "throttle": {"enabled": False},
+    }
+
+
+def generate_tree(root, files, seed=0, sizes="lognormal:16384", max_size=1024 * 1024,
+                  extension_mix=None, collision_rate=0.0, duplicate_ratio=0.0, layout="downloads"):
+    """Create a synthetic download tree under root and return its config
+
+    layout="downloads" puts every file directly in the downloads folder, as
+    the mover sees them; layout="organized" puts them in their category
+    folders, as the statistics and duplicate scanners see them.
+    collision_rate is the fraction of files that already have a same-named
+    file at their destination; duplicate_ratio is the fraction of files
+    whose content copies an earlier file.
+    """
+    rng = random.Random(seed)
+    sample_size = parse_size_distribution(sizes)
+    mix = extension_mix or DEFAULT_EXTENSION_MIX
+    extensions, weights = list(mix), list(mix.values())
+
+    config = build_config(root)
+    for folder in config["folders"].values():
+        os.makedirs(folder, exist_ok=True)
+    config_path = os.path.join(root, "config.json")
+    with open(config_path, "w") as file:
+        json.dump(config, file, indent=4)
+
+    category_for = {".md": "Documents", ".json": "Documents"}
+    for category, category_extensions in CATEGORY_EXTENSIONS.items():
+        for ext in category_extensions:
+            category_for[ext] = category
+
+    # Content is derived from a per-file seed, so duplicates only need to
+    # remember which seed and size to reuse instead of the bytes themselves.
+    contents = []
+    for i in range(files):
+        ext = rng.choices(extensions, weights)[0]
+        name = f"download_{i:07d}{ext}"
+        destination = config["folders"][category_for.get(ext, "Other")]
+        if contents and rng.random() < duplicate_ratio:
+            content_seed, size = contents[rng.randrange(len(contents))]
+        else:
+            content_seed, size = rng.getrandbits(32), min(sample_size(rng), max_size)
+            if len(contents) < 4096:
+                contents.append((content_seed, size))
+        data = random.Random(content_seed).randbytes(size)
+
+        folder = config["downloads_folder"] if layout == "downloads" else destination
+        with open(os.path.join(folder, name), "wb") as file:
+            file.write(data)
+        if layout == "downloads" and rng.random() < collision_rate:
+            with open(os.path.join(destination, name), "wb") as file:
+                file.write(b"")
+
+    return config_path, config
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))
+    return samples[index]
+
+
+def make_organizer(config_path):
+    from script import FileOrganizer
+    args = Namespace(config=config_path, log_level="WARNING", log_to_file=False)
+    # Keep the journal and caches next to the generated tree, away from ~/.config/mfo
+    return FileOrganizer(args, state_dir=os.path.join(os.path.dirname(config_path), "state"))
+
+
+def run_mover(config_path, config):
+    downloads_folder = config["downloads_folder"]
+    with os.scandir(downloads_folder) as entries:
+        file_paths = [entry.path for entry in entries if entry.is_file()]
+    organizer = make_organizer(config_path)
+    latencies = []
+    try:
+        for file_path in file_paths:
+            started = time.perf_counter()
+            organizer.move_file(file_path)
+            latencies.append(time.perf_counter() - started)
+    finally:
+        organizer.close()
+    return len(file_paths), latencies
+
+
+def run_unique_path(config_path, config):
+    with os.scandir(config["downloads_folder"]) as entries:
+        names = [entry.name for entry in entries if entry.is_file()]
+    organizer = make_organizer(config_path)
+    latencies = []
+    count = 0
+    try:
+        for folder in config["folders"].values():
+            for name in names:
+                started = time.perf_counter()
+                organizer.get_unique_file_path(folder, name)
+                latencies.append(time.perf_counter() - started)
+                count += 1
+    finally:
+        organizer.close()
+    return count, latencies
+
+
+def run_sweep(config_path, config):
+    organizer = make_organizer(config_path)
+    try:
+        count = organizer.sweep()
+    finally:
+        organizer.close()
+    return count, []
+
+
+def run_stats(config_path, config):
+    from scanner import collect_statistics
+    stats = collect_statistics(config["folders"])
+    return sum(count for count, _ in stats.values()), []
+
+
+def run_dupes(config_path, config):
+    from scanner import find_duplicates
+    processed = [0]
+
+    def progress(processed_files, total_files):
+        processed[0] = processed_files
+
+    find_duplicates(list(config["folders"].values()), progress)
+    return processed[0], []
+
+
+def run_scan_paths(config_path, config):
+    # Baseline for scan_table: one path string and stat tuple per file,
+    # grouped in dicts of lists as the scanners used to keep them
+    entries = {}
+    for category, folder in config["folders"].items():
+        files = entries[category] = []
+        for root, _, names in os.walk(folder):
+            for name in names:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files.append((path, stat.st_size, stat.st_ino, stat.st_mtime_ns))
+    return sum(len(files) for files in entries.values()), []
+
+
+def run_scan_table(config_path, config):
+    from filetable import FileTable
+    table = FileTable.scan(list(config["folders"].values()))
+    return len(table), []
+
+
+def write_media_headers(path, ext, rng):
+    """Give a generated file a real PDF, MP4 or JPEG container, keeping its random payload as the body"""
+    with open(path, "rb") as file:
+        payload = file.read()
+    if ext == ".pdf":
+        body = b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n1 0 obj\n<< /Type /Catalog >>\nendobj\n"
+        body += b"2 0 obj\n<< /Length %d >>\nstream\n" % len(payload) + payload + b"\nendstream\nendobj\n"
+        info_offset = len(body)
+        body += b"3 0 obj\n<< /Title (Invoice %d) /Author (Bench) /CreationDate (D:2021%02d01120000Z) >>\nendobj\n" % (
+            rng.randrange(10000), rng.randrange(1, 13))
+        xref_offset = len(body)
+        body += b"xref\n0 4\n0000000000 65535 f \n0000000015 00000 n \n0000000000 00000 f \n%010d 00000 n \n" % info_offset
+        body += b"trailer\n<< /Size 4 /Root 1 0 R /Info 3 0 R >>\nstartxref\n%d\n%%%%EOF\n" % xref_offset
+    elif ext in (".mp4", ".mov"):
+        # moov at the end, as most cameras and phones write it
+        created = 2082844800 + 1600000000 + rng.randrange(10 ** 8)
+        mvhd = b"\x00\x00\x00\x00" + created.to_bytes(4, "big") * 2 + (1000).to_bytes(4, "big") + (60000).to_bytes(4, "big")
+        mvhd += bytes(80)
+        moov = (16 + len(mvhd)).to_bytes(4, "big") + b"moov" + (8 + len(mvhd)).to_bytes(4, "big") + b"mvhd" + mvhd
+        body = (b"\x00\x00\x00\x14ftypisom\x00\x00\x02\x00isom"
+                + (8 + len(payload)).to_bytes(4, "big") + b"mdat" + payload + moov)
+    elif ext in (".jpg", ".jpeg"):
+        from PIL import Image
+        image = Image.new("RGB", (64, 48), (rng.randrange(256), 0, 0))
+        exif = Image.Exif()
+        exif[271], exif[272] = "Bench", "Camera"
+        exif.get_ifd(0x8769)[36867] = f"2020:{rng.randrange(1, 13):02d}:01 12:00:00"
+        image.save(path, "JPEG", exif=exif.tobytes())
+        with open(path, "ab") as file:
+            file.write(payload)
+        return
+    else:
+        return
+    with open(path, "wb") as file:
+        file.write(body)
+
+
+def run_metadata(config_path, config):
+    # Header extraction cost next to the move it happens in front of. A
+    # same-device move is a single rename, while extraction has to open and
+    # read the file, so extract_to_move_ratio stays near 1; against the copy
+    # a cross-device move makes (extract_to_copy_ratio) it is a small fraction
+    from metadata import MetadataExtractor
+    from durability import copy_file
+    extractor = MetadataExtractor()
+    rng = random.Random(0)
+    with os.scandir(config["downloads_folder"]) as entries:
+        file_paths = [entry.path for entry in entries if entry.is_file()]
+    media = []
+    for file_path in file_paths:
+        ext = os.path.splitext(file_path)[1]
+        if extractor.kind_of(file_path):
+            write_media_headers(file_path, ext, rng)
+            media.append(file_path)
+    copies = os.path.join(os.path.dirname(config_path), "copies")
+    os.makedirs(copies)
+    organizer = make_organizer(config_path)
+    latencies = []
+    extract_seconds = move_seconds = copy_seconds = 0.0
+    try:
+        for file_path in media:
+            started = time.perf_counter()
+            extractor.extract(file_path)
+            extracted = time.perf_counter()
+            copy_file(file_path, os.path.join(copies, os.path.basename(file_path)), "fast")
+            copied = time.perf_counter()
+            organizer.move_file(file_path)
+            moved = time.perf_counter()
+            latencies.append(extracted - started)
+            extract_seconds += extracted - started
+            copy_seconds += copied - extracted
+            move_seconds += moved - copied
+    finally:
+        organizer.close()
+    return len(media), latencies, {
+        "bytes_read_per_file": extractor.bytes_read / extractor.files if extractor.files else None,
+        "over_budget": extractor.over_budget,
+        "extract_to_move_ratio": extract_seconds / move_seconds if move_seconds > 0 else None,
+        "extract_to_copy_ratio": extract_seconds / copy_seconds if copy_seconds > 0 else None,
+    }
+
+
+def run_durability(config_path, config):
+    # Cost of each durability level for cross-device moves. The files are
+    # copied even though the copy stays on one filesystem, so run with
+    # --workdir on the disk you want to measure
+    from durability import DurableCopier, DURABILITY_LEVELS
+    downloads_folder = config["downloads_folder"]
+    with os.scandir(downloads_folder) as entries:
+        file_paths = [entry.path for entry in entries if entry.is_file()]
+    total_bytes = sum(os.path.getsize(file_path) for file_path in file_paths)
+    latencies = []
+    extra = {}
+    for level in DURABILITY_LEVELS:
+        staging = os.path.join(downloads_folder, f"staging-{level}")
+        target = os.path.join(downloads_folder, f"moved-{level}")
+        os.makedirs(staging)
+        os.makedirs(target)
+        sources = []
+        for file_path in file_paths:
+            sources.append(os.path.join(staging, os.path.basename(file_path)))
+            shutil.copyfile(file_path, sources[-1])
+        copier = DurableCopier(level)
+        started = time.perf_counter()
+        for src in sources:
+            move_started = time.perf_counter()
+            dst = os.path.join(target, os.path.basename(src))
+            if level == "fast":
+                # What shutil.move does across devices
+                shutil.copy2(src, dst)
+                os.unlink(src)
+            else:
+                copier.move(src, dst)
+            latencies.append(time.perf_counter() - move_started)
+        copier.commit()
+        elapsed = time.perf_counter() - started
+        extra[f"{level}_files_per_second"] = len(sources) / elapsed if elapsed > 0 else None
+        extra[f"{level}_mb_per_second"] = total_bytes / elapsed / (1024 * 1024) if elapsed > 0 else None
+    for level in DURABILITY_LEVELS[1:]:
+        if extra["fast_files_per_second"] and extra[f"{level}_files_per_second"]:
+            extra[f"{level}_slowdown"] = extra["fast_files_per_second"] / extra[f"{level}_files_per_second"]
+    return len(file_paths) * len(DURABILITY_LEVELS), latencies, extra
+
+
+ENGINE_RUNNERS = {
+    "mover": (run_mover, "downloads"),
+    "unique_path": (run_unique_path, "downloads"),
+    "sweep": (run_sweep, "downloads"),
+    "stats": (run_stats, "organized"),
+    "dupes": (run_dupes, "organized"),
+    "scan_paths": (run_scan_paths, "organized"),
+    "scan_table": (run_scan_table, "organized"),
+    "metadata": (run_metadata, "downloads"),
+    "durability": (run_durability, "downloads"),
+}
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def run_engine(engine, tree_options, workdir):
+    """Generate a fresh tree and run one engine on it, in the current process"""
+    runner, layout = ENGINE_RUNNERS[engine]
+    root = tempfile.mkdtemp(prefix=f"mfo-bench-{engine}-", dir=workdir)
+    try:
+        config_path, config = generate_tree(root, layout=layout, **tree_options)
+        started = time.perf_counter()
+        count, latencies, *extra = runner(config_path, config)
+        elapsed = time.perf_counter() - started
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    result = {
+        "engine": engine,
+        "files": count,
+        "seconds": elapsed,
+        "throughput": count / elapsed if elapsed > 0 else None,
+        "p50": percentile(latencies, 0.50),
+        "p99": percentile(latencies, 0.99),
+        "peak_rss_kb": peak_rss_kb(),
+    }
+    for fields in extra:
+        result.update(fields)
+    return result
+
+
+def _engine_worker(engine, tree_options, workdir, queue):
+    try:
+        queue.put(run_engine(engine, tree_options, workdir))
+    except BaseException:
+        queue.put({"engine": engine, "error": traceback.format_exc()})
+
+
+def run_isolated(engine, tree_options, workdir):
+    """Run an engine in a fresh process so peak RSS is measured per engine"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_engine_worker, args=(engine, tree_options, workdir, queue))
+    process.start()
+    while True:
+        try:
+            result = queue.get(timeout=1)
+            break
+        except Empty:
+            # A child killed before it could report anything
+            if process.exitcode is not None:
+                raise RuntimeError(f"The {engine} benchmark exited with code {process.exitcode} without a result")
+    process.join()
+    if "error" in result:
+        raise RuntimeError(f"The {engine} benchmark failed:\n{result['error']}")
+    return result
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def compare(before_path, after_path):
+    """Print throughput and latency deltas between two result files"""
+    with open(before_path) as file:
+        before = {result["engine"]: result for result in json.load(file)["results"]}
+    with open(after_path) as file:
+        after = {result["engine"]: result for result in json.load(file)["results"]}
+    for engine, new in after.items():
+        old = before.get(engine)
+        if old is None:
+            continue
+        line = [engine]
+        for key in ("throughput", "p50", "p99", "peak_rss_kb"):
+            if old.get(key) and new.get(key) is not None:
+                change = (new[key] - old[key]) / old[key] * 100
+                line.append(f"{key} {change:+.1f}%")
+        print("  ".join(line))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Messy File Organizer engines on synthetic downloads")
+    parser.add_argument('--files', type=int, default=1000, help='Number of files to generate (1k to 1M)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for reproducible trees')
+    parser.add_argument('--sizes', default='lognormal:16384',
+                        help="Size distribution: fixed:N, uniform:MIN-MAX or lognormal:MEDIAN")
+    parser.add_argument('--max-size', type=int, default=1024 * 1024, help='Upper bound for generated file sizes')
+    parser.add_argument('--extensions', type=parse_extension_mix, default=None,
+                        help="Extension mix as weights, e.g. '.pdf=3,.jpg=5,.bin=1'")
+    parser.add_argument('--collision-rate', type=float, default=0.1,
+                        help='Fraction of files that collide with an existing destination name')
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1,
+                        help='Fraction of files whose content duplicates another file')
+    parser.add_argument('--engines', default=",".join(ENGINES), help='Comma-separated engines to run')
+    parser.add_argument('--workdir', default=None, help='Directory for generated trees (e.g. /dev/shm for tmpfs)')
+    parser.add_argument('--output', default=None, help='Write JSON results to this file instead of stdout')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    tree_options = {
+        "files": args.files,
+        "seed": args.seed,
+        "sizes": args.sizes,
+        "max_size": args.max_size,
+        "extension_mix": args.extensions,
+        "collision_rate": args.collision_rate,
+        "duplicate_ratio": args.duplicate_ratio,
+    }
+    results = [run_isolated(engine, tree_options, args.workdir) for engine in args.engines.split(",")]
+    report = {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in tree_options.items()},
+        "results": results,
+    }
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+import threading
+
+
+class HashCache:
+    """Persistent sqlite cache of per-file hashes
+
+    Entries are keyed by (kind, path) and remembered together with the file's
+    inode, size and mtime; a lookup only hits if all three still match, so a
+    modified or replaced file is hashed again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "kind TEXT NOT NULL, path TEXT NOT NULL, inode INTEGER NOT NULL, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, value TEXT NOT NULL, PRIMARY KEY (kind, path))")
+        self._connection.commit()
+
+    def get(self, kind, path, stat=None):
+        """Return the cached value for path, or None if missing or stale"""
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT inode, size, mtime_ns, value FROM hashes WHERE kind = ? AND path = ?",
+                (kind, path)).fetchone()
+        if row is None or tuple(row[:3]) != (stat.st_ino, stat.st_size, stat.st_mtime_ns):
+            return None
+        return row[3]
+
+    def put(self, kind, path, stat, value):
+        self.put_many(kind, [(path, stat, value)])
+
+    def put_many(self, kind, entries):
+        """Store (path, stat, value) triples in a single transaction"""
+        rows = [(kind, path, stat.st_ino, stat.st_size, stat.st_mtime_ns, value) for path, stat, value in entries]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._connection.commit()
+
+    def prune(self, kind=None):
+        """Drop entries for files that no longer exist; return how many were removed"""
+        with self._lock:
+            if kind is None:
+                rows = self._connection.execute("SELECT kind, path FROM hashes").fetchall()
+            else:
+                rows = self._connection.execute("SELECT kind, path FROM hashes WHERE kind = ?", (kind,)).fetchall()
+        missing = [row for row in rows if not os.path.exists(row[1])]
+        with self._lock:
+            self._connection.executemany("DELETE FROM hashes WHERE kind = ? AND path = ?", missing)
+            self._connection.commit()
+        return len(missing)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
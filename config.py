@@ -0,0 +1,220 @@
+import os
+import json
+from types import MappingProxyType
+from sharding import ShardLayout
+from metadata import RoutingRule
+from durability import DURABILITY_LEVELS, DEFAULT_DURABILITY
+
+OBSERVER_KINDS = ("auto", "native", "polling")
+
+
+class ConfigError(ValueError):
+    """Raised when a configuration file is missing required settings"""
+
+
+def freeze(value):
+    """Return a deeply immutable copy of a JSON value (dicts become read-only mappings, lists tuples)"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def compile_extension_map(folders, file_types, default_folder_mappings):
+    """Precompute extension -> (category, destination), with the same precedence as the old lookup loops
+
+    file_types wins over default_folder_mappings, and the first category
+    listing an extension wins; a mapping to a category without a folder
+    keeps the category name but goes to the Other folder.
+    """
+    other = folders['Other']
+    extension_map = {}
+    for extension, category in default_folder_mappings.items():
+        extension_map[extension] = (category, folders.get(category, other))
+    seen = set()
+    for category, extensions in file_types.items():
+        for extension in extensions:
+            if extension not in seen:
+                seen.add(extension)
+                extension_map[extension] = (category, folders[category])
+    return MappingProxyType(extension_map)
+
+
+def _check_mapping(key, value, valid, expected):
+    if not isinstance(value, dict):
+        raise ConfigError(f"'{key}' must be a mapping")
+    for name, item in value.items():
+        if not valid(item):
+            raise ConfigError(f"'{key}' entry '{name}' must be {expected}")
+
+
+def _rules(name, path, options, defaults, index):
+    if not isinstance(options.get('folders', {}), dict):
+        raise ConfigError("'folders' must be a mapping")
+    folders = {**defaults['folders'], **options.get('folders', {})}
+    _check_mapping('folders', folders, lambda folder: isinstance(folder, str) and folder, "a folder path")
+    file_types = options.get('file_types', defaults['file_types'])
+    _check_mapping('file_types', file_types,
+                   lambda extensions: isinstance(extensions, list) and all(isinstance(ext, str) for ext in extensions),
+                   "a list of extensions")
+    default_folder_mappings = options.get('default_folder_mappings', defaults.get('default_folder_mappings', {}))
+    _check_mapping('default_folder_mappings', default_folder_mappings, lambda category: isinstance(category, str),
+                   "a category name")
+    if 'Other' not in folders:
+        raise ConfigError("'folders' must include an 'Other' folder")
+    for category in file_types:
+        if category not in folders:
+            raise ConfigError(f"File type category '{category}' has no entry in 'folders'")
+    sharding_specs = options.get('sharding', defaults.get('sharding', {}))
+    _check_mapping('sharding', sharding_specs, lambda spec: isinstance(spec, (str, dict)),
+                   "a scheme name or a mapping of options")
+    sharding = {}
+    for category, spec in sharding_specs.items():
+        try:
+            sharding[category] = ShardLayout.from_config(spec)
+        except (TypeError, ValueError, AttributeError) as e:
+            raise ConfigError(f"Invalid sharding for '{category}': {e}")
+    routing = []
+    for position, spec in enumerate(options.get('routing', defaults.get('routing', []))):
+        try:
+            rule = RoutingRule.from_config(spec)
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f"Invalid routing rule {position}: {e}")
+        if rule.category not in folders:
+            raise ConfigError(f"Routing rule {position} sends files to '{rule.category}', which has no entry in 'folders'")
+        routing.append(rule)
+    overflow_folders = options.get('overflow', defaults.get('overflow', {}))
+    _check_mapping('overflow', overflow_folders,
+                   lambda fallbacks: (isinstance(fallbacks, str) and fallbacks) or (
+                       isinstance(fallbacks, list) and all(isinstance(folder, str) and folder for folder in fallbacks)),
+                   "a folder or a list of folders")
+    overflow = {}
+    for category, fallbacks in overflow_folders.items():
+        if category not in folders:
+            raise ConfigError(f"Overflow folders given for '{category}', which has no entry in 'folders'")
+        overflow[category] = (fallbacks,) if isinstance(fallbacks, str) else tuple(fallbacks)
+    if name is not None and not (isinstance(name, str) and name):
+        raise ConfigError("'name' must be a non-empty string")
+    recursive = options.get('recursive', False)
+    if not isinstance(recursive, bool):
+        raise ConfigError("'recursive' must be true or false")
+    weight = options.get('weight', 1)
+    if isinstance(weight, bool) or not isinstance(weight, (int, float)) or not weight > 0:
+        raise ConfigError("'weight' must be a positive number")
+    observer = options.get('observer', defaults.get('observer', 'auto'))
+    if observer not in OBSERVER_KINDS:
+        raise ConfigError(f"Invalid observer {observer!r}; use one of {', '.join(OBSERVER_KINDS)}")
+    polling = options.get('polling', defaults.get('polling', {}))
+    _check_mapping('polling', polling,
+                   lambda interval: not isinstance(interval, bool) and isinstance(interval, (int, float)) and interval > 0,
+                   "a positive number of seconds")
+    return freeze({
+        "name": name or os.path.basename(os.path.normpath(path)) or f"source-{index}",
+        "path": path,
+        "recursive": recursive,
+        "weight": weight,
+        "observer": observer,
+        "polling": polling,
+        "folders": folders,
+        "file_types": file_types,
+        "default_folder_mappings": default_folder_mappings,
+        "sharding": sharding,
+        "routing": routing,
+        "overflow": overflow,
+    }), compile_extension_map(folders, file_types, default_folder_mappings)
+
+
+class ConfigSnapshot:
+    """Immutable, validated view of one version of the configuration file
+
+    The organizer swaps in a new snapshot on reload with a single
+    assignment, so a reader that takes one reference to it sees a
+    consistent config for as long as it holds it, without locking.
+    Raw settings are read with snapshot['key'] or snapshot.get('key');
+    sources are read-only mappings, each with a precompiled 'extension_map'
+    a 'sharding' mapping of category -> ShardLayout, a 'routing' tuple of
+    metadata RoutingRules and an 'overflow' mapping of category -> fallback
+    folders. durability maps every category to its durability level.
+    """
+
+    __slots__ = ("data", "sources", "source_by_name", "default_rules", "destination_prefixes",
+                 "retry_attempts", "retry_delay", "notifications", "settle_delay", "durability")
+
+    def __init__(self, data):
+        if not isinstance(data, dict):
+            raise ConfigError("The configuration must be a JSON object")
+        for key in ('folders', 'file_types'):
+            if not isinstance(data.get(key), dict):
+                raise ConfigError(f"Missing or invalid '{key}' setting")
+        if not data.get('sources') and 'downloads_folder' not in data:
+            raise ConfigError("Either 'downloads_folder' or 'sources' must be set")
+
+        set_ = object.__setattr__
+        set_(self, "data", freeze(data))
+        if not isinstance(data.get('downloads_folder', ''), str):
+            raise ConfigError("'downloads_folder' must be a folder path")
+        rules, extension_map = _rules("default", data.get('downloads_folder', ''), {}, data, 0)
+        set_(self, "default_rules", MappingProxyType({**rules, "extension_map": extension_map}))
+
+        configured = data.get('sources') or [{"name": "Downloads", "path": data['downloads_folder']}]
+        if not isinstance(configured, list):
+            raise ConfigError("'sources' must be a list")
+        sources = []
+        for index, source in enumerate(configured):
+            if not isinstance(source, dict) or not isinstance(source.get('path'), str):
+                raise ConfigError(f"Source {index} has no 'path'")
+            rules, extension_map = _rules(source.get('name'), source['path'], source, data, index)
+            # Sources are looked up and scheduled by name, so each needs its own
+            if any(other['name'] == rules['name'] for other in sources):
+                raise ConfigError(f"Source {index} is named '{rules['name']}' like an earlier source; give it a unique 'name'")
+            sources.append(MappingProxyType({**rules, "extension_map": extension_map}))
+        set_(self, "sources", tuple(sources))
+        set_(self, "source_by_name", MappingProxyType({source['name']: source for source in sources}))
+        # Destination folders are skipped when recursively watching or
+        # sweeping a source that contains them
+        set_(self, "destination_prefixes", tuple({
+            os.path.normpath(folder) + os.sep for source in sources for folder in source['folders'].values()
+        }))
+
+        try:
+            set_(self, "retry_attempts", int(data.get('retry_attempts', 3)))
+            set_(self, "retry_delay", float(data.get('retry_delay', 2)))
+            set_(self, "settle_delay", float(data.get('settle_delay', 5)))
+        except (TypeError, ValueError) as e:
+            raise ConfigError(f"Invalid retry or settle setting: {e}")
+        set_(self, "notifications", bool(data.get('notifications', True)))
+
+        # A single level for every category, or category -> level with the
+        # rest left at the default
+        categories = {category for source in sources for category in source['folders']}
+        durability = data.get('durability', DEFAULT_DURABILITY)
+        if isinstance(durability, str):
+            durability = {category: durability for category in categories}
+        if not isinstance(durability, dict):
+            raise ConfigError("'durability' must be a level or a mapping of category -> level")
+        for category, level in durability.items():
+            if level not in DURABILITY_LEVELS:
+                raise ConfigError(f"Invalid durability '{level}' for '{category}'; use one of {', '.join(DURABILITY_LEVELS)}")
+            if category not in categories:
+                raise ConfigError(f"Durability set for '{category}', which has no entry in 'folders'")
+        set_(self, "durability", MappingProxyType(
+            {category: durability.get(category, DEFAULT_DURABILITY) for category in categories}))
+
+    @classmethod
+    def load(cls, path):
+        """Read and validate a config file; raises OSError, ValueError or ConfigError"""
+        with open(path, 'r') as file:
+            return cls(json.load(file))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigSnapshot is immutable")
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
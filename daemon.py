@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""Multi-user organizer daemon.
+
+Serves every user's ~/.config/mfo/config.json under a root folder (by
+default /home) from one process:
+
+    python daemon.py --config /etc/mfo/daemon.json
+
+All users share one watchdog observer, one mover pool and one set of
+per-device limits. Rules, logs, journals and metrics stay per user.
+"""
+import os
+import sys
+import json
+import ctypes
+import signal
+import logging
+import argparse
+import threading
+from argparse import Namespace
+from contextlib import nullcontext
+from watchdog.observers import Observer
+from config import ConfigError
+from devices import DeviceScheduler, DEFAULT_SAME_DEVICE_LIMIT, DEFAULT_CROSS_DEVICE_LIMIT
+from metrics import OrganizerMetrics, LabeledRegistries, MetricsServer, TextfileWriter
+from scheduler import MoverPool, DEFAULT_LANE_MAX_WAIT
+from throttle import Throttle, ThrottlePolicy, DEFAULT_THROTTLE_INTERVAL
+from script import FileOrganizer
+
+DEFAULT_ROOT = "/home"
+DEFAULT_STATE_DIR = "/var/lib/mfo"
+DEFAULT_CONFIG_NAME = os.path.join(".config", "mfo", "config.json")
+DEFAULT_RESCAN_INTERVAL = 60
+# Moves one user may have dispatched but not finished, so a bulk import
+# can't take every mover
+DEFAULT_TENANT_MAX_INFLIGHT = 4
+DEFAULT_DAEMON_LANE_WORKERS = {"rename": 8, "small": 4, "large": 2}
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True) if sys.platform.startswith("linux") else None
+except OSError:
+    _libc = None
+
+
+def is_within(path, folder):
+    path = os.path.realpath(path)
+    folder = os.path.realpath(folder)
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
+class TenantPathValidator:
+    """Reject a user's config if it watches or fills folders outside their home folder"""
+
+    def __init__(self, home):
+        self.home = home
+
+    def __call__(self, config):
+        for source in config.sources:
+            overflow = [folder for folders in source['overflow'].values() for folder in folders]
+            for path in (source['path'], *source['folders'].values(), *overflow):
+                if not is_within(path, self.home):
+                    raise ConfigError(f"{path} is outside {self.home}")
+
+
+class TenantIdentity:
+    """Run the calling thread's file operations as one user (Linux setfsuid/setfsgid)
+
+    Unlike seteuid this only changes the current thread, so each shared
+    mover can act as the user whose file it is moving. While active, the
+    kernel checks access as that user without root's overrides, so a
+    destination the user swapped for a symlink into /etc is refused, and
+    new files and folders belong to the user. Threads started inside
+    inherit the ids. Nestable; the previous ids are restored on exit.
+    """
+
+    supported = _libc is not None and hasattr(_libc, "setfsuid") and hasattr(_libc, "setfsgid")
+
+    def __init__(self, uid, gid):
+        self.uid = uid
+        self.gid = gid
+        self._local = threading.local()
+
+    def __enter__(self):
+        # Group first: once the uid is not root, changing the group is refused
+        previous_gid = _libc.setfsgid(self.gid)
+        previous_uid = _libc.setfsuid(self.uid)
+        # Both calls return the previous id even when they fail; -1 reads the current one
+        if _libc.setfsuid(-1) != self.uid or _libc.setfsgid(-1) != self.gid:
+            _libc.setfsuid(previous_uid)
+            _libc.setfsgid(previous_gid)
+            raise PermissionError(f"Failed to act as uid {self.uid} gid {self.gid}")
+        self._local.__dict__.setdefault('stack', []).append((previous_uid, previous_gid))
+        return self
+
+    def __exit__(self, *exc_info):
+        previous_uid, previous_gid = self._local.stack.pop()
+        _libc.setfsuid(previous_uid)
+        _libc.setfsgid(previous_gid)
+
+
+class OrganizerDaemon:
+    """Runs one FileOrganizer per user on shared observer, mover pool and device limits"""
+
+    def __init__(self, settings, logger=None):
+        self.settings = settings
+        self.logger = logger or logging.getLogger("mfo.daemon")
+        self.root = settings.get('root', DEFAULT_ROOT)
+        self.config_name = settings.get('config_name', DEFAULT_CONFIG_NAME)
+        self.state_dir = settings.get('state_dir', DEFAULT_STATE_DIR)
+        self.log_level = getattr(logging, str(settings.get('log_level', 'INFO')).upper(), logging.INFO)
+
+        self.metrics = OrganizerMetrics()
+        self.registries = LabeledRegistries("tenant")
+        self.registries.add(None, self.metrics.registry)
+        self.device_scheduler = DeviceScheduler(
+            settings.get('same_device_limit', DEFAULT_SAME_DEVICE_LIMIT),
+            settings.get('cross_device_limit', DEFAULT_CROSS_DEVICE_LIMIT),
+            settings.get('device_limits', {}),
+            self.metrics)
+        self.throttle = None
+        throttle = settings.get('throttle', {})
+        if throttle.get('enabled', True):
+            self.throttle = Throttle(ThrottlePolicy.from_config(throttle),
+                                     throttle.get('interval', DEFAULT_THROTTLE_INTERVAL), self.logger, self.metrics)
+        lanes = settings.get('lanes', {})
+        lane_workers = dict(DEFAULT_DAEMON_LANE_WORKERS)
+        lane_workers.update(lanes.get('workers', {}))
+        self.mover_pool = MoverPool(self.dispatch, self.logger, lane_workers, self.estimate_lane,
+                                    on_dequeue=self._dequeued, metrics=self.metrics,
+                                    max_wait=lanes.get('max_wait', DEFAULT_LANE_MAX_WAIT), throttle=self.throttle)
+        self.observer = Observer()
+        self.tenants = {}
+        self.exporters = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _tenant_for(self, pool_name):
+        tenant, _, source_name = pool_name.partition("/")
+        return self.tenants.get(tenant), source_name
+
+    def dispatch(self, pool_name, item):
+        organizer, source_name = self._tenant_for(pool_name)
+        if organizer is not None:
+            with organizer.identity:
+                organizer.process_event(source_name, item)
+
+    def estimate_lane(self, pool_name, item):
+        organizer, source_name = self._tenant_for(pool_name)
+        if organizer is None:
+            return 'rename', 0
+        with organizer.identity:
+            return organizer.estimate_lane(source_name, item)
+
+    def _dequeued(self, pool_name):
+        organizer, _ = self._tenant_for(pool_name)
+        if organizer is not None:
+            organizer.metrics.queue_depth.dec()
+
+    def discover(self):
+        """Return {tenant: (home, config_path)} for every home folder under root that has a config"""
+        found = {}
+        try:
+            with os.scandir(self.root) as entries:
+                homes = [entry for entry in entries if entry.is_dir()]
+        except OSError as e:
+            self.logger.error(f"Failed to list {self.root}: {e}")
+            return found
+        for home in homes:
+            config_path = os.path.join(home.path, self.config_name)
+            if os.path.isfile(config_path):
+                found[home.name] = (home.path, config_path)
+        return found
+
+    def tenant_settings(self, name):
+        options = {"weight": 1, "max_inflight": DEFAULT_TENANT_MAX_INFLIGHT, "enabled": True}
+        options.update(self.settings.get('tenant_defaults', {}))
+        options.update(self.settings.get('tenants', {}).get(name, {}))
+        return options
+
+    def tenant_logger(self, name, state_dir):
+        logger = logging.getLogger(f"mfo.tenant.{name}")
+        logger.setLevel(self.log_level)
+        logger.propagate = False
+        if not logger.handlers:
+            handler = logging.FileHandler(os.path.join(state_dir, 'messy_files.log'))
+            handler.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATE_FORMAT))
+            logger.addHandler(handler)
+        return logger
+
+    def identity_for(self, owner):
+        """The identity a user's file operations run under; None unless the daemon runs as root"""
+        if os.geteuid() != 0:
+            return None
+        return TenantIdentity(*owner)
+
+    def make_state_dir(self, state_dir, owner=None):
+        """Create a user's state folder and, when running as root, hand it and its files to the user"""
+        os.makedirs(state_dir, mode=0o700, exist_ok=True)
+        if owner is None:
+            return
+        stat = os.lstat(state_dir)
+        if (stat.st_uid, stat.st_gid) == owner:
+            # Already the user's; anything inside may be a link the user planted
+            return
+        with os.scandir(state_dir) as entries:
+            for entry in entries:
+                os.lchown(entry.path, *owner)
+        os.lchown(state_dir, *owner)
+
+    def add_tenant(self, name, home, config_path):
+        options = self.tenant_settings(name)
+        if not options['enabled']:
+            return None
+        state_dir = os.path.join(self.state_dir, name)
+        home_stat = os.stat(home)
+        owner = (home_stat.st_uid, home_stat.st_gid)
+        identity = self.identity_for(owner)
+        args = Namespace(config=config_path, log_level=logging.getLevelName(self.log_level), log_to_file=True)
+        try:
+            self.make_state_dir(state_dir, owner if identity is not None else None)
+            with identity or nullcontext():
+                organizer = FileOrganizer(args, tenant=name, state_dir=state_dir,
+                                          logger=self.tenant_logger(name, state_dir),
+                                          mover_pool=self.mover_pool, device_scheduler=self.device_scheduler,
+                                          observer=self.observer, owner=owner,
+                                          config_validator=TenantPathValidator(home), identity=identity,
+                                          throttle=self.throttle)
+        except (SystemExit, Exception) as e:
+            self.logger.error(f"Failed to load the configuration of {name} ({config_path}): {e}")
+            return None
+        organizer.pool_weight = options['weight']
+        organizer.add_pool_sources()
+        self.mover_pool.queue.set_limit(name, options['max_inflight'])
+        self.registries.add(name, organizer.metrics.registry)
+        with self._lock:
+            self.tenants[name] = organizer
+        with organizer.identity:
+            organizer.start_monitoring()
+        self.logger.info(f"Organizing files for {name} ({config_path})")
+        return organizer
+
+    def remove_tenant(self, name):
+        with self._lock:
+            organizer = self.tenants.pop(name, None)
+        if organizer is None:
+            return
+        with organizer.identity:
+            organizer.close()
+        self.registries.remove(name)
+        self.mover_pool.queue.set_limit(name, None)
+        self.logger.info(f"Stopped organizing files for {name}")
+
+    def rescan(self):
+        """Start organizers for new configs and stop those whose config is gone"""
+        found = self.discover()
+        for name in [name for name in self.tenants if name not in found]:
+            self.remove_tenant(name)
+        for name, (home, config_path) in found.items():
+            if name not in self.tenants:
+                self.add_tenant(name, home, config_path)
+
+    def start_metrics_exporters(self):
+        metrics_config = self.settings.get('metrics', {})
+        try:
+            if metrics_config.get('port'):
+                server = MetricsServer(self.registries, int(metrics_config['port']))
+                server.start()
+                self.exporters.append(server)
+            if metrics_config.get('textfile'):
+                writer = TextfileWriter(self.registries, metrics_config['textfile'], metrics_config.get('interval', 15))
+                writer.start()
+                self.exporters.append(writer)
+        except Exception as e:
+            self.logger.error(f"Failed to start metrics exporter: {e}")
+
+    def start(self):
+        if os.geteuid() == 0:
+            if not TenantIdentity.supported:
+                raise RuntimeError("Running as root needs Linux setfsuid to act as each user")
+            # Users' files are accessed with only their own groups
+            os.setgroups([])
+        # Users can reach their own state folder inside, but not list the others
+        os.makedirs(self.state_dir, mode=0o711, exist_ok=True)
+        os.chmod(self.state_dir, 0o711)
+        if self.throttle is not None:
+            self.throttle.start()
+        self.mover_pool.start()
+        self.observer.start()
+        self.rescan()
+        self.start_metrics_exporters()
+
+    def run(self):
+        """Start and rescan for new users until stop is requested"""
+        self.start()
+        while not self._stopped.wait(self.settings.get('rescan_interval', DEFAULT_RESCAN_INTERVAL)):
+            self.rescan()
+
+    def request_stop(self, *args):
+        self._stopped.set()
+
+    def stop(self):
+        self._stopped.set()
+        for name in list(self.tenants):
+            self.remove_tenant(name)
+        self.observer.stop()
+        self.observer.join()
+        if self.throttle is not None:
+            self.throttle.stop()
+        self.mover_pool.stop()
+        for exporter in self.exporters:
+            exporter.stop()
+        self.exporters = []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Messy File Organizer daemon - organize many users' folders from one process")
+    parser.add_argument('--config', default='/etc/mfo/daemon.json', help='Path to the daemon configuration file')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        help='Set the logging level')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=getattr(logging, args.log_level), format=LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+    settings = {}
+    if os.path.exists(args.config):
+        with open(args.config, 'r') as file:
+            settings = json.load(file)
+    settings.setdefault('log_level', args.log_level)
+
+    daemon = OrganizerDaemon(settings)
+    signal.signal(signal.SIGTERM, daemon.request_stop)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
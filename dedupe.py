@@ -0,0 +1,247 @@
+import os
+import json
+import errno
+import shutil
+import filecmp
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl request number of FICLONE (_IOW(0x94, 9, int)) on Linux
+FICLONE = 0x40049409
+
+LINK_MODES = ("auto", "reflink", "hardlink")
+
+# Errors meaning the filesystem can't clone, as opposed to a real failure
+_REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EXDEV, errno.ENOSYS)
+
+
+def reflink(src, dst):
+    """Create dst as a copy-on-write clone of src, or raise OSError if the filesystem can't"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform", dst)
+    with open(src, 'rb') as source:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(fd, FICLONE, source.fileno())
+        except OSError:
+            os.close(fd)
+            os.unlink(dst)
+            raise
+        os.close(fd)
+
+
+def _materialize(src, dst):
+    # Plain read/write so the result owns its blocks; shutil.copyfile may
+    # use copy_file_range, which can clone again on btrfs and XFS
+    with open(src, 'rb') as source, open(dst, 'xb') as target:
+        shutil.copyfileobj(source, target, 1024 * 1024)
+
+
+class Deduplicator:
+    """Replace verified duplicate files with hardlinks or reflinks
+
+    Every path stays valid: each redundant copy is compared byte for byte
+    with the kept file, linked to a temporary name next to it and swapped in
+    with os.replace. Copies whose permissions or owner differ from the kept
+    file's are only ever reflinked, since a hardlink would share them. Each
+    replacement is appended to a JSON-lines journal first so undo() can
+    turn the links back into independent copies.
+    """
+
+    def __init__(self, journal_path, mode="auto", logger=None):
+        if mode not in LINK_MODES:
+            raise ValueError(f"Unknown link mode {mode!r}, expected one of {LINK_MODES}")
+        self.journal_path = journal_path
+        self.mode = mode
+        self.logger = logger
+        self.files_linked = 0
+        self.bytes_reclaimed = 0
+        self._no_reflink_devices = set()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def _log(self, level, message):
+        if self.logger is not None:
+            getattr(self.logger, level)(message)
+
+    def _write_journal(self, records):
+        with open(self.journal_path, 'a') as journal:
+            for record in records:
+                journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _link(self, keeper, path, device, hardlink=True):
+        """Link a temporary file next to path to keeper; return (kind, tmp_path)
+
+        With hardlink False only a reflink is tried, and (None, None) is
+        returned if the filesystem can't make one.
+        """
+        tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.mfo-link")
+        kind = None
+        if self.mode != "hardlink" and device not in self._no_reflink_devices:
+            try:
+                reflink(keeper, tmp_path)
+                shutil.copystat(path, tmp_path)
+                kind = "reflink"
+            except OSError as e:
+                if e.errno not in _REFLINK_UNSUPPORTED:
+                    raise
+                self._no_reflink_devices.add(device)
+                if self.mode == "reflink":
+                    raise
+        if kind is None:
+            if not hardlink:
+                return None, None
+            os.link(keeper, tmp_path)
+            kind = "hardlink"
+        return kind, tmp_path
+
+    def _link_set(self, paths):
+        """Link every file identical to the first one; return the paths that differed"""
+        keeper, candidates = paths[0], paths[1:]
+        try:
+            keeper_stat = os.stat(keeper)
+        except OSError as e:
+            self._log("warning", f"Skipped the duplicates of {keeper}: {e}")
+            return []
+        different = []
+        for path in candidates:
+            if self._cancel.is_set():
+                break
+            try:
+                stat = os.stat(path)
+                if (stat.st_dev, stat.st_ino) == (keeper_stat.st_dev, keeper_stat.st_ino):
+                    continue
+                if stat.st_dev != keeper_stat.st_dev or stat.st_size != keeper_stat.st_size:
+                    different.append(path)
+                    continue
+                if not filecmp.cmp(keeper, path, shallow=False):
+                    different.append(path)
+                    continue
+                # A hardlink shares the keeper's permissions and owner, so
+                # a copy that differs in them may only become a reflink
+                same_access = (stat.st_mode, stat.st_uid, stat.st_gid) == (
+                    keeper_stat.st_mode, keeper_stat.st_uid, keeper_stat.st_gid)
+                kind, tmp_path = self._link(keeper, path, stat.st_dev, same_access)
+                if kind is None:
+                    different.append(path)
+                    continue
+            except OSError as e:
+                self._log("error", f"Failed to link {path} to {keeper}: {e}")
+                continue
+            try:
+                # The copy must not have changed since it was compared
+                current = os.stat(path)
+                if (current.st_mtime_ns, current.st_size) != (stat.st_mtime_ns, stat.st_size):
+                    os.unlink(tmp_path)
+                    self._log("warning", f"Skipped {path}: it changed while being deduplicated")
+                    continue
+                self._write_journal([{
+                    "path": path,
+                    "keeper": keeper,
+                    "kind": kind,
+                    "size": stat.st_size,
+                    "mode": stat.st_mode & 0o7777,
+                    "atime_ns": stat.st_atime_ns,
+                    "mtime_ns": stat.st_mtime_ns,
+                }])
+                os.replace(tmp_path, path)
+            except OSError as e:
+                self._log("error", f"Failed to link {path} to {keeper}: {e}")
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                continue
+            self.files_linked += 1
+            self.bytes_reclaimed += stat.st_size
+            self._log("info", f"Replaced {path} with a {kind} to {keeper}")
+        return different
+
+    def link_group(self, paths):
+        """Deduplicate one group of candidate duplicates; return the bytes reclaimed"""
+        before = self.bytes_reclaimed
+        links = []
+        for path in paths:
+            try:
+                links.append((-os.stat(path).st_nlink, path))
+            except OSError:
+                continue
+        # Keep the file that already has the most links, so existing link
+        # sets grow instead of splitting
+        remaining = [path for _, path in sorted(links)]
+        # Candidates only share a hash of their first block, so files that
+        # turn out different are grouped again around a new keeper
+        while len(remaining) > 1 and not self._cancel.is_set():
+            remaining = self._link_set(remaining)
+        return self.bytes_reclaimed - before
+
+    def run(self, groups, progress=None):
+        """Deduplicate every group of paths; return (files_linked, bytes_reclaimed)"""
+        groups = list(groups)
+        for index, paths in enumerate(groups, 1):
+            if self._cancel.is_set():
+                break
+            self.link_group(paths)
+            if progress is not None:
+                progress(index, len(groups))
+        return self.files_linked, self.bytes_reclaimed
+
+    def start(self, groups, on_done=None, progress=None):
+        """Run in a background thread; on_done(files_linked, bytes_reclaimed) is called at the end"""
+        def target():
+            result = self.run(groups, progress)
+            if on_done is not None:
+                on_done(*result)
+
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def cancel(self):
+        self._cancel.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def undo(self):
+        """Turn every journaled link back into an independent copy; return the number restored"""
+        try:
+            with open(self.journal_path, 'r') as journal:
+                records = [json.loads(line) for line in journal if line.strip()]
+        except OSError:
+            return 0
+        restored = 0
+        failed = []
+        for record in reversed(records):
+            path = record["path"]
+            tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.mfo-unlink")
+            try:
+                if not os.path.isfile(path):
+                    continue
+                _materialize(path, tmp_path)
+                os.chmod(tmp_path, record["mode"])
+                os.utime(tmp_path, ns=(record["atime_ns"], record["mtime_ns"]))
+                os.replace(tmp_path, path)
+                restored += 1
+            except OSError as e:
+                self._log("error", f"Failed to restore {path}: {e}")
+                failed.append(record)
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+        # Keep only what could not be restored so undo can be retried
+        tmp_journal = self.journal_path + ".tmp"
+        with open(tmp_journal, 'w') as journal:
+            for record in reversed(failed):
+                journal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        os.replace(tmp_journal, self.journal_path)
+        self._log("info", f"Restored {restored} deduplicated files as independent copies")
+        return restored
@@ -0,0 +1,102 @@
+import os
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+# Renames on one device only touch metadata and parallelize well, while
+# cross-device copies stream data and thrash spinning disks when run in
+# parallel.
+DEFAULT_SAME_DEVICE_LIMIT = 16
+DEFAULT_CROSS_DEVICE_LIMIT = 2
+
+
+def find_mount_point(path):
+    """Return the mount point that contains path"""
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+class DeviceScheduler:
+    """Per-device concurrency limits for moves
+
+    Same-device moves take one "same" slot on their device. Cross-device
+    moves take one "cross" slot on both the source and the destination
+    device, acquired in device order so two opposite copies can't deadlock.
+
+    device_limits maps mount points to either an integer (the cross-device
+    limit) or a dict with "same" and/or "cross" keys.
+    """
+
+    def __init__(self, same_device_limit=DEFAULT_SAME_DEVICE_LIMIT, cross_device_limit=DEFAULT_CROSS_DEVICE_LIMIT,
+                 device_limits=None, metrics=None):
+        self.same_device_limit = same_device_limit
+        self.cross_device_limit = cross_device_limit
+        self.metrics = metrics
+        self._limits = {}
+        self._labels = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+        for mount_point, limits in (device_limits or {}).items():
+            try:
+                device = os.stat(mount_point).st_dev
+            except OSError:
+                continue
+            if not isinstance(limits, Mapping):
+                limits = {"cross": limits}
+            self._limits[device] = limits
+            self._labels[device] = mount_point
+
+    def label(self, device, path=None):
+        """Return a readable name (the mount point) for a device"""
+        label = self._labels.get(device)
+        if label is None:
+            label = find_mount_point(path) if path else str(device)
+            self._labels[device] = label
+        return label
+
+    def _semaphore(self, device, kind):
+        key = (device, kind)
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._semaphores.get(key)
+                if semaphore is None:
+                    default = self.same_device_limit if kind == "same" else self.cross_device_limit
+                    limit = max(1, int(self._limits.get(device, {}).get(kind, default)))
+                    semaphore = self._semaphores[key] = threading.BoundedSemaphore(limit)
+        return semaphore
+
+    @contextmanager
+    def slot(self, src_device, dst_device, src_path=None, dst_path=None, size=0):
+        """Hold the concurrency slots needed to move a file between two devices"""
+        if src_device == dst_device:
+            kind = "same"
+            devices = [(src_device, src_path)]
+        else:
+            kind = "cross"
+            devices = sorted([(src_device, src_path), (dst_device, dst_path)], key=lambda item: item[0])
+        semaphores = [self._semaphore(device, kind) for device, _ in devices]
+        for semaphore in semaphores:
+            semaphore.acquire()
+        labels = [self.label(device, path) for device, path in devices]
+        metrics = self.metrics
+        if metrics is not None:
+            for label in labels:
+                metrics.device_inflight.labels(label, kind).inc()
+        try:
+            yield kind
+            if metrics is not None:
+                for label in labels:
+                    metrics.device_bytes.labels(label, kind).inc(size)
+                    metrics.device_moves.labels(label, kind).inc()
+        finally:
+            if metrics is not None:
+                for label in labels:
+                    metrics.device_inflight.labels(label, kind).dec()
+            for semaphore in reversed(semaphores):
+                semaphore.release()
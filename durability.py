@@ -0,0 +1,195 @@
+import os
+import sys
+import errno
+import ctypes
+import shutil
+import hashlib
+
+DURABILITY_LEVELS = ("fast", "safe", "paranoid")
+DEFAULT_DURABILITY = "fast"
+COPY_CHUNK = 1024 * 1024
+# Copies whose sources wait for one directory fsync before being unlinked
+DEFAULT_COMMIT_BATCH = 256
+RENAME_NOREPLACE = 1
+AT_FDCWD = -100
+
+try:
+    _libc = ctypes.CDLL(None, use_errno=True) if sys.platform.startswith("linux") else None
+    _renameat2 = _libc.renameat2
+except (OSError, AttributeError):
+    _renameat2 = None
+
+
+class VerificationError(OSError):
+    """A paranoid copy read back different bytes than were written"""
+
+    def __init__(self, path):
+        super().__init__(errno.EIO, "Copy does not match the source checksum", path)
+
+
+def fsync_directory(path):
+    """Flush a directory's entries to disk; a no-op where directories can't be opened (Windows)"""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+    except (PermissionError, IsADirectoryError):
+        return
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        # Some filesystems don't support fsync on directories
+        if e.errno not in (errno.EINVAL, errno.ENOTSUP, errno.EBADF):
+            raise
+    finally:
+        os.close(fd)
+
+
+def rename_noreplace(src, dst):
+    """Rename src to dst on the same device, raising FileExistsError instead of replacing dst
+
+    os.rename silently replaces an existing file on POSIX. Linux renameat2
+    refuses atomically; elsewhere, or on filesystems without it, the file is
+    hardlinked to dst and then unlinked from src, and only where hardlinks
+    aren't supported either does dst get a last check before the rename.
+    """
+    global _renameat2
+    if os.name == "nt":
+        # Windows never replaces on rename
+        return os.rename(src, dst)
+    if _renameat2 is not None:
+        if _renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dst), RENAME_NOREPLACE) == 0:
+            return
+        error = ctypes.get_errno()
+        if error == errno.ENOSYS:
+            _renameat2 = None
+        elif error != errno.EINVAL:
+            raise OSError(error, os.strerror(error), src, None, dst)
+    try:
+        os.link(src, dst, follow_symlinks=False)
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.EOPNOTSUPP, errno.EMLINK, errno.ENOSYS):
+            raise
+    else:
+        os.unlink(src)
+        return
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+    os.rename(src, dst)
+
+
+def _checksum(path):
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as file:
+        if hasattr(os, "posix_fadvise"):
+            # Read what reached the disk, not the page cache we just wrote
+            os.posix_fadvise(file.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        for chunk in iter(lambda: file.read(COPY_CHUNK), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def copy_file(src, dst, level, on_create=None):
+    """Copy src to dst with its metadata, fsynced for "safe" and also read back and checked for "paranoid"
+
+    on_create(inode) is called with the inode of dst as soon as it exists.
+    """
+    digest = hashlib.blake2b() if level == "paranoid" else None
+    created = False
+    try:
+        # 'x' fails if something took the name since it was chosen
+        with open(src, 'rb') as source, open(dst, 'xb') as target:
+            created = True
+            if on_create is not None:
+                on_create(os.fstat(target.fileno()).st_ino)
+            for chunk in iter(lambda: source.read(COPY_CHUNK), b""):
+                target.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+            target.flush()
+            if level != "fast":
+                os.fsync(target.fileno())
+        shutil.copystat(src, dst)
+        if digest is not None and _checksum(dst) != digest.digest():
+            raise VerificationError(dst)
+    except BaseException:
+        if created:
+            try:
+                os.remove(dst)
+            except OSError:
+                pass
+        raise
+
+
+class DurableCopier:
+    """Cross-device moves at one durability level
+
+    "fast" copies and removes the source at once, like shutil.move. "safe"
+    and "paranoid" copy and fsync each file but leave the source in place
+    until commit(), which fsyncs each destination folder once and only then
+    unlinks the sources, so a crash never leaves the only copy of a file
+    unsynced. on_create(src, dst, inode) is called as soon as each copy
+    exists and on_commit(src, dst) for every source removed. commit() runs
+    by itself every commit_batch files.
+    """
+
+    def __init__(self, level=DEFAULT_DURABILITY, on_commit=None, commit_batch=DEFAULT_COMMIT_BATCH, on_create=None):
+        self.level = level
+        self.on_commit = on_commit
+        self.on_create = on_create
+        self.commit_batch = commit_batch
+        self._pending = []
+
+    def move(self, src, dst):
+        if os.path.islink(src):
+            # Recreate the link itself, failing if dst exists, as shutil.move does across devices
+            os.symlink(os.readlink(src), dst)
+            os.unlink(src)
+            if self.on_commit is not None:
+                self.on_commit(src, dst)
+            return dst
+        on_create = None
+        if self.on_create is not None:
+            on_create = lambda inode: self.on_create(src, dst, inode)
+        copy_file(src, dst, self.level, on_create)
+        if self.level == "fast":
+            os.remove(src)
+            if self.on_commit is not None:
+                self.on_commit(src, dst)
+            return dst
+        self._pending.append((src, dst))
+        if len(self._pending) >= self.commit_batch:
+            self.commit()
+        return dst
+
+    def commit(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        for folder in {os.path.dirname(dst) for _, dst in pending}:
+            fsync_directory(folder)
+        for src, dst in pending:
+            try:
+                os.remove(src)
+            except FileNotFoundError:
+                pass
+            if self.on_commit is not None:
+                self.on_commit(src, dst)
+        # Make the removals durable too, so a crash can't bring a source back
+        for folder in {os.path.dirname(src) for src, _ in pending}:
+            fsync_directory(folder)
+
+
+def move(src, dst, level=DEFAULT_DURABILITY):
+    """Move one file like shutil.move, copying across devices at the given durability level
+
+    Raises FileExistsError instead of replacing an existing dst.
+    """
+    try:
+        rename_noreplace(src, dst)
+        return dst
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    copier = DurableCopier(level)
+    copier.move(src, dst)
+    copier.commit()
+    return dst
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""Record the organizer's raw watcher events and replay them for latency benchmarking.
+
+Record while organizing:
+
+    python messy_organizer.py --cli --record-trace downloads.trace
+
+Replay a trace into a scratch directory and report event-to-move latency:
+
+    python eventtrace.py downloads.trace --speed real
+    python eventtrace.py downloads.trace --speed 10 --output result.json
+    python eventtrace.py downloads.trace --speed max --observer
+
+A trace is a JSON header line followed by one compact JSON array per event:
+[microseconds since start, type, source, size, path relative to the source,
+destination for moves].
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from argparse import Namespace
+
+TRACE_VERSION = 1
+EVENT_CODES = {"created": "c", "modified": "m", "moved": "v", "deleted": "d", "closed": "x"}
+EVENT_TYPES = {code: event_type for event_type, code in EVENT_CODES.items()}
+FLUSH_INTERVAL = 1.0
+DEFAULT_QUIET_PERIOD = 1.0
+DEFAULT_DRAIN_TIMEOUT = 300
+
+
+class EventRecorder:
+    """Appends every raw watcher event the organizer receives to a trace file
+
+    Paths are stored relative to their source folder so a trace can be
+    replayed anywhere. The size is taken with one lstat per event, or -1 if
+    the file is already gone.
+    """
+
+    def __init__(self, path, sources, settle_delay=None):
+        self.path = path
+        self.roots = {source['name']: source['path'] for source in sources}
+        self._file = open(path, 'w', encoding='utf-8')
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._last_flush = self._started
+        self.events = 0
+        header = {"version": TRACE_VERSION, "started": time.time(), "sources": self.roots,
+                  "settle_delay": settle_delay}
+        self._file.write(json.dumps(header) + "\n")
+
+    def _relative(self, source_name, path):
+        root = self.roots.get(source_name)
+        if root is None:
+            return path
+        return os.path.relpath(path, root)
+
+    def record(self, source_name, event):
+        code = EVENT_CODES.get(event.event_type)
+        if code is None or event.is_directory:
+            return
+        now = time.monotonic()
+        path = getattr(event, 'dest_path', None) if code == "v" else event.src_path
+        try:
+            size = os.lstat(path).st_size
+        except (OSError, TypeError):
+            size = -1
+        row = [int((now - self._started) * 1e6), code, source_name, size, self._relative(source_name, event.src_path)]
+        if code == "v":
+            row.append(self._relative(source_name, event.dest_path))
+        line = json.dumps(row, separators=(',', ':')) + "\n"
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(line)
+            self.events += 1
+            if now - self._last_flush >= FLUSH_INTERVAL:
+                self._file.flush()
+                self._last_flush = now
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def read_trace(path):
+    """Return (header, events) where each event is a dict with offset in seconds"""
+    with open(path, 'r', encoding='utf-8') as file:
+        header = json.loads(file.readline())
+        if header.get("version") != TRACE_VERSION:
+            raise ValueError(f"Unsupported trace version {header.get('version')}")
+        events = []
+        for line in file:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            events.append({
+                "offset": row[0] / 1e6,
+                "type": EVENT_TYPES[row[1]],
+                "source": row[2],
+                "size": row[3],
+                "path": row[4],
+                "dest": row[5] if len(row) > 5 else None,
+            })
+    return header, events
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(round(fraction * (len(samples) - 1))))]
+
+
+class LatencyRecorder:
+    """Stands in for the event_to_move histogram and keeps every sample"""
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        self.histogram.observe(value)
+        with self._lock:
+            self.samples.append(value)
+
+
+def _resize(path, size):
+    with open(path, 'ab') as file:
+        file.truncate(max(size, 0))
+
+
+def apply_event(event, root):
+    """Reproduce one traced change in the scratch copy of its source; return the watchdog event for it"""
+    from watchdog.events import FileCreatedEvent, FileModifiedEvent, FileMovedEvent, FileDeletedEvent, FileClosedEvent
+
+    # Only replay inside the scratch source, whatever the trace says
+    for relative in (event["path"], event["dest"] or ""):
+        if os.path.isabs(relative) or os.path.normpath(relative).split(os.sep)[0] == os.pardir:
+            return None
+    path = os.path.join(root, event["path"])
+    kind = event["type"]
+    try:
+        if kind == "created":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _resize(path, event["size"])
+            return FileCreatedEvent(path)
+        if kind == "modified":
+            if os.path.exists(path) and event["size"] >= 0:
+                _resize(path, event["size"])
+            return FileModifiedEvent(path)
+        if kind == "closed":
+            return FileClosedEvent(path)
+        if kind == "moved":
+            dest = os.path.join(root, event["dest"])
+            if os.path.exists(path):
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.replace(path, dest)
+            return FileMovedEvent(path, dest)
+        if kind == "deleted":
+            if os.path.exists(path):
+                os.remove(path)
+            return FileDeletedEvent(path)
+    except OSError:
+        # The organizer may already have moved the file away, as it would
+        # have in production
+        pass
+    return None
+
+
+def build_replay_config(header, workdir, settle_delay, base_config=None):
+    """Write a config whose sources and category folders live in workdir; return its path
+
+    The rules come from base_config (a parsed configuration file) or the
+    benchmark's categories.
+    """
+    if base_config is None:
+        from benchmark import build_config
+        config = build_config(workdir)
+    else:
+        config = dict(base_config)
+    config.pop("downloads_folder", None)
+    config["sources"] = []
+    for name in header["sources"]:
+        path = os.path.join(workdir, "sources", name)
+        os.makedirs(path, exist_ok=True)
+        config["sources"].append({"name": name, "path": path})
+    config["folders"] = {category: os.path.join(workdir, "organized", category) for category in config["folders"]}
+    config.update({"notifications": False, "journal": False, "settle_delay": settle_delay})
+    # Latencies shouldn't include pauses for the replaying machine's load or battery
+    config["throttle"] = dict(config.get("throttle", {}), enabled=False)
+    config_path = os.path.join(workdir, "config.json")
+    with open(config_path, "w") as file:
+        json.dump(config, file, indent=4)
+    return config_path
+
+
+def replay(trace_path, speed="real", workdir=None, settle_delay=None, use_observer=False,
+           config_path=None, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+    """Feed a trace to a fresh organizer in a scratch directory and return a latency report
+
+    speed is "real", "max" or a factor such as 10 (ten times faster). By
+    default events are dispatched straight to DownloadEventHandler, so the
+    replay is deterministic; use_observer=True lets the platform observer
+    rediscover them from the scratch filesystem instead. config_path uses
+    your own rules in place of the built-in categories; its sources are
+    replaced by scratch folders.
+    """
+    from script import FileOrganizer, DownloadEventHandler
+
+    header, events = read_trace(trace_path)
+    factor = None if speed == "max" else (1.0 if speed == "real" else float(speed))
+    if settle_delay is None:
+        settle_delay = header.get("settle_delay") or 0
+    owns_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix="mfo-replay-")
+    os.makedirs(workdir, exist_ok=True)
+    organizer = None
+    try:
+        base_config = None
+        if config_path:
+            with open(config_path) as file:
+                base_config = json.load(file)
+        generated = build_replay_config(header, workdir, settle_delay, base_config)
+
+        state_dir = os.path.join(workdir, "state")
+        args = Namespace(config=generated, log_level="WARNING", log_to_file=True)
+        organizer = FileOrganizer(args, state_dir=state_dir)
+        latencies = LatencyRecorder(organizer.metrics.event_to_move)
+        organizer.metrics.event_to_move = latencies
+        roots = {source['name']: source['path'] for source in organizer.sources}
+        handlers = {source['name']: DownloadEventHandler(organizer, source) for source in organizer.sources}
+        if use_observer:
+            organizer.start_monitoring()
+
+        started = time.monotonic()
+        fed = 0
+        for event in events:
+            if factor is not None:
+                delay = started + event["offset"] / factor - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            root = roots.get(event["source"])
+            if root is None:
+                continue
+            watchdog_event = apply_event(event, root)
+            if watchdog_event is not None and not use_observer:
+                handlers[event["source"]].dispatch(watchdog_event)
+            fed += 1
+        fed_seconds = time.monotonic() - started
+
+        # Wait for the settle delay, then until the pool is empty and no
+        # move has finished for a quiet period
+        deadline = time.monotonic() + settle_delay + drain_timeout
+        time.sleep(settle_delay)
+        last_count, last_change = -1, time.monotonic()
+        while time.monotonic() < deadline:
+            count = len(latencies.samples)
+            if count != last_count:
+                last_count, last_change = count, time.monotonic()
+            elif not organizer.mover_pool.pending() and time.monotonic() - last_change >= DEFAULT_QUIET_PERIOD:
+                break
+            time.sleep(0.05)
+
+        samples = latencies.samples
+        return {
+            "trace": os.path.abspath(trace_path),
+            "speed": speed,
+            "mode": "observer" if use_observer else "handler",
+            "events": len(events),
+            "events_fed": fed,
+            "trace_seconds": events[-1]["offset"] if events else 0,
+            "replay_seconds": fed_seconds,
+            "settle_delay": settle_delay,
+            "files_moved": len(samples),
+            "failures": organizer.metrics.failures.labels().value,
+            "p50": percentile(samples, 0.50),
+            "p90": percentile(samples, 0.90),
+            "p99": percentile(samples, 0.99),
+            "max": max(samples) if samples else None,
+        }
+    finally:
+        if organizer is not None:
+            organizer.close()
+        if owns_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded watcher event trace and report event-to-move latency")
+    parser.add_argument('trace', help='Trace file written with --record-trace')
+    parser.add_argument('--speed', default='real',
+                        help='"real", "max", or a factor such as 10 to replay ten times faster')
+    parser.add_argument('--settle-delay', type=float, default=None,
+                        help='Settle delay for the replay (default: the one in effect when the trace was recorded)')
+    parser.add_argument('--observer', action='store_true',
+                        help='Let the platform observer pick up the replayed changes instead of dispatching events directly')
+    parser.add_argument('--config', default=None, help='Use the rules from this configuration file')
+    parser.add_argument('--workdir', default=None, help='Scratch directory to replay into (kept afterwards)')
+    parser.add_argument('--output', default=None, help='Write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+    if args.speed not in ("real", "max"):
+        try:
+            if float(args.speed) <= 0:
+                raise ValueError
+        except ValueError:
+            parser.error("--speed must be real, max or a positive factor")
+
+    report = replay(args.trace, args.speed, args.workdir, args.settle_delay, args.observer, args.config)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import os
+import errno
+import shutil
+import threading
+from time import monotonic
+
+DEFAULT_FREE_SPACE_TTL = 5.0
+# Never fill a destination past this much free space
+DEFAULT_MIN_FREE = 64 * 1024 * 1024
+DEFAULT_LOW_WATERMARK = 1024 * 1024 * 1024
+
+
+class DestinationFull(OSError):
+    """No configured destination for a file has room for it"""
+
+    def __init__(self, path, size):
+        super().__init__(errno.ENOSPC, f"Not enough free space for {size} bytes", path)
+
+
+def is_out_of_space(error):
+    return isinstance(error, OSError) and error.errno in (errno.ENOSPC, errno.EDQUOT)
+
+
+class FreeSpaceTracker:
+    """Cached free space of each destination device
+
+    The free space of a device is read with shutil.disk_usage (statvfs on
+    POSIX) at most once per ttl seconds and lowered locally by every
+    reservation in between, so many moves in a row cost one system call
+    and still see each other's bytes. A device whose free space drops below
+    low_watermark triggers one on_low(path, free) alert until it recovers.
+    """
+
+    def __init__(self, ttl=DEFAULT_FREE_SPACE_TTL, min_free=DEFAULT_MIN_FREE, low_watermark=DEFAULT_LOW_WATERMARK,
+                 on_low=None, metrics=None):
+        self.ttl = ttl
+        self.min_free = min_free
+        self.low_watermark = low_watermark
+        self.on_low = on_low
+        self.metrics = metrics
+        self._lock = threading.Lock()
+        # device -> [path, free bytes, refreshed at, below the watermark]
+        self._devices = {}
+
+    def _entry(self, path, device, now):
+        entry = self._devices.get(device)
+        if entry is None:
+            entry = self._devices[device] = [path, 0, None, False]
+        if entry[2] is None or now - entry[2] >= self.ttl:
+            entry[1] = shutil.disk_usage(entry[0]).free
+            entry[2] = now
+        return entry
+
+    def _update(self, device, entry):
+        if self.metrics is not None:
+            self.metrics.free_bytes.labels(str(device)).set(entry[1])
+        low = entry[1] < self.low_watermark
+        alert = low and not entry[3]
+        entry[3] = low
+        return alert
+
+    def free(self, path, device):
+        with self._lock:
+            entry = self._entry(path, device, monotonic())
+            alert = self._update(device, entry)
+            folder, free = entry[0], entry[1]
+        if alert and self.on_low:
+            self.on_low(folder, free)
+        return free
+
+    def reserve(self, path, device, size):
+        """Take size bytes from the cached free space of device; return False if they don't fit"""
+        with self._lock:
+            entry = self._entry(path, device, monotonic())
+            fits = entry[1] - size >= self.min_free
+            if fits:
+                entry[1] -= size
+            alert = self._update(device, entry)
+            folder, free = entry[0], entry[1]
+        if alert and self.on_low:
+            self.on_low(folder, free)
+        return fits
+
+    def release(self, device, size):
+        """Give back a reservation whose move failed"""
+        with self._lock:
+            entry = self._devices.get(device)
+            if entry is not None:
+                entry[1] += size
+
+    def exhausted(self, device):
+        """Forget the cached free space after the device reported ENOSPC, so the next check reads it again"""
+        with self._lock:
+            entry = self._devices.get(device)
+            if entry is not None:
+                entry[2] = None
+
+
+def remove_partial_copy(src, dst):
+    """Remove what a failed cross-device move left at dst, as long as src is still there"""
+    if os.path.exists(src) and os.path.lexists(dst):
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
@@ -2,19 +2,110 @@ import sys
 import os
 import json
 import shutil
-import hashlib
-import datetime
 import time
 import threading
-from collections import defaultdict
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QTabWidget, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, 
                              QGroupBox, QFormLayout, QCheckBox, QSpinBox, QListWidget, 
                              QListWidgetItem, QMessageBox, QInputDialog, QScrollArea,
                              QAction, QMenu, QProgressBar, QTableWidget, QTableWidgetItem,
-                             QHeaderView, QDateEdit, QTimeEdit, QComboBox, QRadioButton)
-from PyQt5.QtCore import Qt, QSize, QSettings, QDateTime, QTimer
-from PyQt5.QtGui import QIcon, QPixmap, QPalette, QColor, QFont, QFontMetrics
+                             QHeaderView, QTimeEdit, QComboBox, QListView)
+from PyQt5.QtCore import Qt, QSettings, QDateTime, QTimer, QAbstractListModel, QModelIndex
+from PyQt5.QtGui import QIcon, QFont
+from scanner import collect_statistics, find_duplicates, format_size
+from dedupe import Deduplicator
+from cache import HashCache
+from perceptual import find_similar_images, DEFAULT_MAX_DISTANCE
+from logview import LogIndex, LogIndexer, LOG_LEVELS
+
+class LogListModel(QAbstractListModel):
+    """Virtual list over a LogIndex: rows are read from the mapped log only when the view paints them
+
+    Until the first pass of the index is done the model shows the tail of
+    the log read straight from the end of the file. With a filter set the
+    rows are the matching line numbers, extended as new lines arrive.
+    """
+
+    def __init__(self, index, parent=None):
+        super().__init__(parent)
+        self.index = index
+        self.tail = index.tail()
+        self.rows = None
+        self.text = ""
+        self.level = None
+        self.searched = 0
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self.tail is not None:
+            return len(self.tail)
+        return len(self.rows) if self.rows is not None else self.searched
+
+    def data(self, model_index, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole or not model_index.isValid():
+            return None
+        row = model_index.row()
+        if self.tail is not None:
+            return self.tail[row] if row < len(self.tail) else None
+        return self.index.line(self.rows[row] if self.rows is not None else row)
+
+    def set_filter(self, text, level):
+        self.text = text
+        self.level = level
+        self.beginResetModel()
+        self.searched = 0
+        self.rows = None
+        self.tail = None
+        self._extend()
+        self.endResetModel()
+
+    def _extend(self):
+        """Add the lines indexed since the last call; return the number of rows added"""
+        end = len(self.index)
+        if end <= self.searched:
+            return 0
+        if self.text or self.level:
+            found = self.index.search(self.text, self.level, start=self.searched)
+            if self.rows is None:
+                self.rows = found
+            else:
+                self.rows.extend(found)
+            added = len(found)
+        else:
+            added = end - self.searched
+        self.searched = end
+        return added
+
+    def update(self):
+        """Pick up newly indexed lines; return True if rows were added"""
+        if self.tail is not None:
+            if not self.index.complete:
+                return False
+            # The first pass is done, switch from the tail to the whole log
+            self.set_filter(self.text, self.level)
+            return True
+        if len(self.index) < self.searched:
+            # The log was rotated
+            self.set_filter(self.text, self.level)
+            return True
+        before = self.rowCount()
+        if self.text or self.level:
+            found = self.index.search(self.text, self.level, start=self.searched)
+            self.searched = len(self.index)
+            if not found:
+                return False
+            self.beginInsertRows(QModelIndex(), before, before + len(found) - 1)
+            self.rows.extend(found)
+            self.endInsertRows()
+            return True
+        end = len(self.index)
+        if end <= self.searched:
+            return False
+        self.beginInsertRows(QModelIndex(), before, end - 1)
+        self.searched = end
+        self.endInsertRows()
+        return True
 
 class MessyFileOrganizerGUI(QMainWindow):
     def __init__(self):
@@ -32,6 +123,9 @@ class MessyFileOrganizerGUI(QMainWindow):
         config_dir = os.path.join(user_home, '.config', 'mfo')
         os.makedirs(config_dir, exist_ok=True)
         self.config_path = os.path.join(config_dir, 'config.json')
+        self.dedupe_journal_path = os.path.join(config_dir, 'dedupe-journal.log')
+        self.hash_cache_path = os.path.join(config_dir, 'hash-cache.sqlite3')
+        self.log_path = os.path.join(config_dir, 'messy_files.log')
         
         # Initialize theme settings
         self.settings = QSettings("MessyFileOrganizer", "AppSettings")
@@ -604,7 +698,7 @@ class MessyFileOrganizerGUI(QMainWindow):
             },
             "duplicate_detection": {
                 "enabled": False,
-                "action": "notify"  # notify, move, or delete
+                "action": "notify"  # notify, move, delete, or link
             },
             "retry_attempts": 3,
             "retry_delay": 2,
@@ -633,6 +727,7 @@ class MessyFileOrganizerGUI(QMainWindow):
         extensions_tab = self.create_extensions_tab()
         statistics_tab = self.create_statistics_tab()
         tools_tab = self.create_tools_tab()
+        logs_tab = self.create_logs_tab()
         advanced_tab = self.create_advanced_tab()
         
         # Add tabs to tab widget
@@ -641,6 +736,7 @@ class MessyFileOrganizerGUI(QMainWindow):
         tab_widget.addTab(extensions_tab, "File Extensions")
         tab_widget.addTab(statistics_tab, "Statistics")
         tab_widget.addTab(tools_tab, "Tools")
+        tab_widget.addTab(logs_tab, "Logs")
         tab_widget.addTab(advanced_tab, "Advanced")
         
         # Create save and cancel buttons
@@ -1126,48 +1222,17 @@ class MessyFileOrganizerGUI(QMainWindow):
         # Clear existing data
         self.stats_table.setRowCount(0)
         
-        # Get downloads folder path
-        downloads_folder = self.downloads_folder_edit.text()
-        
-        # Initialize counters
-        category_stats = {}
-        for category in self.config["folders"].keys():
-            category_folder = self.config["folders"][category]
-            if os.path.exists(category_folder):
-                file_count = 0
-                total_size = 0
-                
-                # Count files and calculate total size
-                for root, _, files in os.walk(category_folder):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        try:
-                            file_size = os.path.getsize(file_path)
-                            file_count += 1
-                            total_size += file_size
-                        except Exception:
-                            pass
-                
-                category_stats[category] = (file_count, total_size)
+        # Count files and sizes per category
+        category_stats = collect_statistics(self.config["folders"])
         
         # Add data to table
         for category, (file_count, total_size) in category_stats.items():
             row = self.stats_table.rowCount()
             self.stats_table.insertRow(row)
             
-            # Format size in human-readable format
-            if total_size < 1024:
-                size_str = f"{total_size} B"
-            elif total_size < 1024 * 1024:
-                size_str = f"{total_size / 1024:.2f} KB"
-            elif total_size < 1024 * 1024 * 1024:
-                size_str = f"{total_size / (1024 * 1024):.2f} MB"
-            else:
-                size_str = f"{total_size / (1024 * 1024 * 1024):.2f} GB"
-            
             self.stats_table.setItem(row, 0, QTableWidgetItem(category))
             self.stats_table.setItem(row, 1, QTableWidgetItem(str(file_count)))
-            self.stats_table.setItem(row, 2, QTableWidgetItem(size_str))
+            self.stats_table.setItem(row, 2, QTableWidgetItem(format_size(total_size)))
     
     def create_tools_tab(self):
         """Create the tools tab with additional functionality"""
@@ -1185,11 +1250,17 @@ class MessyFileOrganizerGUI(QMainWindow):
         self.duplicate_checkbox.setChecked(self.config.get("duplicate_detection", {}).get("enabled", False))
         duplicate_layout.addWidget(self.duplicate_checkbox)
         
+        # Near-duplicate image mode
+        self.similar_images_checkbox = QCheckBox("Find visually similar images (resized or re-encoded copies)")
+        self.similar_images_checkbox.setChecked(self.config.get("duplicate_detection", {}).get("similar_images", False))
+        duplicate_layout.addWidget(self.similar_images_checkbox)
+        
         # Action selection
         action_layout = QHBoxLayout()
         action_label = QLabel("When duplicates are found:")
         self.duplicate_action_combo = QComboBox()
-        self.duplicate_action_combo.addItems(["Notify only", "Move to duplicates folder", "Delete duplicates"])
+        self.duplicate_action_combo.addItems(["Notify only", "Move to duplicates folder", "Delete duplicates",
+                                              "Replace duplicates with links"])
         
         # Set current action
         current_action = self.config.get("duplicate_detection", {}).get("action", "notify")
@@ -1199,6 +1270,8 @@ class MessyFileOrganizerGUI(QMainWindow):
             self.duplicate_action_combo.setCurrentIndex(1)
         elif current_action == "delete":
             self.duplicate_action_combo.setCurrentIndex(2)
+        elif current_action == "link":
+            self.duplicate_action_combo.setCurrentIndex(3)
         
         action_layout.addWidget(action_label)
         action_layout.addWidget(self.duplicate_action_combo)
@@ -1209,6 +1282,11 @@ class MessyFileOrganizerGUI(QMainWindow):
         scan_button.clicked.connect(self.scan_duplicates)
         duplicate_layout.addWidget(scan_button)
         
+        # Undo linking button
+        undo_link_button = QPushButton("Restore Linked Duplicates as Copies")
+        undo_link_button.clicked.connect(self.undo_duplicate_links)
+        duplicate_layout.addWidget(undo_link_button)
+        
         # Progress bar
         self.duplicate_progress = QProgressBar()
         self.duplicate_progress.setVisible(False)
@@ -1273,6 +1351,91 @@ class MessyFileOrganizerGUI(QMainWindow):
         tab.setWidget(content_widget)
         return tab
     
+    def create_logs_tab(self):
+        """Create the log viewer tab: the tail shows at once while the log is indexed in the background"""
+        tab = QWidget()
+        layout = QVBoxLayout(tab)
+
+        filter_layout = QHBoxLayout()
+        self.log_search_edit = QLineEdit()
+        self.log_search_edit.setPlaceholderText("Search for a file name or text...")
+        self.log_search_edit.returnPressed.connect(self.filter_log)
+        filter_layout.addWidget(self.log_search_edit)
+        self.log_level_combo = QComboBox()
+        self.log_level_combo.addItems(["All levels"] + list(LOG_LEVELS))
+        self.log_level_combo.currentIndexChanged.connect(self.filter_log)
+        filter_layout.addWidget(self.log_level_combo)
+        search_button = QPushButton("Search")
+        search_button.clicked.connect(self.filter_log)
+        filter_layout.addWidget(search_button)
+        layout.addLayout(filter_layout)
+
+        self.log_index = LogIndex(self.log_path)
+        self.log_model = LogListModel(self.log_index, self)
+        self.log_view = QListView()
+        self.log_view.setUniformItemSizes(True)
+        self.log_view.setModel(self.log_model)
+        self.log_view.setFont(QFont("Monospace"))
+        layout.addWidget(self.log_view)
+        self.log_view.scrollToBottom()
+
+        self.follow_log_checkbox = QCheckBox("Follow new lines")
+        self.follow_log_checkbox.setChecked(True)
+        self.log_status_label = QLabel("Indexing log...")
+        self.log_search_ms = 0.0
+        status_layout = QHBoxLayout()
+        status_layout.addWidget(self.follow_log_checkbox)
+        status_layout.addStretch()
+        status_layout.addWidget(self.log_status_label)
+        layout.addLayout(status_layout)
+
+        # The indexer thread only touches the index; the timer brings new
+        # lines into the view on the GUI thread
+        self.log_indexer = LogIndexer(self.log_index)
+        self.log_indexer.start()
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.update_log_view)
+        self.log_timer.start(500)
+        return tab
+
+    def filter_log(self):
+        """Show only the log lines matching the search text and level"""
+        level = self.log_level_combo.currentText()
+        started = time.perf_counter()
+        self.log_model.set_filter(self.log_search_edit.text().strip(),
+                                  None if level == "All levels" else level)
+        self.log_search_ms = (time.perf_counter() - started) * 1000
+        self.update_log_status()
+        self.log_view.scrollToBottom()
+
+    def update_log_view(self):
+        """Add lines indexed since the last tick and keep the view at the bottom when following"""
+        if self.log_model.update():
+            if self.follow_log_checkbox.isChecked():
+                self.log_view.scrollToBottom()
+            self.update_log_status()
+        elif not self.log_index.complete:
+            self.update_log_status()
+
+    def update_log_status(self):
+        index = self.log_index
+        if not index.size:
+            status = f"No log entries yet in {self.log_path}"
+        elif not index.complete:
+            percent = int(index.indexed * 100 / index.size)
+            status = f"Indexing log... {percent}% ({len(index)} lines)"
+        else:
+            status = f"{len(index)} lines, {format_size(index.size)}"
+        if self.log_model.text or self.log_model.level:
+            status += f" - {self.log_model.rowCount()} matches (searched in {self.log_search_ms:.1f}ms)"
+        self.log_status_label.setText(status)
+
+    def closeEvent(self, event):
+        self.log_timer.stop()
+        self.log_indexer.stop()
+        self.log_index.close()
+        super().closeEvent(event)
+
     def scan_duplicates(self):
         """Scan for duplicate files in the organized folders"""
         # Clear previous results
@@ -1288,45 +1451,21 @@ class MessyFileOrganizerGUI(QMainWindow):
         # Get all folders to scan
         folders_to_scan = list(self.config["folders"].values())
         
-        # Dictionary to store file hashes
-        file_hashes = defaultdict(list)
-        total_files = 0
-        processed_files = 0
-        
-        # First pass: count total files
-        for folder in folders_to_scan:
-            if os.path.exists(folder):
-                for root, _, files in os.walk(folder):
-                    total_files += len(files)
-        
-        # Second pass: compute hashes
-        for folder in folders_to_scan:
-            if os.path.exists(folder):
-                for root, _, files in os.walk(folder):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        try:
-                            # For large files, just hash the first 8KB for speed
-                            file_size = os.path.getsize(file_path)
-                            if file_size > 8192:
-                                with open(file_path, 'rb') as f:
-                                    file_hash = hashlib.md5(f.read(8192)).hexdigest()
-                            else:
-                                with open(file_path, 'rb') as f:
-                                    file_hash = hashlib.md5(f.read()).hexdigest()
-                            
-                            # Store the file path with its hash
-                            file_hashes[file_hash].append(file_path)
-                        except Exception as e:
-                            print(f"Error hashing {file_path}: {e}")
-                        
-                        processed_files += 1
-                        progress = int((processed_files / total_files) * 100) if total_files > 0 else 0
-                        # Update UI from the main thread
-                        self.duplicate_progress.setValue(progress)
+        def update_progress(processed_files, total_files):
+            progress = int((processed_files / total_files) * 100) if total_files > 0 else 0
+            self.duplicate_progress.setValue(progress)
+        
+        if self.similar_images_checkbox.isChecked():
+            self._scan_similar_images(update_progress)
+            self.duplicate_progress.setVisible(False)
+            return
         
         # Find duplicates (files with the same hash)
-        duplicates = {hash_val: paths for hash_val, paths in file_hashes.items() if len(paths) > 1}
+        cache = HashCache(self.hash_cache_path)
+        try:
+            duplicates = find_duplicates(folders_to_scan, update_progress, cache=cache)
+        finally:
+            cache.close()
         
         # Update the UI with results
         if duplicates:
@@ -1345,9 +1484,48 @@ class MessyFileOrganizerGUI(QMainWindow):
         else:
             self.duplicate_list.addItem("No duplicates found.")
         
+        # Replace verified duplicates with links if that action is selected
+        if duplicates and self.duplicate_action_combo.currentIndex() == 3:
+            self.duplicate_progress.setValue(0)
+            mode = self.config.get("duplicate_detection", {}).get("link_mode", "auto")
+            deduplicator = Deduplicator(self.dedupe_journal_path, mode)
+            files_linked, bytes_reclaimed = deduplicator.run(duplicates.values(), update_progress)
+            self.duplicate_list.addItem(f"Linked {files_linked} duplicates, reclaiming {format_size(bytes_reclaimed)}.")
+        
         # Hide progress bar when done
         self.duplicate_progress.setVisible(False)
     
+    def _scan_similar_images(self, update_progress):
+        """List groups of visually similar images in the Images folder"""
+        images_folder = self.config["folders"].get("Images")
+        extensions = self.config["file_types"].get("Images", [])
+        max_distance = self.config.get("duplicate_detection", {}).get("max_distance", DEFAULT_MAX_DISTANCE)
+        cache = HashCache(self.hash_cache_path)
+        try:
+            groups = find_similar_images([images_folder] if images_folder else [], max_distance, extensions,
+                                         cache, progress=update_progress)
+        finally:
+            cache.close()
+        
+        if groups:
+            for group in groups:
+                self.duplicate_list.addItem(f"Found {len(group)} similar images:")
+                for path in group:
+                    item = QListWidgetItem(f"  {path}")
+                    item.setData(Qt.UserRole, path)
+                    self.duplicate_list.addItem(item)
+                self.duplicate_list.addItem("")
+        else:
+            self.duplicate_list.addItem("No similar images found.")
+    
+    def undo_duplicate_links(self):
+        """Turn previously linked duplicates back into independent copies"""
+        def undo_thread():
+            restored = Deduplicator(self.dedupe_journal_path).undo()
+            self.duplicate_list.addItem(f"Restored {restored} linked duplicates as independent copies.")
+        
+        threading.Thread(target=undo_thread, daemon=True).start()
+    
     def save_config(self):
         # Update config from UI (existing code)
         self.config["downloads_folder"] = self.downloads_folder_edit.text()
@@ -1379,6 +1557,7 @@ class MessyFileOrganizerGUI(QMainWindow):
         if not "duplicate_detection" in self.config:
             self.config["duplicate_detection"] = {}
         self.config["duplicate_detection"]["enabled"] = self.duplicate_checkbox.isChecked()
+        self.config["duplicate_detection"]["similar_images"] = self.similar_images_checkbox.isChecked()
         
         action_index = self.duplicate_action_combo.currentIndex()
         if action_index == 0:
@@ -1387,6 +1566,8 @@ class MessyFileOrganizerGUI(QMainWindow):
             self.config["duplicate_detection"]["action"] = "move"
         elif action_index == 2:
             self.config["duplicate_detection"]["action"] = "delete"
+        elif action_index == 3:
+            self.config["duplicate_detection"]["action"] = "link"
         
         # Update scheduled organization settings
         if not "scheduled_organization" in self.config:
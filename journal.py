@@ -0,0 +1,198 @@
+import os
+import json
+import filecmp
+import threading
+
+
+class IntentLog:
+    """Write-ahead log of file moves so interrupted sweeps can be recovered
+
+    Before a batch of moves starts, an "intent" record for every move is
+    appended and the log is fsynced once. Cross-device moves also get a
+    "copy" record with the inode of the copy as soon as it is created, and
+    completed moves are marked with a "done" record. On startup, recover()
+    inspects every intent without a matching "done" and either rolls it
+    forward or back. Long-running jobs can also store "checkpoint" records
+    to resume where they stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self._open_intents = {}
+        self.checkpoints = {}
+        self._file = None
+
+    def _append(self, record):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps(record))
+        self._file.write("\n")
+
+    def sync(self):
+        """Flush buffered records and fsync them to disk"""
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def intent(self, src, dst, size, cross_device=False):
+        """Record that src is about to be moved to dst and return the intent id"""
+        with self._lock:
+            intent_id = self._next_id
+            self._next_id += 1
+            record = {"op": "intent", "id": intent_id, "src": src, "dst": dst, "size": size, "cross": cross_device}
+            self._open_intents[intent_id] = record
+            self._append(record)
+            return intent_id
+
+    def copying(self, intent_id, inode):
+        """Record the inode of the copy a cross-device move just created
+
+        The record is flushed at once, so recovery only ever removes a
+        destination this log shows to be its own copy.
+        """
+        with self._lock:
+            record = self._open_intents.get(intent_id)
+            if record is not None:
+                record["ino"] = inode
+            self._append({"op": "copy", "id": intent_id, "ino": inode})
+            self._file.flush()
+
+    def redirect(self, intent_id, dst):
+        """Point an open intent at a new destination after its first name was taken
+
+        The intent is appended again under the same id, which replaces the
+        earlier record when the log is read back.
+        """
+        with self._lock:
+            record = self._open_intents.get(intent_id)
+            if record is None:
+                return
+            record.pop("ino", None)
+            record["dst"] = dst
+            self._append(record)
+
+    def done(self, intent_id, dst=None):
+        """Record that an intent completed, possibly under a different destination name"""
+        with self._lock:
+            self._open_intents.pop(intent_id, None)
+            record = {"op": "done", "id": intent_id}
+            if dst is not None:
+                record["dst"] = dst
+            self._append(record)
+
+    def checkpoint(self, key, position):
+        """Record how far the job identified by key has progressed; None marks it finished"""
+        with self._lock:
+            if position is None:
+                self.checkpoints.pop(key, None)
+            else:
+                self.checkpoints[key] = position
+            self._append({"op": "checkpoint", "key": key, "position": position})
+        self.sync()
+
+    def _read(self):
+        intents = {}
+        checkpoints = {}
+        if not os.path.exists(self.path):
+            return intents, checkpoints
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final record from a crash mid-write
+                    continue
+                op = record.get("op")
+                if op == "intent":
+                    intents[record["id"]] = record
+                elif op == "copy":
+                    if record["id"] in intents:
+                        intents[record["id"]]["ino"] = record["ino"]
+                elif op == "done":
+                    intents.pop(record["id"], None)
+                elif op == "checkpoint":
+                    if record["position"] is None:
+                        checkpoints.pop(record["key"], None)
+                    else:
+                        checkpoints[record["key"]] = record["position"]
+        return intents, checkpoints
+
+    def recover(self, logger):
+        """Resolve every incomplete intent left by a previous run, then compact the log
+
+        Returns a list of (src, dst, outcome) tuples describing what was
+        done. Unresolved intents stay in the log.
+        """
+        intents, self.checkpoints = self._read()
+        outcomes = []
+        for record in intents.values():
+            src, dst = record["src"], record["dst"]
+            outcome = self._recover_intent(record)
+            logger.warning(f"Recovered interrupted move {src} to {dst}: {outcome}")
+            outcomes.append((src, dst, outcome))
+            if outcome.startswith("unresolved"):
+                # Kept in the log so the next start sees it again
+                with self._lock:
+                    self._open_intents[record["id"]] = record
+        with self._lock:
+            self._next_id = max(self._next_id, max(intents, default=0) + 1)
+        self.compact()
+        return outcomes
+
+    def _recover_intent(self, record):
+        src, dst, size = record["src"], record["dst"], record.get("size")
+        src_exists = os.path.exists(src)
+        dst_exists = os.path.exists(dst)
+        if not src_exists and dst_exists:
+            return "completed"
+        if src_exists and not dst_exists:
+            return "not started"
+        if not src_exists and not dst_exists:
+            return "lost"
+        if not record.get("cross"):
+            # A rename is atomic, so if dst exists it finished and src is a
+            # new file that took the old name since, unless the rename was
+            # a hardlink that was interrupted before unlinking src
+            try:
+                if os.path.samefile(src, dst):
+                    os.remove(src)
+            except OSError as e:
+                return f"unresolved ({e})"
+            return "completed"
+        # Both exist: a cross-device copy may have been interrupted before
+        # the source was removed. Only touch dst if it is provably our copy.
+        try:
+            dst_stat = os.lstat(dst)
+            if record.get("ino") != dst_stat.st_ino:
+                return "unresolved (destination is not the recorded copy)"
+            if dst_stat.st_size == size and filecmp.cmp(src, dst, shallow=False):
+                os.remove(src)
+                return "rolled forward"
+            if size is None or dst_stat.st_size > size:
+                return "unresolved (destination is larger than the source)"
+            os.remove(dst)
+            return "rolled back"
+        except OSError as e:
+            return f"unresolved ({e})"
+
+    def compact(self):
+        """Rewrite the log with only open intents and unfinished checkpoints"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as file:
+                for record in self._open_intents.values():
+                    file.write(json.dumps(record) + "\n")
+                for key, position in self.checkpoints.items():
+                    file.write(json.dumps({"op": "checkpoint", "key": key, "position": position}) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
+
+    def close(self):
+        self.compact()
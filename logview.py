@@ -0,0 +1,289 @@
+import os
+import re
+import mmap
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL")
+# Lines are indexed in chunks so the viewer can show progress and search
+# the part that is done while a large log is still being indexed
+INDEX_CHUNK = 16 * 1024 * 1024
+TAIL_BYTES = 256 * 1024
+# File-name terms are hashed into a fixed number of posting lists, so the
+# index costs a few bytes per mention however many distinct names a log has
+TERM_BUCKETS = 1 << 18
+_SEPARATOR = b" - "
+
+
+def name_terms(text):
+    """Yield the lowercased file names in text: the last path component of each word with a dot or slash"""
+    for word in text.split():
+        if b"." in word or b"/" in word or b"\\" in word:
+            word = word.rpartition(b"/")[2].rpartition(b"\\")[2].rstrip(b".,;:").lower()
+            if word:
+                yield word
+
+
+def _from(numbers, start):
+    """The part of a sorted posting list at or after line start"""
+    return numbers[bisect_left(numbers, start):] if start else numbers
+
+
+def _intersect(first, second):
+    lookup = set(second)
+    return array('L', (line for line in first if line in lookup))
+
+
+class LogIndex:
+    """Memory-mapped view of a log file with a line-offset index and an inverted index
+
+    refresh() maps any new complete lines, records their start offsets and
+    adds each line's level and the file names it mentions to the inverted
+    index, so a search for a file name only reads the few lines whose names
+    hash to the same posting list instead of scanning the log. Lines are
+    read straight from the map on demand, so nothing but the offsets and
+    postings is held in memory. A log that shrinks or is replaced
+    (rotation) is indexed again from the start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._map = None
+        self._file = None
+        self._identity = None
+        self.offsets = array('Q', [0])
+        self.indexed = 0
+        self.size = 0
+        self._last_newline = 0
+        self.levels = {}
+        self.buckets = [None] * TERM_BUCKETS
+        self.generation = getattr(self, 'generation', 0) + 1
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+            if self._file is not None:
+                self._file.close()
+            self._map = self._file = None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def complete(self):
+        """True once every complete line in the mapped file has been indexed"""
+        return self._map is not None and self.indexed >= self._last_newline
+
+    def _remap(self):
+        """Map the file again if it grew, or start over if it shrank or was replaced; return True if it changed"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            if self._map is not None:
+                self.close()
+                self._reset()
+                return True
+            return False
+        identity = (stat.st_dev, stat.st_ino)
+        if self._identity is not None and (identity != self._identity or stat.st_size < self.size):
+            self.close()
+            self._reset()
+        if stat.st_size == self.size and self._map is not None:
+            return False
+        if stat.st_size == 0:
+            return False
+        if self._map is not None:
+            self._map.close()
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._identity = identity
+        self.size = len(self._map)
+        self._last_newline = self._map.rfind(b"\n") + 1
+        return True
+
+    def refresh(self, max_bytes=INDEX_CHUNK):
+        """Index up to max_bytes of new lines; return the number of lines added"""
+        with self._lock:
+            self._remap()
+            if self._map is None or self.indexed >= self._last_newline:
+                return 0
+            end = self._map.rfind(b"\n", self.indexed, min(self._last_newline, self.indexed + max_bytes)) + 1
+            if end <= self.indexed:
+                # A single line longer than max_bytes
+                end = self._map.find(b"\n", self.indexed) + 1
+            chunk = self._map[self.indexed:end]
+            start_line = len(self)
+            lines = chunk.split(b"\n")
+            lines.pop()
+            base = self.indexed
+            self.offsets.extend(base + offset for offset in accumulate(len(line) + 1 for line in lines))
+            self.indexed = end
+            generation = self.generation
+        self._index_terms(lines, start_line, generation)
+        return len(lines)
+
+    def _index_terms(self, lines, start_line, generation):
+        # Postings for the chunk are collected without the lock, then
+        # appended to the shared lists in one short step so the viewer
+        # never waits long
+        mask = TERM_BUCKETS - 1
+        levels = {}
+        buckets = {}
+        for number, line in enumerate(lines, start_line):
+            parts = line.split(_SEPARATOR, 2)
+            if len(parts) == 3:
+                numbers = levels.get(parts[1])
+                if numbers is None:
+                    numbers = levels[parts[1]] = array('L')
+                numbers.append(number)
+                message = parts[2]
+            else:
+                message = line
+            for term in name_terms(message):
+                bucket = hash(term) & mask
+                numbers = buckets.get(bucket)
+                if numbers is None:
+                    numbers = buckets[bucket] = array('L')
+                if not numbers or numbers[-1] != number:
+                    numbers.append(number)
+        with self._lock:
+            if generation != self.generation:
+                # The log was replaced while this chunk was being indexed
+                return
+            for level, numbers in levels.items():
+                level = level.decode('ascii', 'replace').upper()
+                if level in self.levels:
+                    self.levels[level].extend(numbers)
+                else:
+                    self.levels[level] = numbers
+            shared = self.buckets
+            for bucket, numbers in buckets.items():
+                if shared[bucket] is None:
+                    shared[bucket] = numbers
+                else:
+                    shared[bucket].extend(numbers)
+
+    def build(self, stop=None, progress=None):
+        """Index everything up to the current end of the file, in chunks"""
+        while not (stop and stop.is_set()):
+            if not self.refresh():
+                break
+            if progress:
+                progress(self.indexed, self.size)
+
+    def line(self, number):
+        with self._lock:
+            if self._map is None or not 0 <= number < len(self):
+                return ""
+            return self._map[self.offsets[number]:self.offsets[number + 1]].rstrip(b"\r\n").decode('utf-8', 'replace')
+
+    def tail(self, count=200):
+        """Return the last complete lines straight from the end of the file, before anything is indexed"""
+        with self._lock:
+            self._remap()
+            if self._map is None:
+                return []
+            end = self._last_newline
+            start = max(0, end - TAIL_BYTES)
+            lines = self._map[start:end].split(b"\n")[:-1]
+            if start > 0:
+                lines = lines[1:]
+            return [line.rstrip(b"\r").decode('utf-8', 'replace') for line in lines[-count:]]
+
+    def _line_bytes(self, number):
+        return self._map[self.offsets[number]:self.offsets[number + 1]]
+
+    def _level_of(self, number):
+        parts = self._line_bytes(number).split(_SEPARATOR, 2)
+        return parts[1].decode('ascii', 'replace').upper() if len(parts) == 3 else None
+
+    def search(self, text="", level=None, start=0):
+        """Return the sorted line numbers from start on containing text (case-insensitive) at the given level
+
+        Text with a file name in it is looked up in the inverted index and
+        only the candidate lines are read to confirm the match. The index
+        only knows whole names, so if no line is confirmed, e.g. for part of
+        a name or a folder, the mapped file is scanned instead, as it is for
+        any other text. Pass the previous line count as start to search only
+        lines added since.
+        """
+        query = text.strip().encode('utf-8')
+        level = level.upper() if level else None
+        with self._lock:
+            if not query:
+                if level:
+                    return array('L', _from(self.levels.get(level, array('L')), start))
+                return array('L', range(start, len(self)))
+            if query.upper().decode('utf-8', 'replace') in LOG_LEVELS and not level:
+                return array('L', _from(self.levels.get(query.upper().decode(), array('L')), start))
+
+            matches = None
+            terms = list(name_terms(query))
+            if terms:
+                candidates = None
+                for term in terms:
+                    numbers = self.buckets[hash(term) & (TERM_BUCKETS - 1)]
+                    if numbers is None:
+                        candidates = ()
+                        break
+                    numbers = _from(numbers, start)
+                    candidates = numbers if candidates is None else _intersect(candidates, numbers)
+                lowered = query.lower()
+                matches = array('L', (number for number in candidates
+                                      if lowered in self._line_bytes(number).lower()))
+            if not matches:
+                matches = self.scan(query, start)
+            if level:
+                matches = array('L', (number for number in matches if self._level_of(number) == level))
+            return matches
+
+    def scan(self, query, start=0):
+        """Find the lines from start on containing query (bytes, ASCII case-insensitive) by scanning the map"""
+        pattern = re.compile(re.escape(query), re.IGNORECASE)
+        matches = array('L')
+        with self._lock:
+            if self._map is None or start >= len(self):
+                return matches
+            found = pattern.search(self._map, self.offsets[start], self.indexed)
+            while found:
+                number = bisect_right(self.offsets, found.start()) - 1
+                matches.append(number)
+                found = pattern.search(self._map, self.offsets[number + 1], self.indexed)
+        return matches
+
+
+class LogIndexer(threading.Thread):
+    """Background thread that builds a LogIndex and then keeps it up to date"""
+
+    def __init__(self, index, interval=0.5, on_update=None):
+        super().__init__(daemon=True)
+        self.index = index
+        self.interval = interval
+        self.on_update = on_update
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            added = 0
+            try:
+                while not self._stop_event.is_set():
+                    count = self.index.refresh()
+                    if not count:
+                        break
+                    added += count
+            except (OSError, ValueError):
+                pass
+            if added and self.on_update:
+                self.on_update(added)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
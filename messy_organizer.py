@@ -2,6 +2,7 @@
 import sys
 import os
 import argparse
+from reports import add_subcommands
 
 def main():
     parser = argparse.ArgumentParser(description="Messy File Organizer - A tool to organize your messy downloads folder")
@@ -11,10 +12,26 @@ def main():
     parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
                         help='Set the logging level')
     parser.add_argument('--log-to-file', action='store_true', help='Log to file instead of console')
+    parser.add_argument('--paused', action='store_true', help='Start with monitoring paused (CLI mode)')
+    parser.add_argument('--sweep', action='store_true', help='Organize files already in the downloads folder on startup (CLI mode)')
+    parser.add_argument('--profile', action='store_true', help='Time each organizer stage and print a report on exit (CLI mode)')
+    parser.add_argument('--profile-dump', metavar='FILE', help='Write a cProfile/pstats dump of the startup sweep to FILE (CLI mode)')
+    parser.add_argument('--plan', metavar='FILE', help='Write the moves a sweep would make to FILE as JSON lines and exit (CLI mode)')
+    parser.add_argument('--apply-plan', metavar='FILE', help='Execute a plan written by --plan and exit (CLI mode)')
+    parser.add_argument('--dedupe', action='store_true', help='Replace duplicate files with hardlinks or reflinks and exit (CLI mode)')
+    parser.add_argument('--undo-dedupe', action='store_true', help='Turn deduplicated files back into independent copies and exit (CLI mode)')
+    parser.add_argument('--similar-images', action='store_true', help='List groups of visually similar images and exit (CLI mode)')
+    parser.add_argument('--reshard', action='store_true', help='Move files in sharded category folders into their shard subfolders in the background (CLI mode)')
+    parser.add_argument('--record-trace', metavar='FILE', help='Record every watcher event to FILE for replay with eventtrace.py (CLI mode)')
+    add_subcommands(parser)
     
     args = parser.parse_args()
     
-    if args.cli:
+    if args.command:
+        # Headless reports never import Qt or the organizer
+        from reports import main as reports_main
+        sys.exit(reports_main(args))
+    elif args.cli:
         # Import and run the CLI version
         from script import main as cli_main
         cli_main(args)
@@ -0,0 +1,530 @@
+import io
+import os
+import re
+import struct
+from fnmatch import fnmatchcase
+from collections import OrderedDict
+from datetime import datetime
+from threading import Lock
+from time import perf_counter
+from types import MappingProxyType
+
+METADATA_KINDS = {
+    ".jpg": "image", ".jpeg": "image", ".tif": "image", ".tiff": "image", ".webp": "image", ".png": "image",
+    ".pdf": "pdf",
+    ".mp4": "video", ".m4v": "video", ".mov": "video", ".3gp": "video", ".m4a": "audio",
+}
+DEFAULT_BYTE_BUDGET = 64 * 1024
+DEFAULT_CACHE_ENTRIES = 10000
+# PDFs keep the version in the first line and the trailer, which points at
+# the document info dictionary, in the last few hundred bytes
+PDF_HEAD_SIZE = 1024
+PDF_TAIL_SIZE = 1024
+PDF_OBJECT_SIZE = 2048
+# Seconds between the MP4 epoch (1904-01-01) and the Unix epoch
+MP4_EPOCH_OFFSET = 2082844800
+
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+EXIF_MAKE = 271
+EXIF_MODEL = 272
+EXIF_ASCII = 2
+EXIF_LONG = 4
+EXIF_MAX_ENTRIES = 512
+# SOF0-SOF15 carry the image size; C4, C8 and CC share the range but don't
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+JPEG_SOS = 0xDA
+JPEG_EOI = 0xD9
+JPEG_APP1 = 0xE1
+JPEG_SOI = b"\xff\xd8"
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Other image headers worth handing to Pillow: TIFF, GIF and BMP (WebP is
+# RIFF....WEBP)
+PILLOW_SIGNATURES = (b"II*\x00", b"MM\x00*", b"GIF8", b"BM")
+# Read at once; holds the EXIF block of most photos
+IMAGE_HEAD_SIZE = 4096
+
+PDF_INFO_KEYS = {"Title": "title", "Author": "author", "Subject": "subject",
+                 "Creator": "creator", "Producer": "producer", "CreationDate": "created"}
+_PDF_INFO_ENTRY = re.compile(rb"/(Title|Author|Subject|Creator|Producer|CreationDate)\s*(\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>)", re.S)
+_PDF_INFO_REF = re.compile(rb"/Info\s+(\d+)\s+(\d+)\s+R")
+_PDF_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+_EXIF_DATE = re.compile(r"(\d{4}):(\d{2}):(\d{2}) (\d{2}):(\d{2}):(\d{2})")
+_PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+
+
+class BudgetExceeded(Exception):
+    """Raised when extracting a file's metadata would read more than the byte budget"""
+
+
+class BudgetedFile(io.RawIOBase):
+    """Read-only file wrapper that counts bytes read and stops at a budget"""
+
+    def __init__(self, file, budget):
+        self.file = file
+        self.budget = budget
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        remaining = self.budget - self.bytes_read
+        if remaining <= 0:
+            raise BudgetExceeded(f"Read more than {self.budget} bytes")
+        view = memoryview(buffer)[:remaining]
+        count = self.file.readinto(view)
+        self.bytes_read += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+
+def parse_date(text):
+    """Parse an EXIF, PDF or ISO date string into a naive datetime, or return None"""
+    text = text.strip()
+    exif_date = _EXIF_DATE.fullmatch(text[:19])
+    if exif_date:
+        # The common EXIF layout, without strptime's overhead
+        try:
+            return datetime(*map(int, exif_date.groups()))
+        except ValueError:
+            return None
+    if text.startswith("D:"):
+        # YYYY[MM[DD[HH[mm[SS]]]]], the missing month and day being 1
+        digits = re.match(r"\d{4,14}", text[2:])
+        if not digits or len(digits.group(0)) % 2:
+            return None
+        digits = digits.group(0)
+        fields = [int(digits[:4])] + [int(digits[i:i + 2]) for i in range(4, len(digits), 2)]
+        fields += [1] * (3 - len(fields))
+        try:
+            return datetime(*fields)
+        except ValueError:
+            return None
+    for fmt in ("%Y:%m:%d %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text[:19], fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def _pdf_unescape(match):
+    escape = match.group(1)
+    if escape[:1].isdigit():
+        return bytes([int(escape, 8) & 0xFF])
+    return _PDF_ESCAPES.get(escape, escape)
+
+
+def _pdf_string(raw):
+    if raw.startswith(b"<"):
+        value = bytes.fromhex(re.sub(rb"\s", b"", raw[1:-1]).decode("ascii"))
+    else:
+        value = re.sub(rb"\\([nrtbf()\\]|[0-7]{1,3})", _pdf_unescape, raw[1:-1])
+    if value.startswith(b"\xfe\xff"):
+        return value[2:].decode("utf-16-be", "replace")
+    return value.decode("latin-1")
+
+
+def _pdf_info(chunk):
+    info = {}
+    for key, raw in _PDF_INFO_ENTRY.findall(chunk):
+        info.setdefault(PDF_INFO_KEYS[key.decode("ascii")], _pdf_string(raw))
+    return info
+
+
+def _pdf_object_offset(file, xref_offset, number):
+    """Find an object's offset in a classic xref table, or None (e.g. for xref streams)"""
+    file.seek(xref_offset)
+    if file.read(4) != b"xref":
+        return None
+    position = xref_offset + 4
+    while True:
+        file.seek(position)
+        line = file.read(32)
+        match = re.match(rb"\s*(\d+)\s+(\d+)\s*?\r?\n", line)
+        if not match:
+            return None
+        first, count = int(match.group(1)), int(match.group(2))
+        entries = position + match.end()
+        if first <= number < first + count:
+            file.seek(entries + (number - first) * 20)
+            entry = file.read(20)
+            if entry[17:18] != b"n":
+                return None
+            return int(entry[:10])
+        position = entries + count * 20
+
+
+def pdf_metadata(file, size):
+    head = file.read(PDF_HEAD_SIZE)
+    if not head.startswith(b"%PDF-"):
+        return None
+    metadata = {"version": head[5:8].decode("ascii", "replace")}
+    file.seek(max(0, size - PDF_TAIL_SIZE))
+    tail = file.read(PDF_TAIL_SIZE)
+
+    info = {}
+    reference = _PDF_INFO_REF.search(tail) or _PDF_INFO_REF.search(head)
+    startxref = _PDF_STARTXREF.findall(tail)
+    if reference and startxref:
+        offset = _pdf_object_offset(file, int(startxref[-1]), int(reference.group(1)))
+        if offset is not None:
+            file.seek(offset)
+            info = _pdf_info(file.read(PDF_OBJECT_SIZE))
+    if not info:
+        # Xref streams can't be followed without inflating them, but many
+        # writers put the info dictionary right before the trailer
+        info = _pdf_info(tail) or _pdf_info(head)
+    metadata.update(info)
+    if "created" in metadata:
+        metadata["date"] = parse_date(metadata.pop("created"))
+    return metadata
+
+
+def _read_box_header(file, offset, end):
+    file.seek(offset)
+    header = file.read(8)
+    if len(header) < 8:
+        return None
+    box_size, box_type = struct.unpack(">I4s", header)
+    header_size = 8
+    if box_size == 1:
+        box_size = struct.unpack(">Q", file.read(8))[0]
+        header_size = 16
+    elif box_size == 0:
+        box_size = end - offset
+    if box_size < header_size:
+        return None
+    return box_size, box_type, header_size
+
+
+def mp4_metadata(file, size):
+    """Walk the top-level MP4/QuickTime boxes by their headers, reading only ftyp and moov/mvhd"""
+    metadata = None
+    offset = 0
+    while offset + 8 <= size:
+        box = _read_box_header(file, offset, size)
+        if box is None:
+            break
+        box_size, box_type, header_size = box
+        if metadata is None:
+            if box_type not in (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip"):
+                return None
+            metadata = {}
+        if box_type == b"ftyp":
+            metadata["brand"] = file.read(4).decode("latin-1").strip()
+        elif box_type == b"moov":
+            metadata.update(_mvhd(file, offset + header_size, offset + box_size))
+            break
+        offset += box_size
+    return metadata
+
+
+def _mvhd(file, offset, end):
+    while offset + 8 <= end:
+        box = _read_box_header(file, offset, end)
+        if box is None:
+            break
+        box_size, box_type, header_size = box
+        if box_type == b"mvhd":
+            version = file.read(4)[0]
+            if version == 1:
+                created, _, timescale, duration = struct.unpack(">QQIQ", file.read(28))
+            else:
+                created, _, timescale, duration = struct.unpack(">IIII", file.read(16))
+            metadata = {}
+            if created > MP4_EPOCH_OFFSET:
+                metadata["date"] = datetime.fromtimestamp(created - MP4_EPOCH_OFFSET)
+            if timescale:
+                metadata["duration"] = duration / timescale
+            return metadata
+        offset += box_size
+    return {}
+
+
+def _add_exif(metadata, taken, make, model):
+    if taken:
+        metadata["date"] = parse_date(str(taken))
+    for value, key in ((make, "make"), (model, "model")):
+        if value:
+            metadata[key] = str(value).strip("\x00 ")
+    if "make" in metadata or "model" in metadata:
+        metadata["camera"] = " ".join(metadata[key] for key in ("make", "model") if key in metadata)
+
+
+def _exif_ifd(read, base, offset, order, wanted):
+    """Read the wanted ASCII and LONG tags of one TIFF IFD"""
+    count = struct.unpack(order + "H", read(base + offset, 2))[0]
+    entries = read(base + offset + 2, 12 * min(count, EXIF_MAX_ENTRIES))
+    tags = {}
+    for position in range(0, len(entries) - 11, 12):
+        tag, kind, length = struct.unpack(order + "HHI", entries[position:position + 8])
+        if tag not in wanted:
+            continue
+        value = entries[position + 8:position + 12]
+        if kind == EXIF_LONG:
+            tags[tag] = struct.unpack(order + "I", value)[0]
+        elif kind == EXIF_ASCII:
+            if length > 4:
+                value = read(base + struct.unpack(order + "I", value)[0], min(length, 256))
+            tags[tag] = value[:length].split(b"\x00", 1)[0].decode("latin-1")
+    return tags
+
+
+def _exif_tags(read, base):
+    """Read the date and camera tags from a TIFF-structured EXIF block at base"""
+    tiff = read(base, 8)
+    order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if order is None or len(tiff) < 8:
+        return {}
+    exif = _exif_ifd(read, base, struct.unpack(order + "I", tiff[4:8])[0], order,
+                     (EXIF_MAKE, EXIF_MODEL, EXIF_DATETIME, EXIF_IFD))
+    if EXIF_IFD in exif:
+        exif.update(_exif_ifd(read, base, exif[EXIF_IFD], order, (EXIF_DATETIME_ORIGINAL,)))
+    return exif
+
+
+def jpeg_metadata(read):
+    """Walk the JPEG marker segments up to the image data, reading only SOF and the EXIF IFDs
+
+    Returns None if the file has no frame header, so the caller can fall
+    back to Pillow.
+    """
+    metadata = {"format": "JPEG"}
+    exif = {}
+    offset = 2
+    while True:
+        header = read(offset, 4)
+        if len(header) < 4 or header[0] != 0xFF:
+            break
+        marker = header[1]
+        if marker == 0xFF:
+            # Fill byte before the marker
+            offset += 1
+            continue
+        if marker in (JPEG_SOS, JPEG_EOI):
+            break
+        length = struct.unpack(">H", header[2:])[0]
+        if marker in JPEG_SOF_MARKERS:
+            metadata["height"], metadata["width"] = struct.unpack(">xHH", read(offset + 4, 5))
+        elif marker == JPEG_APP1 and not exif and read(offset + 4, 6) == b"Exif\x00\x00":
+            exif = _exif_tags(read, offset + 10)
+        offset += 2 + length
+    if "width" not in metadata:
+        return None
+    _add_exif(metadata, exif.get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME),
+              exif.get(EXIF_MAKE), exif.get(EXIF_MODEL))
+    return metadata
+
+
+def png_metadata(read):
+    """Read the size from IHDR and EXIF from an eXIf chunk that comes before the image data"""
+    width, height = struct.unpack(">II", read(16, 8))
+    metadata = {"format": "PNG", "width": width, "height": height}
+    offset = 8
+    while True:
+        header = read(offset, 8)
+        if len(header) < 8 or header[4:] in (b"IDAT", b"IEND"):
+            break
+        length = struct.unpack(">I", header[:4])[0]
+        if header[4:] == b"eXIf":
+            exif = _exif_tags(read, offset + 8)
+            _add_exif(metadata, exif.get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME),
+                      exif.get(EXIF_MAKE), exif.get(EXIF_MODEL))
+            break
+        # Length, type, data and CRC
+        offset += 12 + length
+    return metadata
+
+
+def image_metadata(file):
+    # JPEG and PNG, most photos and screenshots, are parsed directly:
+    # Pillow's open costs several times a same-device move. Files whose
+    # header isn't an image at all, like partial downloads, are not handed
+    # to Pillow, which would try every decoder it has on them
+    head = file.read(IMAGE_HEAD_SIZE)
+
+    def read(offset, size):
+        if offset + size <= len(head):
+            return head[offset:offset + size]
+        file.seek(offset)
+        return file.read(size)
+
+    parser = None
+    if head.startswith(JPEG_SOI):
+        parser = jpeg_metadata
+    elif head.startswith(PNG_SIGNATURE):
+        parser = png_metadata
+    elif not (head.startswith(PILLOW_SIGNATURES) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")):
+        return None
+    if parser is not None:
+        try:
+            metadata = parser(read)
+        except struct.error:
+            metadata = None
+        if metadata is not None:
+            return metadata
+    file.seek(0)
+    # Imported here so loading the config doesn't need Pillow. Image.open
+    # only parses the headers; pixels are never decoded
+    from PIL import Image
+    with Image.open(file) as image:
+        metadata = {"format": image.format, "width": image.width, "height": image.height}
+        # PNG only has EXIF in its headers if the chunk comes before the
+        # image data; otherwise getexif() would decode the whole image
+        exif = None if image.format == "PNG" and "exif" not in image.info else image.getexif()
+    if exif:
+        _add_exif(metadata, exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME),
+                  exif.get(EXIF_MAKE), exif.get(EXIF_MODEL))
+    return metadata
+
+
+EXTRACTORS = {
+    "image": lambda file, size: image_metadata(file),
+    "pdf": pdf_metadata,
+    "video": mp4_metadata,
+    "audio": mp4_metadata,
+}
+
+
+class MetadataExtractor:
+    """Reads capture dates and document properties from file headers only
+
+    Each file gets a byte budget: JPEG and PNG headers are parsed directly
+    for the size and EXIF tags, other images through Pillow's lazy open,
+    PDFs through their first and last KB plus the info object, and MP4 and
+    QuickTime files by walking box headers to moov/mvhd. Results are cached
+    per (device, inode, mtime), so a file is never read twice while it is
+    unchanged, even after it has been moved on the same device.
+    """
+
+    def __init__(self, byte_budget=DEFAULT_BYTE_BUDGET, cache_entries=DEFAULT_CACHE_ENTRIES,
+                 logger=None, metrics=None):
+        self.byte_budget = byte_budget
+        self.cache_entries = cache_entries
+        self.logger = logger
+        self.metrics = metrics
+        self._cache = OrderedDict()
+        self._lock = Lock()
+        self.files = 0
+        self.bytes_read = 0
+        self.cache_hits = 0
+        self.over_budget = 0
+
+    @staticmethod
+    def kind_of(path):
+        return METADATA_KINDS.get(os.path.splitext(path)[1].lower())
+
+    def extract(self, path, stat=None):
+        """Return a read-only mapping of the file's metadata, or None if its type isn't supported
+
+        Every mapping has 'kind'; 'date' is a naive datetime when the file
+        records one. Unreadable or malformed headers give just the kind.
+        """
+        kind = self.kind_of(path)
+        if kind is None:
+            return None
+        try:
+            stat = stat or os.stat(path)
+        except OSError:
+            return None
+        key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+
+        started = perf_counter()
+        metadata = {}
+        budgeted = None
+        try:
+            with open(path, 'rb', buffering=0) as raw:
+                budgeted = BudgetedFile(raw, self.byte_budget)
+                metadata = EXTRACTORS[kind](budgeted, stat.st_size) or {}
+        except FileNotFoundError:
+            return None
+        except BudgetExceeded:
+            self.over_budget += 1
+            if self.logger:
+                self.logger.debug(f"Metadata of {path} needs more than {self.byte_budget} bytes")
+        except Exception as e:
+            if self.logger:
+                self.logger.debug(f"Failed to read metadata of {path}: {e}")
+        bytes_read = budgeted.bytes_read if budgeted else 0
+        metadata = MappingProxyType({**metadata, "kind": kind})
+
+        with self._lock:
+            self.files += 1
+            self.bytes_read += bytes_read
+            self._cache[key] = metadata
+            if len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+        if self.metrics is not None:
+            self.metrics.metadata_duration.labels(kind).observe(perf_counter() - started)
+            self.metrics.metadata_bytes.labels(kind).inc(bytes_read)
+        return metadata
+
+
+class RoutingRule:
+    """Sends files whose metadata matches every condition to a category
+
+    'kind' matches the metadata kind (image, pdf, video, audio); 'before'
+    and 'after' compare the capture or creation date with an ISO date; any
+    other key is a case-insensitive wildcard pattern on that metadata field,
+    e.g. {"kind": "pdf", "title": "*invoice*", "category": "Invoices"}.
+    """
+
+    __slots__ = ("category", "kind", "before", "after", "patterns")
+
+    def __init__(self, category, kind=None, before=None, after=None, patterns=None):
+        self.category = category
+        self.kind = kind
+        self.before = before
+        self.after = after
+        self.patterns = dict(patterns or {})
+
+    @classmethod
+    def from_config(cls, spec):
+        spec = dict(spec)
+        if 'category' not in spec:
+            raise ValueError("missing 'category'")
+        category = spec.pop('category')
+        dates = {}
+        for key in ('before', 'after'):
+            if key in spec:
+                dates[key] = parse_date(str(spec.pop(key)))
+                if dates[key] is None:
+                    raise ValueError(f"'{key}' must be a date like 2020-01-31")
+        kind = spec.pop('kind', None)
+        if kind is not None and kind not in EXTRACTORS:
+            raise ValueError(f"Unknown metadata kind {kind!r}, expected one of {tuple(EXTRACTORS)}")
+        return cls(category, kind, dates.get('before'), dates.get('after'),
+                   {key: str(pattern).lower() for key, pattern in spec.items()})
+
+    def applies_to(self, kind):
+        return self.kind is None or self.kind == kind
+
+    def matches(self, metadata):
+        if not self.applies_to(metadata['kind']):
+            return False
+        if self.before or self.after:
+            date = metadata.get('date')
+            if date is None or (self.before and date >= self.before) or (self.after and date < self.after):
+                return False
+        for key, pattern in self.patterns.items():
+            value = metadata.get(key)
+            if value is None or not fnmatchcase(str(value).lower(), pattern):
+                return False
+        return True
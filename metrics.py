@@ -0,0 +1,421 @@
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default latency buckets in seconds, from sub-millisecond renames up to
+# multi-minute cross-device copies.
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def _format_labels(labelnames, values, extra=None, prefix=()):
+    pairs = list(prefix) + list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class _Metric:
+    kind = "untyped"
+    child_class = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+            self._children[()] = self._default
+
+    def _new_child(self):
+        return self.child_class()
+
+    def labels(self, *values):
+        """Return the child for the given label values, creating it on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def children(self):
+        return list(self._children.items())
+
+
+class Counter(_Metric):
+    kind = "counter"
+    child_class = _CounterChild
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def render(self, prefix=()):
+        lines = []
+        for values, child in self.children():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values, prefix=prefix)} {_format_value(child.value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    child_class = _GaugeChild
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def render(self, prefix=()):
+        lines = []
+        for values, child in self.children():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values, prefix=prefix)} {_format_value(child.value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def render(self, prefix=()):
+        lines = []
+        for values, child in self.children():
+            counts, total, count = child.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, values, ("le", _format_value(float(bound))), prefix)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values, prefix=prefix)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process registry of counters, gauges and histograms"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        metrics = self.metrics()
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class LabeledRegistries:
+    """Render several registries as one, telling their series apart by a label
+
+    Registries added with value None are rendered without the label. Has the
+    same render() method as MetricsRegistry, so it can be passed to
+    MetricsServer and TextfileWriter.
+    """
+
+    def __init__(self, label):
+        self.label = label
+        self._registries = {}
+        self._lock = threading.Lock()
+
+    def add(self, value, registry):
+        with self._lock:
+            self._registries[value] = registry
+
+    def remove(self, value):
+        with self._lock:
+            self._registries.pop(value, None)
+
+    def render(self):
+        with self._lock:
+            registries = list(self._registries.items())
+        families = {}
+        for value, registry in registries:
+            prefix = () if value is None else ((self.label, value),)
+            for metric in registry.metrics():
+                families.setdefault(metric.name, (metric, []))[1].append((prefix, metric))
+        lines = []
+        for name, (first, members) in families.items():
+            lines.append(f"# HELP {name} {first.documentation}")
+            lines.append(f"# TYPE {name} {first.kind}")
+            for prefix, metric in members:
+                lines.extend(metric.render(prefix))
+        return "\n".join(lines) + "\n"
+
+
+class OrganizerMetrics:
+    """The metrics recorded by FileOrganizer"""
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.event_to_move = r.histogram(
+            "mfo_event_to_move_seconds",
+            "Time from the filesystem event to the completed move")
+        self.move_duration = r.histogram(
+            "mfo_move_duration_seconds",
+            "Duration of a single move operation",
+            ["device"])
+        self.bytes_moved = r.counter(
+            "mfo_bytes_moved_total",
+            "Bytes moved per category",
+            ["category"])
+        self.files_moved = r.counter(
+            "mfo_files_moved_total",
+            "Files moved per category",
+            ["category"])
+        self.retries = r.counter(
+            "mfo_move_retries_total",
+            "Move attempts that had to be retried",
+            ["reason"])
+        self.failures = r.counter(
+            "mfo_move_failures_total",
+            "Files that could not be moved after all retries")
+        self.notification_latency = r.histogram(
+            "mfo_notification_seconds",
+            "Time spent sending desktop notifications")
+        self.queue_depth = r.gauge(
+            "mfo_queue_depth",
+            "Filesystem events waiting to be moved")
+        self.device_bytes = r.counter(
+            "mfo_device_bytes_total",
+            "Bytes moved per device and move kind (same or cross device)",
+            ["device", "kind"])
+        self.device_moves = r.counter(
+            "mfo_device_moves_total",
+            "Moves completed per device and move kind",
+            ["device", "kind"])
+        self.device_inflight = r.gauge(
+            "mfo_device_inflight",
+            "Moves currently running per device and move kind",
+            ["device", "kind"])
+        self.lane_latency = r.histogram(
+            "mfo_lane_latency_seconds",
+            "Time from entering a mover lane to the completed move",
+            ["lane"])
+        self.lane_depth = r.gauge(
+            "mfo_lane_depth",
+            "Files waiting in each mover lane",
+            ["lane"])
+        self.metadata_duration = r.histogram(
+            "mfo_metadata_seconds",
+            "Time spent reading a file's header metadata",
+            ["kind"])
+        self.metadata_bytes = r.counter(
+            "mfo_metadata_bytes_read_total",
+            "Bytes read to extract header metadata",
+            ["kind"])
+        self.plugin_duration = r.histogram(
+            "mfo_plugin_seconds",
+            "Duration of one classifier plugin call, including reading its inputs",
+            ["plugin"])
+        self.plugin_results = r.counter(
+            "mfo_plugin_files_total",
+            "Files seen by each classifier plugin, by result (verdict, none, cached, timeout, error, skipped)",
+            ["plugin", "result"])
+        self.free_bytes = r.gauge(
+            "mfo_destination_free_bytes",
+            "Free space last seen on each destination device, less the bytes moved there since",
+            ["device"])
+        self.overflow_moves = r.counter(
+            "mfo_overflow_moves_total",
+            "Files sent to an overflow folder because their category folder was full",
+            ["category"])
+        self.low_space_alerts = r.counter(
+            "mfo_low_space_alerts_total",
+            "Times a destination device dropped below the free space low watermark")
+        self.throttle_state = r.gauge(
+            "mfo_throttle_state",
+            "1 for the current throttle state of background work (full, reduced or paused)",
+            ["state"])
+        self.throttle_share = r.gauge(
+            "mfo_throttle_share",
+            "Share of the configured worker and hashing concurrency currently allowed")
+        self.throttle_changes = r.counter(
+            "mfo_throttle_changes_total",
+            "Throttle state changes, by the state entered",
+            ["state"])
+        self.system_load = r.gauge(
+            "mfo_system_load",
+            "Last system load sample (load_per_cpu, io_pressure, battery_percent, on_battery)",
+            ["signal"])
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer:
+    """Serve the registry over HTTP on a localhost port"""
+
+    def __init__(self, registry, port, host="127.0.0.1"):
+        handler = type("MetricsRequestHandler", (_MetricsRequestHandler,), {"registry": registry})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TextfileWriter:
+    """Periodically write the registry to a textfile (node_exporter textfile collector format)"""
+
+    def __init__(self, registry, path, interval=15):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def write(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as file:
+            file.write(self.registry.render())
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError:
+                pass
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.thread.join()
+        try:
+            self.write()
+        except OSError:
+            pass
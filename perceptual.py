@@ -0,0 +1,157 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.tif', '.webp')
+HASH_SIZE = 8
+# Hamming distance (out of 64 bits) at which two images count as the same picture
+DEFAULT_MAX_DISTANCE = 6
+CACHE_KIND = "dhash"
+
+
+def dhash(file_path, hash_size=HASH_SIZE):
+    """Difference hash of an image, as an int of hash_size * hash_size bits
+
+    Image.draft lets the JPEG decoder downscale while decoding, which skips
+    most of the work for large photos.
+    """
+    with Image.open(file_path) as image:
+        image.draft('L', (hash_size * 8, hash_size * 8))
+        image = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+        pixels = list(image.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _hash_worker(file_path):
+    try:
+        return file_path, dhash(file_path)
+    except Exception:
+        return file_path, None
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree of hashes for Hamming-distance range queries
+
+    Nodes are [hash, items, children] lists, where children maps an edge
+    distance to a child node.
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Return (distance, item) for every item within max_distance of value"""
+        results = []
+        if self.root is None:
+            return results
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            # Triangle inequality: only edges within max_distance of distance can match
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+def _iter_images(folders, extensions):
+    for folder in folders:
+        for root, _, files in os.walk(folder):
+            for file in files:
+                if os.path.splitext(file)[1].lower() in extensions:
+                    yield os.path.join(root, file)
+
+
+def compute_hashes(paths, cache=None, workers=None, progress=None):
+    """Return {path: dhash} for the given images, using and filling cache if given"""
+    hashes = {}
+    stats = {}
+    missing = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        cached = cache.get(CACHE_KIND, path, stat) if cache is not None else None
+        if cached is not None:
+            hashes[path] = int(cached, 16)
+        else:
+            stats[path] = stat
+            missing.append(path)
+
+    total = len(hashes) + len(missing)
+    processed = len(hashes)
+    if progress is not None:
+        progress(processed, total)
+    if missing:
+        computed = []
+        with ProcessPoolExecutor(workers) as executor:
+            for path, value in executor.map(_hash_worker, missing, chunksize=64):
+                processed += 1
+                if value is not None:
+                    hashes[path] = value
+                    computed.append((path, stats[path], f"{value:016x}"))
+                if cache is not None and len(computed) >= 1000:
+                    cache.put_many(CACHE_KIND, computed)
+                    computed = []
+                if progress is not None:
+                    progress(processed, total)
+        if cache is not None and computed:
+            cache.put_many(CACHE_KIND, computed)
+    return hashes
+
+
+def find_similar_images(folders, max_distance=DEFAULT_MAX_DISTANCE, extensions=IMAGE_EXTENSIONS, cache=None,
+                        workers=None, progress=None):
+    """Group images whose perceptual hashes are within max_distance of each other
+
+    Returns a list of path lists, one per group of two or more similar images.
+    """
+    folders = [folder for folder in folders if os.path.exists(folder)]
+    extensions = tuple(extension.lower() for extension in extensions)
+    hashes = compute_hashes(list(_iter_images(folders, extensions)), cache, workers, progress)
+
+    tree = BKTree()
+    for path, value in hashes.items():
+        tree.add(value, path)
+
+    groups = []
+    assigned = set()
+    for path, value in hashes.items():
+        if path in assigned:
+            continue
+        group = [match for _, match in sorted(tree.search(value, max_distance)) if match not in assigned]
+        if len(group) > 1:
+            assigned.update(group)
+            groups.append(group)
+    return groups
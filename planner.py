@@ -0,0 +1,163 @@
+import os
+import json
+import hashlib
+from time import perf_counter
+
+# Number of plan entries applied between journal checkpoints
+PLAN_CHECKPOINT_INTERVAL = 5000
+
+
+class DestinationModel:
+    """In-memory model of the names in each destination folder
+
+    Each folder is listed once, the first time a file is planned into it.
+    Planned names are added to the model so later files collide with them
+    exactly as they would with the real files after the move.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._next_suffix = {}
+
+    def names(self, destination):
+        names = self._names.get(destination)
+        if names is None:
+            try:
+                names = set(os.listdir(destination))
+            except OSError:
+                names = set()
+            self._names[destination] = names
+        return names
+
+    def reserve(self, destination, filename):
+        """Resolve the final path for filename, the same way get_unique_file_path does"""
+        names = self.names(destination)
+        if filename not in names:
+            names.add(filename)
+            return os.path.join(destination, filename)
+
+        base, extension = os.path.splitext(filename)
+        # Remember where probing stopped so a burst of same-named files
+        # doesn't rescan every earlier suffix
+        key = (destination, filename)
+        counter = self._next_suffix.get(key, 1)
+        candidate = f"{base} ({counter}){extension}"
+        while candidate in names:
+            counter += 1
+            candidate = f"{base} ({counter}){extension}"
+        self._next_suffix[key] = counter + 1
+        names.add(candidate)
+        return os.path.join(destination, candidate)
+
+
+def iter_plan(organizer, sources=None):
+    """Yield one plan record per file in the watched folders without touching any file"""
+    model = DestinationModel()
+    for source in sources or organizer.sources:
+        for entry in organizer.prefetched(organizer.iter_source_entries(source)):
+            if organizer.is_temporary_file(entry.path):
+                yield {"action": "skip", "src": entry.path, "reason": "temporary"}
+                continue
+            try:
+                stat = entry.stat()
+            except OSError as e:
+                organizer.logger.warning(f"Failed to stat {entry.path}: {e}. Skipping.")
+                continue
+            category, destination = organizer.classify(entry.path, source, stat)
+            destination = organizer.shard_folder(source, category, destination, entry.path, stat)
+            yield {
+                "action": "move",
+                "src": entry.path,
+                "dst": model.reserve(destination, entry.name),
+                "category": category,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+            }
+
+
+def write_plan(organizer, plan_path, sources=None):
+    """Stream the move plan to plan_path as JSON lines and return the number of records"""
+    started = perf_counter()
+    count = 0
+    with open(plan_path, 'w') as file:
+        for record in iter_plan(organizer, sources):
+            file.write(json.dumps(record))
+            file.write("\n")
+            count += 1
+    organizer.logger.info(f"Planned {count} entries to {plan_path} in {perf_counter() - started:.2f}s")
+    return count
+
+
+def read_plan(plan_path):
+    with open(plan_path, 'r') as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def plan_digest(plan_path):
+    digest = hashlib.md5()
+    with open(plan_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def apply_plan(organizer, plan_path):
+    """Execute a saved plan, skipping entries that changed since it was written
+
+    Progress is checkpointed to the organizer's journal every
+    PLAN_CHECKPOINT_INTERVAL entries, so rerunning an interrupted plan
+    resumes after the last completed checkpoint, as long as the plan file
+    is unchanged.
+    """
+    from batch import BatchExecutor
+
+    journal = organizer.journal
+    # Keyed by content too, so a plan regenerated at the same path starts
+    # over instead of resuming at the old plan's position
+    plan_prefix = "plan:" + os.path.abspath(plan_path) + ":"
+    checkpoint_key = plan_prefix + plan_digest(plan_path)
+    resume_from = 0
+    if journal:
+        stale = [key for key in journal.checkpoints
+                 if key == plan_prefix[:-1] or key.startswith(plan_prefix) and key != checkpoint_key]
+        for key in stale:
+            organizer.logger.info(f"Discarding the checkpoint of an earlier plan at {plan_path}")
+            journal.checkpoint(key, None)
+        resume_from = journal.checkpoints.get(checkpoint_key, 0)
+    if resume_from:
+        organizer.logger.info(f"Resuming plan {plan_path} from entry {resume_from}")
+
+    executor = BatchExecutor(organizer)
+    skipped = 0
+    for index, record in enumerate(read_plan(plan_path)):
+        if index < resume_from or record.get("action") != "move":
+            continue
+        src, dst = record["src"], record["dst"]
+        try:
+            stat = os.stat(src)
+        except FileNotFoundError:
+            organizer.logger.warning(f"Skipping planned move, source is gone: {src}")
+            skipped += 1
+            continue
+        if stat.st_size != record.get("size") or stat.st_mtime_ns != record.get("mtime_ns"):
+            organizer.logger.warning(f"Skipping planned move, source changed since planning: {src}")
+            skipped += 1
+            continue
+        # Planned names are re-checked against the live folder listing, so a
+        # name taken since planning gets a fresh collision suffix
+        executor.add(src, os.path.dirname(dst), record.get("category", "Other"),
+                     name=os.path.basename(dst), stat=stat)
+        if len(executor) >= PLAN_CHECKPOINT_INTERVAL:
+            executor.run()
+            if journal:
+                journal.checkpoint(checkpoint_key, index + 1)
+    executor.run()
+    if journal and not organizer.shutdown_flag:
+        journal.checkpoint(checkpoint_key, None)
+    moved = executor.moved
+    skipped += sum(report["failed"] for report in executor.reports)
+    organizer.logger.info(f"Applied plan {plan_path}: {moved} moved, {skipped} skipped")
+    return moved, skipped
@@ -0,0 +1,338 @@
+import os
+import sys
+import inspect
+import importlib.util
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from threading import Lock, Semaphore
+from time import perf_counter
+
+try:
+    from importlib.metadata import entry_points
+except ImportError:
+    entry_points = None
+
+ENTRY_POINT_GROUP = "mfo.classifiers"
+PLUGIN_INPUTS = ("name", "path", "stat", "header", "metadata")
+DEFAULT_PLUGIN_TIMEOUT = 0.05
+DEFAULT_PLUGIN_BATCH_SIZE = 64
+DEFAULT_PLUGIN_CACHE_ENTRIES = 50000
+MAX_HEADER_BYTES = 64 * 1024
+# Sweeps hand the engine this many files at a time so plugins can batch
+PREFETCH_CHUNK = 256
+
+
+class Classifier:
+    """Base class for classifier plugins
+
+    Subclasses return a category name from classify(), or None to leave the
+    file to the configured rules, and list the inputs they need in
+    'inputs': "name", "path", "stat", "header" (the first header_bytes
+    bytes) and "metadata" (see metadata.py). Only declared inputs are
+    gathered. Override classify_batch() to handle many files in one call.
+
+    A call that takes longer than 'timeout' seconds per file is abandoned
+    and the file falls back to the configured rules; while an abandoned call
+    is still running the plugin is skipped, so a hung plugin costs nothing.
+    """
+
+    name = None
+    inputs = ("name",)
+    header_bytes = 4096
+    timeout = DEFAULT_PLUGIN_TIMEOUT
+    batch_size = DEFAULT_PLUGIN_BATCH_SIZE
+    concurrency = 1
+
+    def configure(self, options):
+        """Apply the plugin's section of the 'plugins' settings; override to accept more options"""
+        for key in ("timeout", "batch_size", "concurrency", "header_bytes"):
+            if key in options:
+                setattr(self, key, type(getattr(self, key))(options[key]))
+
+    def classify(self, file):
+        return None
+
+    def classify_batch(self, files):
+        return [self.classify(file) for file in files]
+
+
+class FileInfo:
+    """The inputs a plugin may see for one file; undeclared ones are None"""
+
+    __slots__ = ("name", "path", "stat", "header", "metadata")
+
+    def __init__(self, path, stat=None, header=None, metadata=None):
+        self.name = os.path.basename(path)
+        self.path = path
+        self.stat = stat
+        self.header = header
+        self.metadata = metadata
+
+
+def _instances(candidates):
+    for candidate in candidates:
+        if inspect.isclass(candidate) and issubclass(candidate, Classifier) and candidate is not Classifier:
+            yield candidate()
+        elif isinstance(candidate, Classifier):
+            yield candidate
+
+
+def load_classifiers(directory=None, logger=None):
+    """Load classifier plugins from the 'mfo.classifiers' entry points and from *.py files in directory"""
+    classifiers = []
+    if entry_points is not None:
+        try:
+            found = entry_points(group=ENTRY_POINT_GROUP)
+        except TypeError:
+            # Python < 3.10
+            found = entry_points().get(ENTRY_POINT_GROUP, [])
+        for entry_point in found:
+            try:
+                classifiers.extend(_instances([entry_point.load()]))
+            except Exception as e:
+                if logger:
+                    logger.error(f"Failed to load classifier plugin {entry_point.name}: {e}")
+    if directory and os.path.isdir(directory):
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(".py") or filename.startswith("_"):
+                continue
+            module_name = f"mfo_plugin_{filename[:-3]}"
+            try:
+                spec = importlib.util.spec_from_file_location(module_name, os.path.join(directory, filename))
+                module = importlib.util.module_from_spec(spec)
+                sys.modules[module_name] = module
+                spec.loader.exec_module(module)
+            except Exception as e:
+                sys.modules.pop(module_name, None)
+                if logger:
+                    logger.error(f"Failed to load classifier plugin {filename}: {e}")
+                continue
+            classifiers.extend(_instances(
+                value for value in vars(module).values()
+                if not inspect.isclass(value) or value.__module__ == module_name))
+    for classifier in classifiers:
+        if not classifier.name:
+            classifier.name = type(classifier).__name__
+        unknown = set(classifier.inputs) - set(PLUGIN_INPUTS)
+        if unknown and logger:
+            logger.warning(f"Classifier plugin {classifier.name} asks for unknown inputs {sorted(unknown)}")
+    return classifiers
+
+
+class PluginStats:
+    __slots__ = ("calls", "files", "seconds", "verdicts", "cached", "timeouts", "errors", "skipped")
+
+    def __init__(self):
+        for field in self.__slots__:
+            setattr(self, field, 0)
+
+    def as_dict(self):
+        stats = {field: getattr(self, field) for field in self.__slots__}
+        stats["ms_per_file"] = 1000 * self.seconds / self.files if self.files else None
+        return stats
+
+
+class ClassifierEngine:
+    """Runs classifier plugins in order and returns the first verdict
+
+    Each plugin runs on its own threads, so it can be abandoned after its
+    time budget without blocking the mover. Verdicts, including "no
+    opinion", are cached per (plugin, device, inode, mtime); timeouts and
+    errors are not, so the file is asked about again next time.
+    """
+
+    def __init__(self, classifiers, logger, metrics=None, metadata=None,
+                 cache_entries=DEFAULT_PLUGIN_CACHE_ENTRIES):
+        self.classifiers = list(classifiers)
+        self.logger = logger
+        self.metrics = metrics
+        self.metadata = metadata
+        self.cache_entries = cache_entries
+        self.stats = {classifier.name: PluginStats() for classifier in self.classifiers}
+        self.inputs = set()
+        for classifier in self.classifiers:
+            self.inputs.update(classifier.inputs)
+        self.header_bytes = min(MAX_HEADER_BYTES, max(
+            (classifier.header_bytes for classifier in self.classifiers if "header" in classifier.inputs), default=0))
+        self._executors = {classifier.name: ThreadPoolExecutor(max(1, classifier.concurrency),
+                                                               thread_name_prefix=f"plugin-{classifier.name}")
+                           for classifier in self.classifiers}
+        self._slots = {classifier.name: Semaphore(max(1, classifier.concurrency)) for classifier in self.classifiers}
+        # Calls that timed out but are still running in the plugin's threads
+        self._abandoned = {classifier.name: set() for classifier in self.classifiers}
+        self._cache = OrderedDict()
+        self._lock = Lock()
+
+    def __bool__(self):
+        return bool(self.classifiers)
+
+    def _load(self, info):
+        """Read the header and metadata of a file once, and only when a plugin call needs them"""
+        if self.header_bytes and info.header is None:
+            try:
+                with open(info.path, 'rb') as file:
+                    info.header = file.read(self.header_bytes)
+            except OSError:
+                info.header = b""
+        if "metadata" in self.inputs and self.metadata is not None and info.metadata is None:
+            info.metadata = self.metadata.extract(info.path, info.stat)
+
+    def _view(self, classifier, info):
+        """Copy of info with only the inputs this classifier declared"""
+        inputs = classifier.inputs
+        view = FileInfo(info.path)
+        if "path" not in inputs:
+            view.path = None
+        if "name" not in inputs:
+            view.name = None
+        if "stat" in inputs:
+            view.stat = info.stat
+        if "header" in inputs and info.header is not None:
+            view.header = info.header[:classifier.header_bytes]
+        if "metadata" in inputs:
+            view.metadata = info.metadata
+        return view
+
+    def _key(self, classifier, stat):
+        return classifier.name, stat.st_dev, stat.st_ino, stat.st_mtime_ns
+
+    def _cached(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return True, self._cache[key]
+        return False, None
+
+    def _store(self, key, verdict):
+        with self._lock:
+            self._cache[key] = verdict
+            if len(self._cache) > self.cache_entries:
+                self._cache.popitem(last=False)
+
+    def _count(self, classifier, result, files=1):
+        if self.metrics is not None:
+            self.metrics.plugin_results.labels(classifier.name, result).inc(files)
+
+    def _skip(self, classifier, infos):
+        self.stats[classifier.name].skipped += len(infos)
+        self._count(classifier, "skipped", len(infos))
+
+    def _call(self, classifier, infos):
+        """Run one batch through a plugin within its budget; returns verdicts or None on timeout/error/busy
+
+        While a call that timed out is still running the plugin is skipped,
+        so a hung plugin can't hold up moves; otherwise a call waits up to
+        its budget for one of the plugin's threads to be free.
+        """
+        stats = self.stats[classifier.name]
+        slot = self._slots[classifier.name]
+        budget = classifier.timeout * len(infos)
+        abandoned = self._abandoned[classifier.name]
+        with self._lock:
+            abandoned.difference_update([future for future in abandoned if future.done()])
+            hung = bool(abandoned)
+        if hung or not slot.acquire(timeout=budget):
+            self._skip(classifier, infos)
+            return None
+        started = perf_counter()
+        for info in infos:
+            self._load(info)
+        views = [self._view(classifier, info) for info in infos]
+        try:
+            future = self._executors[classifier.name].submit(classifier.classify_batch, views)
+        except RuntimeError:
+            slot.release()
+            return None
+        future.add_done_callback(lambda _: slot.release())
+        try:
+            verdicts = future.result(timeout=budget)
+        except FutureTimeoutError:
+            with self._lock:
+                abandoned.add(future)
+            stats.timeouts += 1
+            self._count(classifier, "timeout", len(infos))
+            self.logger.warning(f"Classifier plugin {classifier.name} took longer than "
+                                f"{budget:.3f}s for {len(infos)} files; using the configured rules")
+            return None
+        except Exception as e:
+            stats.errors += 1
+            self._count(classifier, "error", len(infos))
+            self.logger.error(f"Classifier plugin {classifier.name} failed: {e}")
+            return None
+        finally:
+            elapsed = perf_counter() - started
+            stats.calls += 1
+            stats.files += len(infos)
+            stats.seconds += elapsed
+            if self.metrics is not None:
+                self.metrics.plugin_duration.labels(classifier.name).observe(elapsed)
+        if not isinstance(verdicts, (list, tuple)) or len(verdicts) != len(infos):
+            stats.errors += 1
+            self._count(classifier, "error", len(infos))
+            self.logger.error(f"Classifier plugin {classifier.name} did not return one verdict for each of {len(infos)} files")
+            return None
+        return verdicts
+
+    def classify_many(self, files):
+        """Return the first plugin verdict (a category or None) for each (path, stat) pair"""
+        infos = []
+        for path, stat in files:
+            try:
+                # The stat is needed for the cache key even if no plugin asks for it
+                infos.append(FileInfo(path, stat or os.stat(path)))
+            except OSError:
+                infos.append(None)
+        results = [None] * len(infos)
+        undecided = [index for index, info in enumerate(infos) if info is not None]
+        for classifier in self.classifiers:
+            if not undecided:
+                break
+            stats = self.stats[classifier.name]
+            pending = []
+            for index in undecided:
+                key = self._key(classifier, infos[index].stat)
+                hit, verdict = self._cached(key)
+                if hit:
+                    stats.cached += 1
+                    self._count(classifier, "cached")
+                    results[index] = verdict
+                else:
+                    pending.append(index)
+            for start in range(0, len(pending), max(1, classifier.batch_size)):
+                chunk = pending[start:start + max(1, classifier.batch_size)]
+                verdicts = self._call(classifier, [infos[index] for index in chunk])
+                if verdicts is None:
+                    continue
+                for index, verdict in zip(chunk, verdicts):
+                    verdict = verdict or None
+                    self._store(self._key(classifier, infos[index].stat), verdict)
+                    results[index] = verdict
+                    if verdict is not None:
+                        stats.verdicts += 1
+                self._count(classifier, "verdict", sum(1 for verdict in verdicts if verdict))
+                self._count(classifier, "none", sum(1 for verdict in verdicts if not verdict))
+            undecided = [index for index in undecided if results[index] is None]
+        return results
+
+    def classify(self, path, stat=None):
+        return self.classify_many([(path, stat)])[0]
+
+    def prefetch(self, files):
+        """Classify many files in batches so later classify() calls for them hit the cache"""
+        if self.classifiers and files:
+            self.classify_many(files)
+
+    def report(self):
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def log_report(self):
+        for name, stats in self.report().items():
+            if stats["files"] or stats["cached"]:
+                per_file = f"{stats['ms_per_file']:.2f}ms/file" if stats["ms_per_file"] is not None else "-"
+                self.logger.info(f"Classifier plugin {name}: {stats['files']} files in {stats['calls']} calls "
+                                 f"({per_file}), {stats['verdicts']} verdicts, {stats['cached']} cached, "
+                                 f"{stats['timeouts']} timeouts, {stats['errors']} errors, {stats['skipped']} skipped")
+
+    def close(self):
+        for executor in self._executors.values():
+            executor.shutdown(wait=False)
@@ -0,0 +1,175 @@
+import os
+import threading
+from watchdog.events import FileCreatedEvent, DirCreatedEvent, FileDeletedEvent, DirDeletedEvent
+
+
+# Filesystem types on which inotify does not report changes made by other hosts
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "9p", "fuse", "sshfs", "afs", "davfs")
+
+
+def is_network_filesystem(path, mounts_file="/proc/mounts"):
+    """Return True if path lives on a network or FUSE mount (Linux only)"""
+    try:
+        with open(mounts_file, 'r') as file:
+            mounts = [line.split()[1:3] for line in file]
+    except OSError:
+        return False
+    path = os.path.realpath(path)
+    best_mount, best_type = "", ""
+    for mount_point, fs_type in mounts:
+        mount_point = mount_point.replace("\\040", " ")
+        if (path == mount_point or path.startswith(mount_point.rstrip(os.sep) + os.sep)) and len(mount_point) > len(best_mount):
+            best_mount, best_type = mount_point, fs_type
+    return best_type.split(".", 1)[0] in NETWORK_FILESYSTEMS
+
+
+class _DirectoryState:
+    __slots__ = ("mtime_ns", "entries")
+
+    def __init__(self, mtime_ns, entries):
+        self.mtime_ns = mtime_ns
+        self.entries = entries
+
+
+class _PolledWatch:
+    """Scandir-based snapshot of one watched path"""
+
+    def __init__(self, event_handler, path, recursive):
+        self.event_handler = event_handler
+        self.path = path
+        self.recursive = recursive
+        self.directories = {}
+        self._scan_directory(path, emit=False)
+
+    def _list(self, directory):
+        entries = {}
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                entries[entry.name] = entry.is_dir(follow_symlinks=False)
+        return entries
+
+    def _scan_directory(self, directory, emit):
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+            entries = self._list(directory)
+        except OSError:
+            return
+        self.directories[directory] = _DirectoryState(mtime_ns, entries)
+        for name, is_dir in entries.items():
+            path = os.path.join(directory, name)
+            if emit:
+                self.event_handler.dispatch(DirCreatedEvent(path) if is_dir else FileCreatedEvent(path))
+            if is_dir and self.recursive:
+                self._scan_directory(path, emit)
+
+    def _forget_directory(self, directory):
+        for path in [path for path in self.directories if path == directory or path.startswith(directory + os.sep)]:
+            del self.directories[path]
+
+    def poll(self):
+        """Check every tracked directory and dispatch events; return True if anything changed"""
+        changed = False
+        for directory, state in list(self.directories.items()):
+            if directory not in self.directories:
+                continue
+            try:
+                mtime_ns = os.stat(directory).st_mtime_ns
+            except OSError:
+                if directory != self.path:
+                    self._forget_directory(directory)
+                continue
+            # Entries can only be added, removed or renamed when the
+            # directory's own mtime changes, so unchanged directories cost a
+            # single stat call
+            if mtime_ns == state.mtime_ns:
+                continue
+            try:
+                entries = self._list(directory)
+            except OSError:
+                continue
+            state.mtime_ns = mtime_ns
+            previous, state.entries = state.entries, entries
+
+            for name, is_dir in entries.items():
+                if name in previous and previous[name] == is_dir:
+                    continue
+                path = os.path.join(directory, name)
+                changed = True
+                if is_dir:
+                    self.event_handler.dispatch(DirCreatedEvent(path))
+                    if self.recursive:
+                        self._scan_directory(path, emit=True)
+                else:
+                    self.event_handler.dispatch(FileCreatedEvent(path))
+            for name, was_dir in previous.items():
+                if name in entries and entries[name] == was_dir:
+                    continue
+                path = os.path.join(directory, name)
+                changed = True
+                if was_dir:
+                    self._forget_directory(path)
+                    self.event_handler.dispatch(DirDeletedEvent(path))
+                else:
+                    self.event_handler.dispatch(FileDeletedEvent(path))
+        return changed
+
+
+class AdaptivePollingObserver:
+    """Polling replacement for watchdog's Observer, for network shares and FUSE mounts
+
+    Polls quickly (min_interval) right after activity and backs off
+    exponentially up to max_interval while the watched folders are idle.
+    Supports the schedule/start/stop/join subset of the Observer API that
+    the organizer uses.
+    """
+
+    def __init__(self, min_interval=1.0, max_interval=60.0, backoff=2.0):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.interval = min_interval
+        self._watches = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def schedule(self, event_handler, path, recursive=False):
+        watch = _PolledWatch(event_handler, path, recursive)
+        with self._lock:
+            self._watches.append(watch)
+        return watch
+
+    def unschedule(self, watch):
+        with self._lock:
+            self._watches.remove(watch)
+
+    def poll_once(self):
+        with self._lock:
+            watches = list(self._watches)
+        changed = False
+        for watch in watches:
+            if watch.poll():
+                changed = True
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        return changed
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.poll_once()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
@@ -0,0 +1,97 @@
+import sys
+import threading
+from time import perf_counter
+
+
+class _NullSpan:
+    """Span used when profiling is disabled; entering and leaving it does nothing"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "stage", "started")
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.record(self.stage, perf_counter() - self.started)
+        return False
+
+
+class _StageStats:
+    __slots__ = ("count", "total", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+
+class Profiler:
+    """Aggregates timing spans per pipeline stage"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def span(self, stage):
+        """Return a context manager that times the enclosed block as stage"""
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, stage)
+
+    def record(self, stage, seconds):
+        with self._lock:
+            stats = self._stages.get(stage)
+            if stats is None:
+                stats = self._stages[stage] = _StageStats()
+            stats.count += 1
+            stats.total += seconds
+            if seconds < stats.min:
+                stats.min = seconds
+            if seconds > stats.max:
+                stats.max = seconds
+
+    def report(self):
+        """Return the aggregated stage timings as a printable table"""
+        with self._lock:
+            stages = sorted(self._stages.items(), key=lambda item: item[1].total, reverse=True)
+        lines = [f"{'Stage':<24}{'Count':>10}{'Total (s)':>14}{'Mean (ms)':>12}{'Min (ms)':>12}{'Max (ms)':>12}"]
+        for stage, stats in stages:
+            mean = stats.total / stats.count * 1000 if stats.count else 0.0
+            lines.append(f"{stage:<24}{stats.count:>10}{stats.total:>14.3f}{mean:>12.3f}"
+                         f"{stats.min * 1000:>12.3f}{stats.max * 1000:>12.3f}")
+        return "\n".join(lines)
+
+    def print_report(self, file=None):
+        if not self._stages:
+            return
+        print("\nProfile report:", file=file or sys.stderr)
+        print(self.report(), file=file or sys.stderr)
+
+
+def profile_call(dump_path, function, *args, **kwargs):
+    """Run function under cProfile and write a pstats dump to dump_path"""
+    import cProfile
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        profiler.dump_stats(dump_path)
@@ -0,0 +1,145 @@
+"""Headless statistics and duplicate reports for the 'stats' and 'dupes' subcommands.
+
+Nothing here imports Qt, watchdog or the organizer, so the reports run on
+servers without a display or the desktop dependencies:
+
+    python messy_organizer.py stats --json
+    python messy_organizer.py dupes --json --threads 8
+
+With --json every record is written as one JSON object per line as soon as
+it is known, followed by a final "summary" record.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from config import ConfigSnapshot
+from scanner import iter_statistics, iter_duplicates, format_size
+
+
+def default_state_dir():
+    return os.path.join(os.path.expanduser("~"), '.config', 'mfo')
+
+
+def category_folders(config):
+    """Return [(source name, category, folder)] for every category folder, each folder once"""
+    seen = set()
+    folders = []
+    for source in config.sources:
+        for category, folder in source['folders'].items():
+            key = os.path.normpath(folder)
+            if key not in seen:
+                seen.add(key)
+                folders.append((source['name'], category, folder))
+    return folders
+
+
+def _emit(stream, record):
+    stream.write(json.dumps(record, separators=(',', ':')) + "\n")
+    stream.flush()
+
+
+def run_stats(args, stream=sys.stdout):
+    """Print the file count and size of each category folder; return the exit code"""
+    config = ConfigSnapshot.load(args.config)
+    folders = category_folders(config)
+    started = time.perf_counter()
+    # Keys are positions, since the same category can map to different
+    # folders in different sources
+    by_position = {position: folder for position, (_, _, folder) in enumerate(folders)}
+    total_files = total_size = 0
+    for position, file_count, size in iter_statistics(by_position, args.threads):
+        source_name, category, folder = folders[position]
+        total_files += file_count
+        total_size += size
+        if args.json:
+            _emit(stream, {"type": "category", "source": source_name, "category": category, "path": folder,
+                           "files": file_count, "bytes": size})
+        else:
+            stream.write(f"{source_name}/{category}: {file_count} files, {format_size(size)} ({folder})\n")
+    elapsed = time.perf_counter() - started
+    if args.json:
+        _emit(stream, {"type": "summary", "folders": len(folders), "files": total_files, "bytes": total_size,
+                       "seconds": round(elapsed, 3)})
+    else:
+        stream.write(f"Total: {total_files} files, {format_size(total_size)} in {elapsed:.2f}s\n")
+    return 0
+
+
+def run_dupes(args, stream=sys.stdout):
+    """Print each set of duplicate files as soon as it is found; return the exit code"""
+    from cache import HashCache
+
+    config = ConfigSnapshot.load(args.config)
+    folders = [folder for _, _, folder in category_folders(config)]
+    cache = None
+    if not args.no_cache:
+        state_dir = args.state_dir or default_state_dir()
+        os.makedirs(state_dir, exist_ok=True)
+        cache = HashCache(os.path.join(state_dir, 'hash-cache.sqlite3'))
+    scanned = [0]
+
+    def progress(processed_files, total_files):
+        scanned[0] = total_files
+
+    started = time.perf_counter()
+    groups = duplicates = wasted = 0
+    try:
+        for (size, value), paths in iter_duplicates(folders, progress, args.threads, cache):
+            groups += 1
+            duplicates += len(paths) - 1
+            wasted += size * (len(paths) - 1)
+            if args.json:
+                _emit(stream, {"type": "duplicates", "size": size, "hash": value, "paths": paths})
+            else:
+                stream.write(f"Found {len(paths)} duplicates ({format_size(size)} each):\n")
+                stream.writelines(f"  {path}\n" for path in paths)
+                stream.flush()
+    finally:
+        if cache is not None:
+            cache.close()
+    elapsed = time.perf_counter() - started
+    if args.json:
+        _emit(stream, {"type": "summary", "files": scanned[0], "groups": groups, "duplicates": duplicates,
+                       "wasted_bytes": wasted, "seconds": round(elapsed, 3)})
+    else:
+        stream.write(f"{groups} sets of duplicates among {scanned[0]} files, "
+                     f"{format_size(wasted)} reclaimable, in {elapsed:.2f}s\n")
+    return 0
+
+
+def add_subcommands(parser):
+    """Add the 'stats' and 'dupes' subcommands to an argparse parser"""
+    subparsers = parser.add_subparsers(dest='command', metavar='{stats,dupes}')
+    for name, summary in (("stats", "Print file counts and sizes per category folder and exit"),
+                          ("dupes", "Print sets of duplicate files in the category folders and exit")):
+        subparser = subparsers.add_parser(name, help=summary, description=summary)
+        # SUPPRESS keeps the value given before the subcommand
+        subparser.add_argument('--config', default=argparse.SUPPRESS,
+                               help='Path to configuration file')
+        subparser.add_argument('--json', action='store_true', help='Write one JSON object per line')
+        subparser.add_argument('--threads', type=int, default=1,
+                               help='Scan this many folders (stats) or hash this many files (dupes) at once')
+        if name == "dupes":
+            subparser.add_argument('--state-dir', default=None,
+                                   help='Directory of the hash cache (default: ~/.config/mfo)')
+            subparser.add_argument('--no-cache', action='store_true',
+                                   help='Hash every file instead of reusing and updating the hash cache')
+    return subparsers
+
+
+def main(args):
+    if args.threads < 1:
+        sys.stderr.write("--threads must be at least 1\n")
+        return 2
+    try:
+        if args.command == "stats":
+            return run_stats(args)
+        return run_dupes(args)
+    except BrokenPipeError:
+        # The reader (head, a closed ssh session) went away
+        return 0
+    except (OSError, ValueError) as e:
+        sys.stderr.write(f"Error: {e}\n")
+        return 1
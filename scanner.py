@@ -0,0 +1,190 @@
+import os
+import hashlib
+import logging
+from array import array
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from threading import Semaphore
+from filetable import FileTable
+
+# Goes to stderr when nothing configured logging, so report output on
+# stdout stays clean
+logger = logging.getLogger("mfo.scanner")
+
+# Only the first block of each file is hashed to keep duplicate scans fast
+HASH_BLOCK_SIZE = 8192
+# HashCache kind for HASH_BLOCK_SIZE content hashes
+CONTENT_HASH_KIND = "head-md5"
+# Files are hashed this many at a time (whole size groups), so groups can be
+# reported while the rest of the scan is still running
+HASH_BATCH = 1024
+
+# The fields HashCache compares, rebuilt from a FileTable row without a stat call
+_CacheStat = namedtuple("_CacheStat", ("st_ino", "st_size", "st_mtime_ns"))
+
+
+def format_size(total_size):
+    """Format a byte count in a human-readable format"""
+    if total_size < 1024:
+        return f"{total_size} B"
+    elif total_size < 1024 * 1024:
+        return f"{total_size / 1024:.2f} KB"
+    elif total_size < 1024 * 1024 * 1024:
+        return f"{total_size / (1024 * 1024):.2f} MB"
+    else:
+        return f"{total_size / (1024 * 1024 * 1024):.2f} GB"
+
+
+def _folder_statistics(folder):
+    table = FileTable.scan([folder])
+    return len(table), sum(table.sizes)
+
+
+def iter_statistics(folders, threads=1):
+    """Yield (category, file_count, total_size) for each existing category folder, in order
+
+    folders maps category names to folder paths, like config["folders"].
+    With threads > 1 that many folders are scanned at once.
+    """
+    existing = [(category, folder) for category, folder in folders.items() if os.path.exists(folder)]
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as executor:
+            results = executor.map(_folder_statistics, [folder for _, folder in existing])
+            for (category, _), (file_count, total_size) in zip(existing, results):
+                yield category, file_count, total_size
+    else:
+        for category, folder in existing:
+            yield (category,) + _folder_statistics(folder)
+
+
+def collect_statistics(folders, threads=1):
+    """Count files and total size for each category folder
+
+    folders maps category names to folder paths, like config["folders"].
+    Returns a dict of category -> (file_count, total_size).
+    """
+    return {category: (file_count, total_size)
+            for category, file_count, total_size in iter_statistics(folders, threads)}
+
+
+def hash_file(file_path):
+    """Hash the first HASH_BLOCK_SIZE bytes of a file"""
+    with open(file_path, 'rb') as f:
+        return hashlib.md5(f.read(HASH_BLOCK_SIZE)).hexdigest()
+
+
+def _hash_or_none(file_path):
+    try:
+        return hash_file(file_path)
+    except Exception as e:
+        logger.warning(f"Error hashing {file_path}: {e}")
+        return None
+
+
+def _hash_groups(table, groups, executor, cache, concurrency=None):
+    """Hash the files of a batch of same-size groups; yield ((size, hash), paths) for each duplicate set
+
+    concurrency caps how many of the executor's threads hash at once.
+    """
+    indices = [index for group in groups for index in group]
+    paths = [table.path(index) for index in indices]
+    hashes = [None] * len(indices)
+    missing = []
+    for position, index in enumerate(indices):
+        if cache is not None:
+            stat = _CacheStat(table.inodes[index], table.sizes[index], table.mtimes[index])
+            hashes[position] = cache.get(CONTENT_HASH_KIND, paths[position], stat)
+        if hashes[position] is None:
+            missing.append(position)
+
+    files = [paths[position] for position in missing]
+    if executor is None:
+        computed = map(_hash_or_none, files)
+    elif concurrency is None:
+        computed = executor.map(_hash_or_none, files)
+    else:
+        slots = Semaphore(concurrency)
+
+        def limited(file_path):
+            with slots:
+                return _hash_or_none(file_path)
+
+        computed = executor.map(limited, files)
+    fresh = []
+    for position, value in zip(missing, computed):
+        hashes[position] = value
+        if value is not None and cache is not None:
+            index = indices[position]
+            fresh.append((paths[position], _CacheStat(table.inodes[index], table.sizes[index],
+                                                      table.mtimes[index]), value))
+    if fresh:
+        cache.put_many(CONTENT_HASH_KIND, fresh)
+
+    position = 0
+    for group in groups:
+        size = table.sizes[group[0]]
+        by_hash = defaultdict(list)
+        for _ in group:
+            if hashes[position] is not None:
+                by_hash[hashes[position]].append(paths[position])
+            position += 1
+        for value, same in by_hash.items():
+            if len(same) > 1:
+                yield (size, value), same
+
+
+def iter_duplicates(folders, progress=None, threads=1, cache=None, throttle=None):
+    """Yield ((size, hash), paths) for each set of duplicates across the given folders
+
+    Files are hashed size group by size group, so each set is yielded as
+    soon as every file of its size has been hashed. threads > 1 hashes that
+    many files at once; cache, a HashCache, skips files hashed before and
+    remembers new hashes. throttle, a throttle.Throttle, pauses hashing
+    and scales the threads used with the machine's load. progress, if
+    given, is called as progress(processed_files, total_files).
+    """
+    table = FileTable.scan(folders)
+    total_files = len(table)
+
+    # Files with a unique size can't have a duplicate, so only files whose
+    # size is shared are read at all
+    by_size = defaultdict(lambda: array('L'))
+    for index, size in enumerate(table.sizes):
+        by_size[size].append(index)
+    groups = [indices for indices in by_size.values() if len(indices) > 1]
+    processed = total_files - sum(len(indices) for indices in groups)
+    if progress is not None:
+        progress(processed, total_files)
+
+    executor = ThreadPoolExecutor(threads) if threads > 1 else None
+    try:
+        batch = []
+        batch_files = 0
+        for position, indices in enumerate(groups):
+            batch.append(indices)
+            batch_files += len(indices)
+            if batch_files < HASH_BATCH and position < len(groups) - 1:
+                continue
+            concurrency = None
+            if throttle is not None:
+                throttle.wait()
+                concurrency = max(1, throttle.limit(threads))
+            yield from _hash_groups(table, batch, executor, cache, concurrency)
+            processed += batch_files
+            batch = []
+            batch_files = 0
+            if progress is not None:
+                progress(processed, total_files)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def find_duplicates(folders, progress=None, threads=1, cache=None, throttle=None):
+    """Find files with the same size and content hash across the given folders
+
+    progress, if given, is called as progress(processed_files, total_files).
+    Returns a dict of (size, hash) -> list of paths, only for groups of two or more.
+    See iter_duplicates() for threads, cache and throttle.
+    """
+    return dict(iter_duplicates(folders, progress, threads, cache, throttle))
@@ -0,0 +1,353 @@
+import heapq
+import threading
+from collections import deque
+from time import monotonic
+
+# Lanes in increasing order of cost. Workers of a lane serve their own lane
+# first and help cheaper lanes when idle, never more expensive ones, so small
+# files are never stuck behind a large copy while every lane keeps its own
+# reserved workers.
+LANES = ("rename", "small", "large")
+DEFAULT_LANE_WORKERS = {"rename": 4, "small": 2, "large": 1}
+DEFAULT_LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+DEFAULT_LANE_MAX_WAIT = 30.0
+
+
+class _SourceQueue:
+    __slots__ = ("name", "weight", "items", "virtual_time")
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.items = deque()
+        self.virtual_time = 0.0
+
+
+class FairQueue:
+    """Weighted fair queue of pending moves, one FIFO per source
+
+    Uses stride scheduling: every dequeue advances the source's virtual time
+    by 1 / weight, and the ready source with the lowest virtual time goes
+    next. A source that was idle re-enters at the current minimum virtual
+    time, so it can't bank credit and then flood the pool. Items only become
+    ready once their settle delay has passed.
+
+    Sources can be put in groups with a limit on how many of the group's
+    items may be taken but not yet released; a group at its limit is
+    skipped until release() is called for one of its items.
+    """
+
+    def __init__(self):
+        self._sources = {}
+        self._condition = threading.Condition()
+        self._closed = False
+        self._size = 0
+        self._groups = {}
+        self._limits = {}
+        self._outstanding = {}
+
+    def add_source(self, name, weight=1, group=None):
+        with self._condition:
+            if name not in self._sources:
+                self._sources[name] = _SourceQueue(name, max(float(weight), 0.01))
+            else:
+                self._sources[name].weight = max(float(weight), 0.01)
+            self._groups[name] = group or name
+
+    def set_limit(self, group, limit):
+        """Allow at most limit outstanding items for group (None for no limit)"""
+        with self._condition:
+            if limit is None:
+                self._limits.pop(group, None)
+            else:
+                self._limits[group] = max(1, int(limit))
+            self._condition.notify_all()
+
+    def weight(self, source_name):
+        source = self._sources.get(source_name)
+        return source.weight if source is not None else 1.0
+
+    def release(self, source_name):
+        """Mark an item taken from source_name as finished"""
+        with self._condition:
+            group = self._groups.get(source_name, source_name)
+            self._outstanding[group] = self._outstanding.get(group, 1) - 1
+            if group in self._limits:
+                self._condition.notify_all()
+
+    def __len__(self):
+        return self._size
+
+    def _min_virtual_time(self):
+        active = [source.virtual_time for source in self._sources.values() if source.items]
+        return min(active) if active else 0.0
+
+    def put(self, source_name, item, ready_at=0.0):
+        with self._condition:
+            source = self._sources.get(source_name)
+            if source is None:
+                source = self._sources[source_name] = _SourceQueue(source_name, 1.0)
+            if not source.items:
+                source.virtual_time = max(source.virtual_time, self._min_virtual_time())
+            source.items.append((ready_at, item))
+            self._size += 1
+            self._condition.notify_all()
+
+    def _pop_ready(self, now):
+        best = None
+        next_ready = None
+        for source in self._sources.values():
+            if not source.items:
+                continue
+            ready_at = source.items[0][0]
+            if ready_at > now:
+                next_ready = ready_at if next_ready is None else min(next_ready, ready_at)
+                continue
+            group = self._groups.get(source.name, source.name)
+            limit = self._limits.get(group)
+            if limit is not None and self._outstanding.get(group, 0) >= limit:
+                continue
+            if best is None or source.virtual_time < best.virtual_time:
+                best = source
+        if best is None:
+            return None, next_ready
+        _, item = best.items.popleft()
+        best.virtual_time += 1.0 / best.weight
+        self._size -= 1
+        group = self._groups.get(best.name, best.name)
+        self._outstanding[group] = self._outstanding.get(group, 0) + 1
+        return (best.name, item), None
+
+    def get(self):
+        """Block until an item is ready and return (source_name, item), or None once closed"""
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                now = monotonic()
+                entry, next_ready = self._pop_ready(now)
+                if entry is not None:
+                    return entry
+                self._condition.wait(None if next_ready is None else next_ready - now)
+
+    def pending(self):
+        """Return a list of (source_name, item) still waiting in the queue"""
+        with self._condition:
+            return [(source.name, item) for source in self._sources.values() for _, item in source.items]
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class _LaneSource:
+    __slots__ = ("heap", "arrivals", "size", "weight", "virtual_time")
+
+    def __init__(self):
+        self.heap = []
+        self.arrivals = deque()
+        self.size = 0
+        self.weight = 1.0
+        self.virtual_time = 0.0
+
+    def pop(self, now, max_wait):
+        while self.arrivals[0][5]:
+            self.arrivals.popleft()
+        if now - self.arrivals[0][2] >= max_wait:
+            entry = self.arrivals.popleft()
+        else:
+            entry = heapq.heappop(self.heap)
+            while entry[5]:
+                entry = heapq.heappop(self.heap)
+        entry[5] = True
+        self.size -= 1
+        if not self.size:
+            self.heap.clear()
+            self.arrivals.clear()
+        return entry
+
+
+class LaneQueue:
+    """Pending moves of one lane, fair across sources and smallest file first within each
+
+    Sources take turns by weighted stride scheduling, as in FairQueue, so a
+    source that floods the lane can't push another source's files to the
+    back. Within a source the smallest file goes first, but an item that
+    has waited longer than max_wait is served before any smaller one, so a
+    steady stream of small files can't starve a big one.
+    """
+
+    def __init__(self, max_wait=DEFAULT_LANE_MAX_WAIT):
+        self.max_wait = max_wait
+        self._sources = {}
+        self._sequence = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _min_virtual_time(self):
+        active = [source.virtual_time for source in self._sources.values() if source.size]
+        return min(active) if active else 0.0
+
+    def push(self, source_name, item, size, now, weight=1.0):
+        source = self._sources.get(source_name)
+        if source is None:
+            source = self._sources[source_name] = _LaneSource()
+        if not source.size:
+            source.virtual_time = max(source.virtual_time, self._min_virtual_time())
+        source.weight = weight
+        # [size, sequence, enqueued_at, source_name, item, taken]
+        entry = [size, self._sequence, now, source_name, item, False]
+        self._sequence += 1
+        heapq.heappush(source.heap, entry)
+        source.arrivals.append(entry)
+        source.size += 1
+        self._size += 1
+
+    def pop(self, now):
+        """Return (source_name, item, enqueued_at) of the next item, or None if empty"""
+        best = None
+        for source in self._sources.values():
+            if source.size and (best is None or source.virtual_time < best.virtual_time):
+                best = source
+        if best is None:
+            return None
+        entry = best.pop(now, self.max_wait)
+        best.virtual_time += 1.0 / best.weight
+        self._size -= 1
+        return entry[3], entry[4], entry[2]
+
+    def pending(self):
+        return [(entry[3], entry[4]) for source in self._sources.values()
+                for entry in source.arrivals if not entry[5]]
+
+
+class MoverPool:
+    """Worker threads shared by every source, split into cost lanes
+
+    Submitted items wait in a FairQueue until their settle delay passes.
+    A dispatcher then asks estimator(source_name, item) for the item's lane
+    ("rename", "small" or "large") and size, and queues it in that lane,
+    which is served by the lane's own workers. Each lane is fair-queued by
+    source weight again, so sizes only reorder files within a source. With a throttle (see
+    throttle.py), only as many of each lane's workers as the throttle allows
+    pick up new items; the rest wait until the machine is calmer.
+    """
+
+    def __init__(self, handler, logger, lane_workers=None, estimator=None, on_dequeue=None, metrics=None,
+                 max_wait=DEFAULT_LANE_MAX_WAIT, throttle=None):
+        self.handler = handler
+        self.logger = logger
+        self.lane_workers = dict(DEFAULT_LANE_WORKERS)
+        self.lane_workers.update(lane_workers or {})
+        self.estimator = estimator
+        self.on_dequeue = on_dequeue
+        self.metrics = metrics
+        self.queue = FairQueue()
+        self.lanes = {lane: LaneQueue(max_wait) for lane in LANES}
+        self._lane_condition = threading.Condition()
+        self._closed = False
+        self._threads = []
+        self.throttle = throttle
+        if throttle is not None:
+            throttle.add_listener(self._throttled)
+
+    def _throttled(self, state):
+        with self._lane_condition:
+            self._lane_condition.notify_all()
+
+    def _allowed(self, lane, index):
+        if self.throttle is None:
+            return True
+        return index < self.throttle.limit(max(1, int(self.lane_workers.get(lane, 1))))
+
+    def start(self):
+        dispatcher = threading.Thread(target=self._dispatch, name="mover-dispatcher", daemon=True)
+        dispatcher.start()
+        self._threads.append(dispatcher)
+        for lane in LANES:
+            for index in range(max(1, int(self.lane_workers.get(lane, 1)))):
+                thread = threading.Thread(target=self._run, args=(lane, index), name=f"mover-{lane}-{index}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, source_name, item, delay=0.0):
+        self.queue.put(source_name, item, monotonic() + delay)
+
+    def pending(self):
+        """Return every (source_name, item) not yet picked up by a worker"""
+        pending = self.queue.pending()
+        with self._lane_condition:
+            for lane_queue in self.lanes.values():
+                pending.extend(lane_queue.pending())
+        return pending
+
+    def _estimate(self, source_name, item):
+        if self.estimator is None:
+            return "rename", 0
+        try:
+            lane, size = self.estimator(source_name, item)
+        except Exception as e:
+            self.logger.error(f"Failed to estimate the cost of {item}: {e}")
+            return "large", 0
+        return (lane if lane in self.lanes else "large"), size
+
+    def _dispatch(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+            source_name, item = entry
+            lane, size = self._estimate(source_name, item)
+            with self._lane_condition:
+                self.lanes[lane].push(source_name, item, size, monotonic(), self.queue.weight(source_name))
+                self._lane_condition.notify_all()
+            if self.metrics is not None:
+                self.metrics.lane_depth.labels(lane).inc()
+
+    def _next(self, own_lane, index=0):
+        # Own lane first, then the cheaper lanes from the most to the least expensive
+        eligible = [own_lane] + list(reversed(LANES[:LANES.index(own_lane)]))
+        with self._lane_condition:
+            while not self._closed:
+                if not self._allowed(own_lane, index):
+                    self._lane_condition.wait()
+                    continue
+                now = monotonic()
+                for lane in eligible:
+                    entry = self.lanes[lane].pop(now)
+                    if entry is not None:
+                        return (lane,) + entry
+                self._lane_condition.wait()
+        return None
+
+    def _run(self, own_lane, index=0):
+        while True:
+            picked = self._next(own_lane, index)
+            if picked is None:
+                return
+            lane, source_name, item, enqueued_at = picked
+            if self.metrics is not None:
+                self.metrics.lane_depth.labels(lane).dec()
+            if self.on_dequeue is not None:
+                self.on_dequeue(source_name)
+            try:
+                self.handler(source_name, item)
+            except Exception as e:
+                self.logger.exception(f"Mover failed on {item} from {source_name}: {e}")
+            finally:
+                self.queue.release(source_name)
+            if self.metrics is not None:
+                self.metrics.lane_latency.labels(lane).observe(monotonic() - enqueued_at)
+
+    def stop(self):
+        self.queue.close()
+        with self._lane_condition:
+            self._closed = True
+            self._lane_condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -13,37 +13,201 @@ import argparse
 import platform
 import sys
 import subprocess
-from time import sleep
+import atexit
+import hashlib
+from time import sleep, perf_counter, monotonic
 from threading import Thread
+from contextlib import nullcontext
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from pystray import Icon, Menu, MenuItem
 from PIL import Image, ImageDraw
 from plyer import notification
-import winreg as reg
-import tkinter as tk
-from tkinter import messagebox
+from metrics import OrganizerMetrics, MetricsServer, TextfileWriter
+from profiling import Profiler, profile_call
+from planner import write_plan, apply_plan
+from batch import BatchExecutor
+from journal import IntentLog
+from snapshot import DirectorySnapshot
+from polling import AdaptivePollingObserver, is_network_filesystem
+from config import ConfigSnapshot
+from scheduler import MoverPool, DEFAULT_LANE_WORKERS, DEFAULT_LARGE_FILE_THRESHOLD, DEFAULT_LANE_MAX_WAIT
+from devices import DeviceScheduler, DEFAULT_SAME_DEVICE_LIMIT, DEFAULT_CROSS_DEVICE_LIMIT
+from dedupe import Deduplicator
+from cache import HashCache
+from perceptual import find_similar_images, IMAGE_EXTENSIONS, DEFAULT_MAX_DISTANCE
+from scanner import find_duplicates, format_size
+from sharding import start_reshard
+from metadata import MetadataExtractor, DEFAULT_BYTE_BUDGET, DEFAULT_CACHE_ENTRIES
+from plugins import ClassifierEngine, load_classifiers, PREFETCH_CHUNK
+from eventtrace import EventRecorder
+from throttle import Throttle, ThrottlePolicy, DEFAULT_THROTTLE_INTERVAL
+from durability import move as durable_move, DEFAULT_DURABILITY
+from freespace import (FreeSpaceTracker, DestinationFull, is_out_of_space, remove_partial_copy,
+                       DEFAULT_FREE_SPACE_TTL, DEFAULT_MIN_FREE, DEFAULT_LOW_WATERMARK)
+
+# The tray icon, registry and dialogs are optional so the organizer can
+# also run headless (benchmarks, servers without a display).
+try:
+    from pystray import Icon, Menu, MenuItem
+except Exception:
+    Icon = Menu = MenuItem = None
+try:
+    import winreg as reg
+except ImportError:
+    reg = None
+try:
+    import tkinter as tk
+    from tkinter import messagebox
+except ImportError:
+    tk = messagebox = None
 
 class FileOrganizer:
-    def __init__(self, args):
+    """Watches the configured folders and moves new files into their category folders
+
+    Normally an organizer owns all of its threads. The multi-user daemon
+    instead passes in a shared mover_pool, device_scheduler and native
+    observer, a tenant name that namespaces this organizer's sources in the
+    shared pool, a state_dir for its journal and snapshots, a logger, an
+    owner (uid, gid) for created folders and copied files, a
+    config_validator that can reject a config, the shared throttle, and an
+    identity context that makes file operations run as the user.
+    """
+
+    def __init__(self, args, tenant=None, state_dir=None, logger=None, mover_pool=None, device_scheduler=None,
+                 observer=None, owner=None, config_validator=None, identity=None, throttle=None):
         self.args = args
         self.config_path = args.config
         self.shutdown_flag = False
+        self.tenant = tenant
+        self.pool_prefix = f"{tenant}/" if tenant else ""
+        self.owner = owner
+        self.config_validator = config_validator
+        # Entered around file operations done on threads the daemon owns
+        self.identity = identity or nullcontext()
+        # Desktop notifications and the tray only make sense for a single user session
+        self.desktop = tenant is None
 
         user_home = os.path.expanduser("~")
-        config_dir = os.path.join(user_home, '.config', 'mfo')
+        config_dir = state_dir or os.path.join(user_home, '.config', 'mfo')
         os.makedirs(config_dir, exist_ok=True)
         self.args.log_file_path = os.path.join(config_dir, 'messy_files.log')
+        self.config_dir = config_dir
+        self.journal_path = os.path.join(config_dir, 'journal.log')
+        self.dedupe_journal_path = os.path.join(config_dir, 'dedupe-journal.log')
+        self.hash_cache_path = os.path.join(config_dir, 'hash-cache.sqlite3')
 
         self.load_config()
-        self.logger = self.configure_logging()
+        self.logger = logger or self.configure_logging()
+        self.metrics = OrganizerMetrics()
+        self.profiler = Profiler(getattr(args, 'profile', False) or self.config.get('profile', False))
+        if self.profiler.enabled:
+            atexit.register(self.profiler.print_report)
+        self.metrics_exporters = []
+        self._device_cache = {}
+        self.device_scheduler = device_scheduler or DeviceScheduler(
+            self.config.get('same_device_limit', DEFAULT_SAME_DEVICE_LIMIT),
+            self.config.get('cross_device_limit', DEFAULT_CROSS_DEVICE_LIMIT),
+            self.config.get('device_limits', {}),
+            self.metrics)
+        free_space = self.config.get('free_space', {})
+        self.free_space = FreeSpaceTracker(free_space.get('ttl', DEFAULT_FREE_SPACE_TTL),
+                                           free_space.get('min_free', DEFAULT_MIN_FREE),
+                                           free_space.get('low_watermark', DEFAULT_LOW_WATERMARK),
+                                           self.low_space_alert, self.metrics)
+        metadata_config = self.config.get('metadata', {})
+        self.metadata = MetadataExtractor(metadata_config.get('byte_budget', DEFAULT_BYTE_BUDGET),
+                                          metadata_config.get('cache_entries', DEFAULT_CACHE_ENTRIES),
+                                          self.logger, self.metrics)
+        self.plugins = self.load_plugins()
+        self.trace = None
         self.backup_config()
         self.create_folders()
+        self.journal = None
+        if self.config.get("journal", True):
+            self.journal = IntentLog(self.journal_path)
+            self.journal.recover(self.logger)
         self.monitoring = True
-        self.observer = None
-        self.event_handler = DownloadEventHandler(self)
+        self.observers = []
+        self.shared_observer = observer
+        self.shared_watches = []
+        self.config_observer = None
+        self.config_watch = None
+        lanes = self.config.get('lanes', {})
+        self.large_file_threshold = lanes.get('large_file_threshold', DEFAULT_LARGE_FILE_THRESHOLD)
+        self.owns_mover_pool = mover_pool is None
+        # The daemon passes in the throttle of its shared pool
+        self.throttle = self.create_throttle() if self.owns_mover_pool else throttle
+        if self.owns_mover_pool:
+            lane_workers = {'rename': self.config.get('workers', DEFAULT_LANE_WORKERS['rename'])}
+            lane_workers.update(lanes.get('workers', {}))
+            mover_pool = MoverPool(self.process_event, self.logger, lane_workers, self.estimate_lane,
+                                   on_dequeue=lambda source_name: self.metrics.queue_depth.dec(),
+                                   metrics=self.metrics, max_wait=lanes.get('max_wait', DEFAULT_LANE_MAX_WAIT),
+                                   throttle=self.throttle)
+        self.mover_pool = mover_pool
+        self.pool_weight = 1
+        self.add_pool_sources()
+        if self.owns_mover_pool:
+            self.mover_pool.start()
+            self.start_metrics_exporters()
         self.icon_path = self.config.get("icon_path", "mfo.png")
 
+    def add_pool_sources(self, sources=None):
+        for source in self.sources if sources is None else sources:
+            self.mover_pool.queue.add_source(self.pool_prefix + source['name'], source['weight'] * self.pool_weight,
+                                             self.tenant)
+
+    def restore_owner(self, path, uid_gid=None):
+        """Give a folder or copied file back to its owner when running as a multi-user daemon"""
+        if self.owner is None or not hasattr(os, 'lchown'):
+            return
+        try:
+            # lchown: never follow a link the user may have planted in their own folders
+            os.lchown(path, *(uid_gid or self.owner))
+        except OSError as e:
+            self.logger.error(f"Failed to set the owner of {path}: {e}")
+
+    def make_folders(self, path):
+        """Create a folder and any missing parents, giving each new one back to its owner"""
+        missing = []
+        while path and not os.path.isdir(path):
+            missing.append(path)
+            path = os.path.dirname(path)
+        for folder in reversed(missing):
+            os.makedirs(folder, exist_ok=True)
+            self.restore_owner(folder)
+
+    def start_metrics_exporters(self):
+        metrics_config = self.config.get("metrics", {})
+        port = metrics_config.get("port")
+        textfile = metrics_config.get("textfile")
+        try:
+            if port:
+                server = MetricsServer(self.metrics.registry, int(port))
+                server.start()
+                self.metrics_exporters.append(server)
+                self.logger.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+            if textfile:
+                writer = TextfileWriter(self.metrics.registry, textfile, metrics_config.get("interval", 15))
+                writer.start()
+                self.metrics_exporters.append(writer)
+                self.logger.info(f"Writing metrics to {textfile}")
+        except Exception as e:
+            self.logger.error(f"Failed to start metrics exporter: {e}")
+
+    def stop_metrics_exporters(self):
+        for exporter in self.metrics_exporters:
+            exporter.stop()
+        self.metrics_exporters = []
+
+    def get_device(self, path):
+        # Destination folders rarely change device, so cache their st_dev
+        device = self._device_cache.get(path)
+        if device is None:
+            device = os.stat(path).st_dev
+            self._device_cache[path] = device
+        return device
+
     def create_image(self):
         if os.path.isfile(self.icon_path):
             return Image.open(self.icon_path)
@@ -69,8 +233,9 @@ class FileOrganizer:
         if not os.path.exists(self.config_path):
             self.create_default_config()
         try:
-            with open(self.config_path, 'r') as file:
-                self.config = json.load(file)
+            self.config = ConfigSnapshot.load(self.config_path)
+            if self.config_validator is not None:
+                self.config_validator(self.config)
         except Exception as e:
             print(f"Failed to load configuration file: {e}")
             sys.exit(1)
@@ -111,17 +276,43 @@ class FileOrganizer:
             json.dump(default_config, file, indent=4)
         print(f"Default configuration file created at: {self.config_path}")
 
+    # The watched folders and their rules belong to the current config
+    # snapshot, so they are swapped together with it on reload
+
+    @property
+    def sources(self):
+        return self.config.sources
+
+    @property
+    def source_by_name(self):
+        return self.config.source_by_name
+
+    @property
+    def destination_prefixes(self):
+        return self.config.destination_prefixes
+
+    def is_destination_path(self, path):
+        """True for a destination folder itself and anything inside one"""
+        # normpath drops any trailing separator, so add it back for the prefix match
+        return (os.path.normpath(path) + os.sep).startswith(self.destination_prefixes)
+
     def backup_config(self):
         try:
-            backup_path = self.config_path + ".bak"
+            if self.tenant is None:
+                backup_path = self.config_path + ".bak"
+            else:
+                backup_path = os.path.join(self.config_dir, os.path.basename(self.config_path) + ".bak")
             shutil.copy(self.config_path, backup_path)
             self.logger.info(f"Backup of configuration file created at: {backup_path}")
         except Exception as e:
             self.logger.error(f"Failed to create backup of configuration file: {e}")
 
     def create_folders(self):
-        for folder in self.config['folders'].values():
-            os.makedirs(folder, exist_ok=True)
+        for source in self.sources:
+            for folder in source['folders'].values():
+                if not os.path.isdir(folder):
+                    os.makedirs(folder, exist_ok=True)
+                    self.restore_owner(folder)
 
     def get_unique_file_path(self, destination, filename):
         base, extension = os.path.splitext(filename)
@@ -132,58 +323,492 @@ class FileOrganizer:
             counter += 1
         return new_file_path
 
-    def move_file(self, file_path):
+    def is_temporary_file(self, file_path):
         _, extension = os.path.splitext(file_path)
-        if extension == '.tmp' and '.part' or file_path.endswith('~'):
-            self.logger.info(f"Ignored temporary file: {file_path}")
+        return extension == '.tmp' and '.part' or file_path.endswith('~')
+
+    def load_plugins(self):
+        """Load the classifier plugins and apply their settings from the 'plugins' config section
+
+        Plugins in the config folder's plugins directory are only loaded for
+        a single user; the daemon runs as root, so its users only get plugins
+        installed system-wide as 'mfo.classifiers' entry points.
+        """
+        plugins_config = self.config.get('plugins', {})
+        if not plugins_config.get('enabled', True):
+            return None
+        directory = None if self.tenant else plugins_config.get('directory', os.path.join(self.config_dir, 'plugins'))
+        disabled = set(plugins_config.get('disabled', []))
+        classifiers = []
+        for classifier in load_classifiers(directory, self.logger):
+            if classifier.name in disabled:
+                continue
+            try:
+                classifier.configure(plugins_config.get('settings', {}).get(classifier.name, {}))
+            except Exception as e:
+                self.logger.error(f"Invalid settings for classifier plugin {classifier.name}: {e}")
+                continue
+            classifiers.append(classifier)
+            self.logger.info(f"Loaded classifier plugin {classifier.name} (inputs: {', '.join(classifier.inputs)})")
+        if not classifiers:
+            return None
+        return ClassifierEngine(classifiers, self.logger, self.metrics, self.metadata)
+
+    def prefetched(self, entries):
+        """Yield entries unchanged, first classifying them with the plugins in batches"""
+        if self.plugins is None:
+            yield from entries
             return
+        chunk = []
+        for entry in entries:
+            chunk.append(entry)
+            if len(chunk) >= PREFETCH_CHUNK:
+                self._prefetch(chunk)
+                yield from chunk
+                chunk = []
+        self._prefetch(chunk)
+        yield from chunk
 
-        destination = self.config['folders']['Other']
-        category = 'Other'
+    def _prefetch(self, entries):
+        files = []
+        for entry in entries:
+            try:
+                if entry.is_file() and not self.is_temporary_file(entry.path):
+                    files.append((entry.path, entry.stat()))
+            except OSError:
+                continue
+        self.plugins.prefetch(files)
 
-        for ext, folder in self.config.get('default_folder_mappings', {}).items():
-            if extension == ext:
-                destination = self.config['folders'].get(folder, destination)
-                category = folder
-                break
+    def classify(self, file_path, source=None, stat=None, route=True):
+        """Return the (category, destination folder) a file belongs in, using the source's rules if given
 
-        for cat, extensions in self.config['file_types'].items():
-            if extension in extensions:
-                destination = self.config['folders'][cat]
-                category = cat
-                break
+        Classifier plugins get the first say, then metadata routing rules;
+        the file's headers are only read if a rule could apply to its type.
+        route=False classifies by extension alone.
+        """
+        rules = source or self.config.default_rules
+        if route and self.plugins is not None:
+            try:
+                category = self.plugins.classify(file_path, stat)
+            except OSError:
+                category = None
+            if category is not None:
+                if category in rules['folders']:
+                    return category, rules['folders'][category]
+                self.logger.warning(f"Classifier plugins chose '{category}' for {file_path}, which has no folder")
+        if route and rules['routing']:
+            routed = self.route(file_path, rules, stat)
+            if routed is not None:
+                return routed
+        _, extension = os.path.splitext(file_path)
+        found = rules['extension_map'].get(extension)
+        if found is None:
+            return 'Other', rules['folders']['Other']
+        return found
+
+    def route(self, file_path, rules, stat=None):
+        kind = self.metadata.kind_of(file_path)
+        if kind is None or not any(rule.applies_to(kind) for rule in rules['routing']):
+            return None
+        metadata = self.metadata.extract(file_path, stat)
+        if metadata is None:
+            return None
+        for rule in rules['routing']:
+            if rule.matches(metadata):
+                return rule.category, rules['folders'][rule.category]
+        return None
+
+    def create_throttle(self):
+        """Start sampling system load per the 'throttle' config section; None if it is disabled"""
+        options = self.config.get('throttle', {})
+        if not options.get('enabled', True):
+            return None
+        try:
+            policy = ThrottlePolicy.from_config(options)
+        except (TypeError, ValueError) as e:
+            self.logger.error(f"Invalid throttle settings, not throttling: {e}")
+            return None
+        throttle = Throttle(policy, options.get('interval', DEFAULT_THROTTLE_INTERVAL), self.logger, self.metrics)
+        throttle.start()
+        return throttle
+
+    def low_space_alert(self, folder, free):
+        self.metrics.low_space_alerts.inc()
+        self.logger.warning(f"Low free space on the disk of {folder}: {format_size(free)} left")
+        if self.config.notifications and self.desktop:
+            notification.notify(
+                title="Low Disk Space",
+                message=f"Only {format_size(free)} left for {folder}",
+                timeout=10
+            )
+
+    def choose_destination(self, source, category, destination, file_path, stat, exclude=()):
+        """Return (folder, reserved): destination, or the first overflow folder with room for the file
+
+        Moves to another device reserve the file's size in the free space
+        tracker (reserved=True); a rename within a device needs no space.
+        Devices in exclude are passed over. Raises DestinationFull if no
+        candidate has room.
+        """
+        rules = source or self.config.default_rules
+        for folder in (destination,) + rules['overflow'].get(category, ()):
+            try:
+                if folder != destination:
+                    self.make_folders(folder)
+                device = self.get_device(folder)
+                if device in exclude:
+                    continue
+                reserved = device != stat.st_dev
+                if reserved and not self.free_space.reserve(folder, device, stat.st_size):
+                    continue
+            except OSError as e:
+                self.logger.error(f"Cannot use {folder} for {file_path}: {e}")
+                continue
+            if folder != destination:
+                self.metrics.overflow_moves.labels(category).inc()
+                self.logger.info(f"Not enough free space in {destination}; using overflow folder {folder} for {file_path}")
+            return folder, reserved
+        raise DestinationFull(destination, stat.st_size)
+
+    def shard_folder(self, source, category, destination, file_path, stat):
+        """Return the folder inside destination a file goes to, per the category's sharding layout"""
+        rules = source or self.config.default_rules
+        layout = rules['sharding'].get(category)
+        if layout is None:
+            return destination
+        metadata = self.metadata.extract(file_path, stat) if layout.needs_metadata else None
+        return layout.folder(destination, os.path.basename(file_path), stat, metadata)
 
+    def move_file(self, file_path, event_time=None, source=None):
+        span = self.profiler.span
+        if self.is_temporary_file(file_path):
+            self.logger.info(f"Ignored temporary file: {file_path}")
+            return
+
+        # Read the config once so a concurrent reload can't mix two versions
+        config = self.config
+        if source is not None:
+            source = config.source_by_name.get(source['name'], source)
+
+        with span('classify'):
+            category, destination = self.classify(file_path, source)
+
+        metrics = self.metrics
         attempts = 0
-        while attempts < self.config['retry_attempts']:
+        # Devices that ran out of space during this file's moves
+        full_devices = set()
+        while attempts < config.retry_attempts:
+            unique_file_path = reserved_device = None
             try:
-                unique_file_path = self.get_unique_file_path(destination, os.path.basename(file_path))
-                shutil.move(file_path, unique_file_path)
-                self.logger.info(f"Moved file: {file_path} to {unique_file_path}")
-                if self.config['notifications']:
-                    notification.notify(
-                        title="File Moved",
-                        message=f"File: {os.path.basename(file_path)}\nCategory: {category}\nDestination: {unique_file_path}",
-                        timeout=10
-                    )
+                stat = os.stat(file_path)
+                name = os.path.basename(file_path)
+                folder, reserved = self.choose_destination(source, category, destination, file_path, stat,
+                                                           full_devices)
+                destination_device = self.get_device(folder)
+                if reserved:
+                    reserved_device = destination_device
+                target = self.shard_folder(source, category, folder, file_path, stat)
+                if target != folder:
+                    self.make_folders(target)
+                with span('unique_path'):
+                    unique_file_path = self.get_unique_file_path(target, name)
+                with self.device_scheduler.slot(stat.st_dev, destination_device, file_path, folder,
+                                                stat.st_size) as device:
+                    started = perf_counter()
+                    with span(f'move_{device}_device'):
+                        durable_move(file_path, unique_file_path,
+                                     config.durability.get(category, DEFAULT_DURABILITY))
+                reserved_device = None
+                if device == 'cross':
+                    self.restore_owner(unique_file_path, (stat.st_uid, stat.st_gid))
+                metrics.move_duration.labels(device).observe(perf_counter() - started)
+                metrics.bytes_moved.labels(category).inc(stat.st_size)
+                metrics.files_moved.labels(category).inc()
+                if event_time is not None:
+                    metrics.event_to_move.observe(monotonic() - event_time)
+                with span('log'):
+                    self.logger.info(f"Moved file: {file_path} to {unique_file_path}")
+                if config.notifications and self.desktop:
+                    started = perf_counter()
+                    with span('notify'):
+                        notification.notify(
+                            title="File Moved",
+                            message=f"File: {os.path.basename(file_path)}\nCategory: {category}\nDestination: {unique_file_path}",
+                            timeout=10
+                        )
+                    metrics.notification_latency.observe(perf_counter() - started)
+                break
+            except DestinationFull:
+                # Retrying would only repeat the copy that can't fit
+                metrics.failures.inc()
+                self.logger.error(f"Not enough free space for {file_path} in {destination} or its overflow folders; leaving it in place")
                 break
+            except FileExistsError as e:
+                # Another writer took the name after it was chosen; retry at once with a new one
+                attempts += 1
+                if reserved_device is not None:
+                    self.free_space.release(reserved_device, stat.st_size)
+                self.logger.warning(f"Failed to move {file_path}: {e}. Attempt {attempts} of {config.retry_attempts}.")
             except FileNotFoundError:
                 attempts += 1
-                self.logger.warning(f"File not found: {file_path}. Attempt {attempts} of {self.config['retry_attempts']}. Retrying...")
-                sleep(self.config['retry_delay'])
+                if reserved_device is not None:
+                    self.free_space.release(reserved_device, stat.st_size)
+                metrics.retries.labels('not_found').inc()
+                self.logger.warning(f"File not found: {file_path}. Attempt {attempts} of {config.retry_attempts}. Retrying...")
+                sleep(config.retry_delay)
             except Exception as e:
-                self.logger.error(f"Failed to move file: {file_path}. Attempt {attempts} of {self.config['retry_attempts']}. Reason: {e}")
-                sleep(self.config['retry_delay'])
+                attempts += 1
+                if reserved_device is not None:
+                    self.free_space.release(reserved_device, stat.st_size)
+                if is_out_of_space(e):
+                    # The disk filled up under the copy: clean up and move on
+                    # to an overflow folder right away instead of copying again
+                    if unique_file_path is not None:
+                        remove_partial_copy(file_path, unique_file_path)
+                    self.free_space.exhausted(destination_device)
+                    full_devices.add(destination_device)
+                    metrics.retries.labels('no_space').inc()
+                    self.logger.warning(f"Ran out of space moving {file_path} to {unique_file_path}; trying overflow folders")
+                    continue
+                metrics.retries.labels('error').inc()
+                self.logger.error(f"Failed to move file: {file_path}. Attempt {attempts} of {config.retry_attempts}. Reason: {e}")
+                sleep(config.retry_delay)
         else:
+            metrics.failures.inc()
             self.logger.error(f"Exhausted all retry attempts for file: {file_path}")
 
+    def organize_entries(self, entries, source=None):
+        """Move the given os.DirEntry files in bulk and return how many were moved"""
+        executor = BatchExecutor(self)
+        for entry in self.prefetched(entries):
+            if self.shutdown_flag:
+                break
+            if not entry.is_file():
+                continue
+            if self.is_temporary_file(entry.path):
+                self.logger.info(f"Ignored temporary file: {entry.path}")
+                continue
+            try:
+                stat = entry.stat()
+            except OSError as e:
+                # Removed or renamed since the folder was listed
+                self.logger.warning(f"Failed to stat {entry.path}: {e}. Skipping.")
+                continue
+            category, destination = self.classify(entry.path, source, stat)
+            try:
+                folder, reserved = self.choose_destination(source, category, destination, entry.path, stat)
+            except DestinationFull:
+                self.metrics.failures.inc()
+                self.logger.error(f"Not enough free space for {entry.path} in {destination} or its overflow folders; leaving it in place")
+                continue
+            executor.add(entry.path, self.shard_folder(source, category, folder, entry.path, stat),
+                         category, stat=stat, reserved=reserved)
+        executor.run()
+        moved = executor.moved
+        if moved and self.config.notifications and self.desktop:
+            notification.notify(
+                title="Messy File Organizer",
+                message=f"Organized {moved} files from {source['path'] if source else 'the watched folders'}",
+                timeout=10
+            )
+        return moved
+
+    def iter_source_entries(self, source):
+        """Yield the file entries of a source, descending into subfolders if it is recursive"""
+        pending = [source['path']]
+        while pending:
+            folder = pending.pop()
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            if source['recursive'] and not self.is_destination_path(entry.path):
+                                pending.append(entry.path)
+                        elif entry.is_file():
+                            yield entry
+            except OSError as e:
+                self.logger.error(f"Failed to scan {folder}: {e}")
+
+    def sweep(self):
+        """Organize every file already present in the watched folders"""
+        moved = 0
+        for source in self.sources:
+            source_moved = self.organize_entries(self.iter_source_entries(source), source)
+            self.logger.info(f"Sweep of {source['path']} moved {source_moved} files")
+            moved += source_moved
+        return moved
+
+    def deduplicate(self):
+        """Replace duplicate files in the category folders with hardlinks or reflinks"""
+        folders = sorted({folder for source in self.sources for folder in source['folders'].values()})
+        cache = HashCache(self.hash_cache_path)
+        try:
+            duplicates = find_duplicates(folders, cache=cache, throttle=self.throttle)
+        finally:
+            cache.close()
+        mode = self.config.get('duplicate_detection', {}).get('link_mode', 'auto')
+        deduplicator = Deduplicator(self.dedupe_journal_path, mode, self.logger)
+        files_linked, bytes_reclaimed = deduplicator.run(duplicates.values())
+        self.logger.info(f"Deduplicated {files_linked} files, reclaiming {format_size(bytes_reclaimed)}")
+        return files_linked, bytes_reclaimed
+
+    def undo_deduplicate(self):
+        """Turn files linked by deduplicate() back into independent copies"""
+        return Deduplicator(self.dedupe_journal_path, logger=self.logger).undo()
+
+    def find_similar_images(self):
+        """Group visually similar images (resized or re-encoded copies) in the Images folders"""
+        folders = sorted({source['folders']['Images'] for source in self.sources if 'Images' in source['folders']})
+        extensions = self.config['file_types'].get('Images', IMAGE_EXTENSIONS)
+        max_distance = self.config.get('duplicate_detection', {}).get('max_distance', DEFAULT_MAX_DISTANCE)
+        workers = None
+        if self.throttle is not None:
+            self.throttle.wait()
+            workers = max(1, self.throttle.limit(os.cpu_count() or 1))
+        cache = HashCache(self.hash_cache_path)
+        try:
+            groups = find_similar_images(folders, max_distance, extensions, cache, workers)
+        finally:
+            cache.close()
+        for group in groups:
+            self.logger.info(f"Found {len(group)} similar images: {', '.join(group)}")
+        self.logger.info(f"Found {len(groups)} groups of similar images")
+        return groups
+
+    def snapshot_path(self, source):
+        digest = hashlib.md5(os.path.normpath(source['path']).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(self.config_dir, f"snapshot-{digest}.json")
+
+    def catch_up(self):
+        """Organize files that arrived in the watched folders while monitoring was stopped or paused"""
+        moved = 0
+        with self.identity:
+            for source in self.sources:
+                snapshot = DirectorySnapshot.load(self.snapshot_path(source))
+                if snapshot is None or snapshot.folder != source['path'] or snapshot.recursive != source['recursive']:
+                    self.logger.info(f"No snapshot of {source['path']} yet; skipping catch-up.")
+                else:
+                    source_moved = self.organize_entries(snapshot.changed_entries(self.is_destination_path), source)
+                    self.logger.info(f"Caught up on {source_moved} files added to {source['path']} while not monitoring")
+                    moved += source_moved
+                # Save a baseline right away so an unclean exit still has something to diff against
+                self.save_snapshot(source)
+        return moved
+
+    def save_snapshot(self, source):
+        try:
+            snapshot = DirectorySnapshot.capture(source['path'], source['recursive'], self.is_destination_path)
+        except OSError as e:
+            self.logger.error(f"Failed to save snapshot of {source['path']}: {e}")
+            return
+        # Files still waiting in the mover queue have not been organized yet,
+        # so leave them out and let the next catch-up find them
+        for source_name, (file_path, _) in self.mover_pool.pending():
+            if source_name == self.pool_prefix + source['name']:
+                snapshot.entries.pop(os.path.relpath(file_path, source['path']), None)
+        try:
+            snapshot.save(self.snapshot_path(source))
+        except OSError as e:
+            self.logger.error(f"Failed to save snapshot of {source['path']}: {e}")
+
+    def observer_kind(self, path, options):
+        """Return 'native' or 'polling', as chosen by options['observer']"""
+        kind = options.get('observer', 'auto')
+        if kind == 'auto':
+            kind = 'polling' if is_network_filesystem(path) else 'native'
+        return kind
+
+    def create_observer(self, path, options):
+        """Create a native or polling observer for path, as chosen by options['observer']"""
+        if self.observer_kind(path, options) == 'polling':
+            polling = options.get('polling', {})
+            self.logger.info(f"Using polling observer for {path}")
+            return AdaptivePollingObserver(polling.get('min_interval', 1.0), polling.get('max_interval', 60.0))
+        return Observer()
+
+    @property
+    def watching(self):
+        return bool(self.observers or self.shared_watches)
+
+    def enqueue(self, source, file_path):
+        """Queue a new file for the shared mover pool once its settle delay has passed"""
+        self.metrics.queue_depth.inc()
+        self.mover_pool.submit(self.pool_prefix + source['name'], (file_path, monotonic()), self.config.settle_delay)
+
+    def estimate_lane(self, source_name, item):
+        """Return the mover lane and size for a queued file, from its size and destination device"""
+        file_path, _ = item
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            # Gone already; move_file will notice cheaply
+            return 'rename', 0
+        _, destination = self.classify(file_path, self.source_by_name.get(source_name), route=False)
+        try:
+            same_device = stat.st_dev == self.get_device(destination)
+        except OSError:
+            same_device = False
+        if same_device:
+            return 'rename', stat.st_size
+        return ('large' if stat.st_size >= self.large_file_threshold else 'small'), stat.st_size
+
+    def process_event(self, source_name, item):
+        file_path, event_time = item
+        source = self.source_by_name.get(source_name)
+        with self.profiler.span('handler_move'):
+            self.move_file(file_path, event_time, source)
+
+    def start_source_observers(self):
+        # All native sources share one observer; polling sources each get
+        # their own so their intervals adapt independently
+        native_observer = None
+        for source in self.sources:
+            if self.shared_observer is not None and self.observer_kind(source['path'], source) == 'native':
+                self.shared_watches.append(self.shared_observer.schedule(
+                    DownloadEventHandler(self, source), source['path'], recursive=source['recursive']))
+                self.logger.info(f"Monitoring {source['name']} folder for new files: {source['path']}")
+                continue
+            observer = self.create_observer(source['path'], source)
+            if isinstance(observer, AdaptivePollingObserver):
+                self.observers.append(observer)
+            elif native_observer is None:
+                native_observer = observer
+                self.observers.append(observer)
+            else:
+                observer = native_observer
+            observer.schedule(DownloadEventHandler(self, source), source['path'], recursive=source['recursive'])
+            self.logger.info(f"Monitoring {source['name']} folder for new files: {source['path']}")
+        for observer in self.observers:
+            observer.start()
+
+        self.catch_up_thread = Thread(target=self.catch_up)
+        self.catch_up_thread.daemon = True
+        self.catch_up_thread.start()
+
+    def stop_source_observers(self):
+        if not self.watching:
+            return
+        for watch in self.shared_watches:
+            self.shared_observer.unschedule(watch)
+        self.shared_watches = []
+        for observer in self.observers:
+            observer.stop()
+        for observer in self.observers:
+            observer.join()
+        self.observers = []
+        # Only snapshot what was actually being watched, so files that
+        # arrive while paused are still picked up by the next catch-up
+        for source in self.sources:
+            self.save_snapshot(source)
+
     def start_monitoring(self):
-        self.observer = Observer()
-        self.observer.schedule(self.event_handler, self.config['downloads_folder'], recursive=False)
-        self.observer_thread = Thread(target=self.observer.start)
-        self.observer_thread.daemon = True
-        self.observer_thread.start()
-        self.logger.info(f"Monitoring Downloads folder for new files: {self.config['downloads_folder']}")
+        self.start_source_observers()
 
+        if self.shared_observer is not None:
+            self.config_watch = self.shared_observer.schedule(ConfigEventHandler(self), os.path.dirname(self.config_path),
+                                                              recursive=False)
+            self.logger.info(f"Monitoring configuration file for changes: {self.config_path}")
+            return
         self.config_observer = Observer()
         self.config_event_handler = ConfigEventHandler(self)
         self.config_observer.schedule(self.config_event_handler, os.path.dirname(self.config_path), recursive=False)
@@ -193,22 +818,51 @@ class FileOrganizer:
         self.logger.info(f"Monitoring configuration file for changes: {self.config_path}")
 
     def stop_monitoring(self):
-        if self.observer is not None:
-            self.observer.stop()
-            self.observer_thread.join()
+        self.stop_source_observers()
+        if self.config_watch is not None:
+            self.shared_observer.unschedule(self.config_watch)
+            self.config_watch = None
         if self.config_observer is not None:
             self.config_observer.stop()
             self.config_observer_thread.join()
+            self.config_observer = None
 
     def reload_config(self):
-        self.load_config()
-        self.create_folders()
+        # This runs on an observer thread, which the daemon shares between
+        # users, so no error may escape
+        try:
+            config = ConfigSnapshot.load(self.config_path)
+            if self.config_validator is not None:
+                self.config_validator(config)
+            # Before the swap, so a failure keeps the current config
+            self.add_pool_sources(config.sources)
+        except Exception as e:
+            self.logger.error(f"Failed to reload configuration, keeping the current one: {e}")
+            return
+        watched = lambda snapshot: [(source['path'], source['recursive'], source['observer'], source['polling'])
+                                    for source in snapshot.sources]
+        # Movers keep running throughout; only the observers are restarted,
+        # and only if the watched folders changed
+        restart = self.watching and watched(config) != watched(self.config)
+        if restart:
+            self.stop_source_observers()
+        self.config = config
+        try:
+            self.create_folders()
+        except OSError as e:
+            self.logger.error(f"Failed to create destination folders: {e}")
+        if restart:
+            try:
+                self.start_source_observers()
+            except OSError as e:
+                self.logger.error(f"Failed to watch the reconfigured folders: {e}")
         self.logger.info("Configuration reloaded.")
-        notification.notify(
-            title="Messy File Organizer",
-            message="Configuration reloaded successfully.",
-            timeout=10
-        )
+        if self.desktop:
+            notification.notify(
+                title="Messy File Organizer",
+                message="Configuration reloaded successfully.",
+                timeout=10
+            )
 
     def enable_autostart(self):
         if platform.system() == 'Windows':
@@ -329,10 +983,28 @@ class FileOrganizer:
         
         self.icon.menu = self.create_menu()
 
-    def stop(self, icon, item):
+    def close(self):
+        """Stop monitoring and release this organizer's threads, exporters and journal"""
+        self.shutdown_flag = True
         self.stop_monitoring()
+        if self.owns_mover_pool and self.throttle is not None:
+            # Wakes anything waiting for the throttle so it sees the shutdown
+            self.throttle.stop()
+        if self.owns_mover_pool:
+            self.mover_pool.stop()
+        self.stop_metrics_exporters()
+        if self.plugins is not None:
+            self.plugins.log_report()
+            self.plugins.close()
+        if self.trace is not None:
+            self.trace.close()
+            self.logger.info(f"Recorded {self.trace.events} watcher events to {self.trace.path}")
+        if self.journal is not None:
+            self.journal.close()
+
+    def stop(self, icon, item):
+        self.close()
         icon.stop()
-        self.shutdown_flag = True  # Signal the main loop to exit
 
 
 class ConfigEventHandler(FileSystemEventHandler):
@@ -341,16 +1013,21 @@ class ConfigEventHandler(FileSystemEventHandler):
 
     def on_modified(self, event):
         if event.src_path == self.organizer.config_path:
-            self.organizer.reload_config()
+            with self.organizer.identity:
+                self.organizer.reload_config()
 
 class DownloadEventHandler(FileSystemEventHandler):
-    def __init__(self, organizer):
+    def __init__(self, organizer, source):
         self.organizer = organizer
+        self.source = source
+
+    def on_any_event(self, event):
+        if self.organizer.trace is not None:
+            self.organizer.trace.record(self.source['name'], event)
 
     def on_created(self, event):
-        if not event.is_directory:
-            sleep(5)
-            self.organizer.move_file(event.src_path)
+        if not event.is_directory and not self.organizer.is_destination_path(event.src_path):
+            self.organizer.enqueue(self.source, event.src_path)
 
 def main(args=None):
     if args is None:
@@ -361,12 +1038,68 @@ def main(args=None):
                             help='Set the logging level')
         parser.add_argument('--log-to-file', action='store_true', help='Log to file instead of console')
         parser.add_argument('--paused', action='store_true', help='Start with monitoring paused')
+        parser.add_argument('--sweep', action='store_true', help='Organize files already in the downloads folder on startup')
+        parser.add_argument('--profile', action='store_true', help='Time each organizer stage and print a report on exit')
+        parser.add_argument('--profile-dump', metavar='FILE', help='Write a cProfile/pstats dump of the startup sweep to FILE')
+        parser.add_argument('--plan', metavar='FILE', help='Write the moves a sweep would make to FILE as JSON lines and exit')
+        parser.add_argument('--apply-plan', metavar='FILE', help='Execute a plan written by --plan and exit')
+        parser.add_argument('--dedupe', action='store_true', help='Replace duplicate files with hardlinks or reflinks and exit')
+        parser.add_argument('--undo-dedupe', action='store_true', help='Turn deduplicated files back into independent copies and exit')
+        parser.add_argument('--similar-images', action='store_true', help='List groups of visually similar images and exit')
+        parser.add_argument('--reshard', action='store_true', help='Move files in sharded category folders into their shard subfolders in the background')
+        parser.add_argument('--record-trace', metavar='FILE', help='Record every watcher event to FILE for replay with eventtrace.py')
         args = parser.parse_args()
 
     organizer = FileOrganizer(args)
+
+    # One-off commands release the journal, caches and threads before exiting
+    if getattr(args, 'plan', None):
+        try:
+            write_plan(organizer, args.plan)
+        finally:
+            organizer.close()
+        return organizer
+    if getattr(args, 'apply_plan', None):
+        try:
+            apply_plan(organizer, args.apply_plan)
+        finally:
+            organizer.close()
+        return organizer
+    if getattr(args, 'dedupe', False):
+        try:
+            organizer.deduplicate()
+        finally:
+            organizer.close()
+        return organizer
+    if getattr(args, 'undo_dedupe', False):
+        try:
+            organizer.undo_deduplicate()
+        finally:
+            organizer.close()
+        return organizer
+    if getattr(args, 'similar_images', False):
+        try:
+            organizer.find_similar_images()
+        finally:
+            organizer.close()
+        return organizer
+    if getattr(args, 'record_trace', None):
+        organizer.trace = EventRecorder(args.record_trace, organizer.sources, organizer.config.settle_delay)
+
+    if getattr(args, 'profile_dump', None):
+        profile_call(args.profile_dump, organizer.sweep)
+        organizer.logger.info(f"Sweep profile written to {args.profile_dump}")
+    elif getattr(args, 'sweep', False):
+        organizer.sweep()
+
+    if getattr(args, 'reshard', False):
+        # New downloads keep being organized while the folders are migrated
+        start_reshard(organizer)
     
     if not getattr(args, 'paused', False):
         organizer.start_monitoring()
+    else:
+        organizer.monitoring = False
         
     # Run in main thread if called directly
     if __name__ == "__main__":
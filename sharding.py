@@ -0,0 +1,118 @@
+import os
+import time
+import hashlib
+from threading import Thread
+from batch import BatchExecutor
+
+SHARD_SCHEMES = ("date", "hash")
+SHARD_DATE_SOURCES = ("mtime", "capture")
+
+
+class ShardLayout:
+    """Splits a category folder into subfolders so no single directory grows without bound
+
+    The "date" scheme files by the file's modification time, or with date
+    "capture" by its EXIF, PDF or video creation date where it has one,
+    using a strftime format (default "%Y/%m", e.g. Images/2026/10). The "hash"
+    scheme files by the first levels * width hex digits of the md5 of the
+    file name (e.g. Other/3f/a2), which spreads files evenly.
+    """
+
+    __slots__ = ("scheme", "format", "levels", "width", "date")
+
+    def __init__(self, scheme="date", format="%Y/%m", levels=1, width=2, date="mtime"):
+        if scheme not in SHARD_SCHEMES:
+            raise ValueError(f"Unknown sharding scheme {scheme!r}, expected one of {SHARD_SCHEMES}")
+        if date not in SHARD_DATE_SOURCES:
+            raise ValueError(f"Unknown sharding date {date!r}, expected one of {SHARD_DATE_SOURCES}")
+        levels, width = int(levels), int(width)
+        if scheme == "hash" and not (1 <= levels and 1 <= width and levels * width <= 32):
+            raise ValueError("Hash sharding needs levels >= 1, width >= 1 and levels * width <= 32")
+        if scheme == "date":
+            if not isinstance(format, str):
+                raise ValueError("The sharding format must be a string")
+            # Shards must stay inside the category folder
+            sample = time.strftime(format)
+            if (os.path.isabs(sample) or os.path.splitdrive(sample)[0]
+                    or os.pardir in sample.replace("\\", "/").split("/")):
+                raise ValueError(f"Sharding format {format!r} must be a relative path without '..'")
+        self.scheme = scheme
+        self.format = format
+        self.levels = levels
+        self.width = width
+        self.date = date
+
+    @classmethod
+    def from_config(cls, spec):
+        """Build a layout from a config value: a scheme name or a dict of options"""
+        if isinstance(spec, str):
+            return cls(spec)
+        return cls(spec.get('scheme', 'date'), spec.get('format', '%Y/%m'), spec.get('levels', 1), spec.get('width', 2),
+                   spec.get('date', 'mtime'))
+
+    @property
+    def needs_metadata(self):
+        return self.scheme == "date" and self.date == "capture"
+
+    def subfolder(self, name, stat, metadata=None):
+        """Return the shard subfolder, relative to the category folder, for a file"""
+        if self.scheme == "date":
+            captured = metadata.get('date') if metadata else None
+            if captured is not None:
+                return os.path.normpath(captured.strftime(self.format))
+            return os.path.normpath(time.strftime(self.format, time.localtime(stat.st_mtime)))
+        digest = hashlib.md5(name.encode('utf-8', 'surrogateescape')).hexdigest()
+        return os.path.join(*(digest[level * self.width:(level + 1) * self.width] for level in range(self.levels)))
+
+    def folder(self, destination, name, stat, metadata=None):
+        return os.path.join(destination, self.subfolder(name, stat, metadata))
+
+
+def reshard(organizer, categories=None):
+    """Move files lying directly in sharded category folders into their shard subfolders
+
+    Only files at the top level of a category folder are moved, so existing
+    shards and any subfolders the user made are left alone. Returns the
+    number of files moved.
+    """
+    executor = BatchExecutor(organizer)
+    seen = set()
+    for source in organizer.sources:
+        for category in source['sharding']:
+            destination = source['folders'].get(category)
+            if destination is None or destination in seen or (categories and category not in categories):
+                continue
+            seen.add(destination)
+            queued = 0
+            try:
+                with os.scandir(destination) as entries:
+                    for entry in entries:
+                        if organizer.shutdown_flag:
+                            break
+                        if not entry.is_file(follow_symlinks=False):
+                            continue
+                        try:
+                            stat = entry.stat()
+                        except OSError as e:
+                            organizer.logger.warning(f"Failed to stat {entry.path}: {e}. Skipping.")
+                            continue
+                        executor.add(entry.path, organizer.shard_folder(source, category, destination, entry.path, stat),
+                                     category, stat=stat)
+                        queued += 1
+            except OSError as e:
+                organizer.logger.error(f"Failed to scan {destination} for resharding: {e}")
+            organizer.logger.info(f"Resharding {queued} files in {destination}")
+    executor.run()
+    organizer.logger.info(f"Resharding moved {executor.moved} files")
+    return executor.moved
+
+
+def start_reshard(organizer, categories=None):
+    """Run reshard() in a background thread and return the thread
+
+    This is how --reshard migrates existing folders while the organizer
+    keeps watching; the thread stops early once the organizer shuts down.
+    """
+    thread = Thread(target=reshard, args=(organizer, categories), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,115 @@
+import os
+import json
+from collections import defaultdict
+
+# On Windows scandir already carries the mtime, while on POSIX only the
+# inode comes for free, so each platform compares what it gets without
+# an extra stat call per entry.
+_COMPARE_MTIME = os.name == 'nt'
+
+
+def _entry_key(entry):
+    if _COMPARE_MTIME:
+        return [entry.inode(), entry.stat().st_mtime_ns]
+    return [entry.inode(), 0]
+
+
+class DirectorySnapshot:
+    """Compact record of the files under a folder (relative path -> [inode, mtime_ns])
+
+    A recursive snapshot also keeps the mtime of every subfolder
+    (relative path -> mtime_ns), so catching up lists only the folders
+    whose contents changed.
+    """
+
+    def __init__(self, folder, folder_mtime_ns=0, entries=None, folders=None, recursive=False):
+        self.folder = folder
+        self.folder_mtime_ns = folder_mtime_ns
+        self.entries = entries or {}
+        self.folders = folders or {}
+        self.recursive = recursive
+
+    @classmethod
+    def capture(cls, folder, recursive=False, skip=None):
+        """Record the files in folder, and in its subfolders if recursive
+
+        skip(path) returns True for subfolders to leave out, such as category
+        folders inside the source.
+        """
+        snapshot = cls(folder, os.stat(folder).st_mtime_ns, recursive=recursive)
+        pending = [""]
+        while pending:
+            relative = pending.pop()
+            try:
+                with os.scandir(os.path.join(folder, relative)) as scan:
+                    for entry in scan:
+                        name = os.path.join(relative, entry.name) if relative else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if recursive and not (skip and skip(entry.path)):
+                                # Read before the subfolder is listed, so a file
+                                # added in between changes it again
+                                snapshot.folders[name] = entry.stat(follow_symlinks=False).st_mtime_ns
+                                pending.append(name)
+                        elif entry.is_file():
+                            snapshot.entries[name] = _entry_key(entry)
+            except OSError:
+                if not relative:
+                    raise
+                # Leave it out so the next catch-up lists it in full
+                snapshot.folders.pop(relative, None)
+        return snapshot
+
+    @classmethod
+    def load(cls, path):
+        """Load a snapshot saved by save(), or return None if there is none"""
+        try:
+            with open(path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return cls(data["folder"], data.get("folder_mtime_ns", 0), data.get("entries", {}),
+                   data.get("folders", {}), data.get("recursive", False))
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({
+                "folder": self.folder,
+                "folder_mtime_ns": self.folder_mtime_ns,
+                "recursive": self.recursive,
+                "entries": self.entries,
+                "folders": self.folders,
+            }, file, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+    def changed_entries(self, skip=None):
+        """Yield the os.DirEntry of every file that is new or changed since this snapshot
+
+        Adding, removing or renaming a file updates its folder's mtime, so a
+        folder whose mtime is unchanged is not listed at all; for recursive
+        snapshots only its recorded subfolders are checked in turn. Folders
+        that are new since the snapshot are listed in full.
+        """
+        children = defaultdict(list)
+        for name, mtime_ns in self.folders.items():
+            children[os.path.dirname(name)].append((name, mtime_ns))
+        pending = [("", self.folder_mtime_ns)]
+        while pending:
+            relative, recorded = pending.pop()
+            path = os.path.join(self.folder, relative)
+            try:
+                if os.stat(path).st_mtime_ns == recorded:
+                    pending.extend(children.get(relative, ()))
+                    continue
+                with os.scandir(path) as scan:
+                    for entry in scan:
+                        name = os.path.join(relative, entry.name) if relative else entry.name
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive and not (skip and skip(entry.path)):
+                                pending.append((name, self.folders.get(name)))
+                        elif entry.is_file():
+                            previous = self.entries.get(name)
+                            if previous is None or previous != _entry_key(entry):
+                                yield entry
+            except OSError:
+                continue
@@ -0,0 +1,259 @@
+import os
+import math
+import threading
+from time import monotonic
+
+# Throttle states, from most to least work allowed
+THROTTLE_STATES = ("full", "reduced", "paused")
+DEFAULT_THROTTLE_INTERVAL = 5.0
+POWER_SUPPLY_DIR = "/sys/class/power_supply"
+IO_PRESSURE_PATH = "/proc/pressure/io"
+
+
+def load_per_cpu():
+    """1-minute load average divided by the number of CPUs, or None where there is no load average"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+
+def io_pressure(path=IO_PRESSURE_PATH):
+    """Share of the last 10 seconds (0-100) in which some task waited for I/O, or None without PSI"""
+    try:
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                if fields and fields[0] == "some":
+                    for field in fields[1:]:
+                        key, _, value = field.partition("=")
+                        if key == "avg10":
+                            return float(value)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _read(path):
+    try:
+        with open(path) as file:
+            return file.read().strip()
+    except OSError:
+        return None
+
+
+def power_state(directory=POWER_SUPPLY_DIR):
+    """Return (on_battery, battery_percent); (False, None) on machines without a battery
+
+    A machine is on battery when a battery is discharging and no mains or
+    USB supply is online.
+    """
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return False, None
+    discharging = mains_online = False
+    capacities = []
+    for name in names:
+        path = os.path.join(directory, name)
+        supply_type = _read(os.path.join(path, "type"))
+        if supply_type == "Battery":
+            if _read(os.path.join(path, "scope")) == "Device":
+                # Mice, keyboards and other peripherals
+                continue
+            if _read(os.path.join(path, "status")) == "Discharging":
+                discharging = True
+            capacity = _read(os.path.join(path, "capacity"))
+            if capacity and capacity.isdigit():
+                capacities.append(int(capacity))
+        elif supply_type in ("Mains", "USB", "USB_C", "USB_PD") and _read(os.path.join(path, "online")) == "1":
+            mains_online = True
+    return discharging and not mains_online, (min(capacities) if capacities else None)
+
+
+class LoadSample:
+    __slots__ = ("load", "io_pressure", "on_battery", "battery")
+
+    def __init__(self, load, io_pressure, on_battery, battery):
+        self.load = load
+        self.io_pressure = io_pressure
+        self.on_battery = on_battery
+        self.battery = battery
+
+    @classmethod
+    def read(cls):
+        on_battery, battery = power_state()
+        return cls(load_per_cpu(), io_pressure(), on_battery, battery)
+
+
+class ThrottlePolicy:
+    """Thresholds that decide how much background work the machine can take
+
+    load is the 1-minute load average per CPU, io_pressure the PSI "some"
+    10-second average in percent. Above the "reduce" thresholds workers and
+    hashing run at reduced_share of their configured concurrency; above the
+    "pause" thresholds they stop. on_battery is "reduce", "pause" or
+    "ignore", and below pause_battery_below percent work pauses on battery.
+    """
+
+    def __init__(self, reduce_load=0.8, pause_load=1.5, reduce_io_pressure=20.0, pause_io_pressure=60.0,
+                 on_battery="reduce", pause_battery_below=20, reduced_share=0.5, recover_after=30.0):
+        if on_battery not in ("reduce", "pause", "ignore"):
+            raise ValueError(f"on_battery must be reduce, pause or ignore, not {on_battery!r}")
+        self.reduce_load = float(reduce_load)
+        self.pause_load = float(pause_load)
+        self.reduce_io_pressure = float(reduce_io_pressure)
+        self.pause_io_pressure = float(pause_io_pressure)
+        self.on_battery = on_battery
+        self.pause_battery_below = pause_battery_below
+        self.reduced_share = min(1.0, max(0.0, float(reduced_share)))
+        self.recover_after = float(recover_after)
+
+    @classmethod
+    def from_config(cls, options):
+        keys = ("reduce_load", "pause_load", "reduce_io_pressure", "pause_io_pressure", "on_battery",
+                "pause_battery_below", "reduced_share", "recover_after")
+        return cls(**{key: options[key] for key in keys if key in options})
+
+    def state_for(self, sample):
+        """Return the state sample calls for, and the reason, e.g. ("paused", "load 1.7")"""
+        if sample.on_battery and self.on_battery != "ignore":
+            if self.on_battery == "pause" or (sample.battery is not None and self.pause_battery_below is not None
+                                              and sample.battery < self.pause_battery_below):
+                return "paused", f"on battery ({sample.battery}%)" if sample.battery is not None else "on battery"
+        if sample.load is not None and sample.load >= self.pause_load:
+            return "paused", f"load {sample.load:.2f} per CPU"
+        if sample.io_pressure is not None and sample.io_pressure >= self.pause_io_pressure:
+            return "paused", f"I/O pressure {sample.io_pressure:.0f}%"
+        if sample.on_battery and self.on_battery == "reduce":
+            return "reduced", "on battery"
+        if sample.load is not None and sample.load >= self.reduce_load:
+            return "reduced", f"load {sample.load:.2f} per CPU"
+        if sample.io_pressure is not None and sample.io_pressure >= self.reduce_io_pressure:
+            return "reduced", f"I/O pressure {sample.io_pressure:.0f}%"
+        return "full", "idle"
+
+
+class Throttle:
+    """Samples system load in the background and scales background work to it
+
+    Work is throttled as soon as a sample calls for it, but only ramps back
+    up one state at a time after the machine has stayed calmer for the
+    policy's recover_after seconds, so a short lull doesn't start a burst
+    of copies. Listeners are called with the new state on every change.
+    """
+
+    def __init__(self, policy=None, interval=DEFAULT_THROTTLE_INTERVAL, logger=None, metrics=None, sampler=None):
+        self.policy = policy or ThrottlePolicy()
+        self.interval = interval
+        self.logger = logger
+        self.metrics = metrics
+        self.sampler = sampler or LoadSample.read
+        self.state = "full"
+        self.reason = "idle"
+        self.sample = None
+        self._calm_since = None
+        self._listeners = []
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._publish()
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def share(self):
+        """Fraction of the configured concurrency allowed now"""
+        return {"full": 1.0, "reduced": self.policy.reduced_share, "paused": 0.0}[self.state]
+
+    def limit(self, workers):
+        """How many of workers may run now: at least one unless paused"""
+        share = self.share()
+        if share <= 0:
+            return 0
+        return max(1, min(workers, math.ceil(workers * share)))
+
+    def wait(self, timeout=None):
+        """Block while paused; return False if still paused after timeout or when stopped"""
+        with self._condition:
+            return self._condition.wait_for(lambda: self.state != "paused" or self._stop_event.is_set(),
+                                            timeout) and self.state != "paused"
+
+    def update(self, sample=None, now=None):
+        """Take one sample and apply the policy; return the current state"""
+        sample = sample or self.sampler()
+        now = monotonic() if now is None else now
+        target, reason = self.policy.state_for(sample)
+        current = THROTTLE_STATES.index(self.state)
+        wanted = THROTTLE_STATES.index(target)
+        new_state = self.state
+        if wanted > current:
+            new_state = target
+            self._calm_since = None
+        elif wanted < current:
+            if self._calm_since is None:
+                self._calm_since = now
+            if now - self._calm_since >= self.policy.recover_after:
+                new_state = THROTTLE_STATES[current - 1]
+                self._calm_since = now
+        else:
+            self._calm_since = None
+        self.sample = sample
+        if new_state != self.state:
+            with self._condition:
+                self.state = new_state
+                self.reason = reason
+                self._condition.notify_all()
+            if self.logger:
+                self.logger.info(f"Background work {new_state}: {reason}")
+            if self.metrics is not None:
+                self.metrics.throttle_changes.labels(new_state).inc()
+            for listener in self._listeners:
+                try:
+                    listener(new_state)
+                except Exception as e:
+                    if self.logger:
+                        self.logger.error(f"Throttle listener failed: {e}")
+        self._publish()
+        return self.state
+
+    def _publish(self):
+        if self.metrics is None:
+            return
+        for state in THROTTLE_STATES:
+            self.metrics.throttle_state.labels(state).set(1 if state == self.state else 0)
+        self.metrics.throttle_share.set(self.share())
+        sample = self.sample
+        if sample is not None:
+            for signal, value in (("load_per_cpu", sample.load), ("io_pressure", sample.io_pressure),
+                                  ("battery_percent", sample.battery)):
+                if value is not None:
+                    self.metrics.system_load.labels(signal).set(value)
+            self.metrics.system_load.labels("on_battery").set(1 if sample.on_battery else 0)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.update()
+            except Exception as e:
+                if self.logger:
+                    self.logger.error(f"Failed to sample system load: {e}")
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        # Take the first sample right away so work started now is already throttled
+        try:
+            self.update()
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Failed to sample system load: {e}")
+        self._thread = threading.Thread(target=self._run, name="throttle", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None